@@ -0,0 +1,169 @@
+"""
+回答缓存模块 - 对重复问题直接返回已生成的回答，减少上游 LLM 调用
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# 回答缓存配置
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "True").lower() == "true"
+ANSWER_CACHE_BACKEND = os.getenv("ANSWER_CACHE_BACKEND", "memory")  # memory | redis
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "3600"))  # 秒
+ANSWER_CACHE_MAX_SIZE = int(os.getenv("ANSWER_CACHE_MAX_SIZE", "10000"))
+ANSWER_CACHE_WITH_CONTEXT = os.getenv("ANSWER_CACHE_WITH_CONTEXT", "False").lower() == "true"  # 默认只缓存无历史的首轮问题
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+CACHE_REPLAY_CHUNK_SIZE = int(os.getenv("CACHE_REPLAY_CHUNK_SIZE", "20"))  # 命中缓存时每个SSE分片的字符数
+
+# 归一化时去除的结尾标点
+_TRAILING_PUNCTUATION = "?？!！.。,，~～;；:："
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(text: str) -> str:
+    """归一化问题文本：全半角统一、小写、合并空白、去除结尾标点"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = _WHITESPACE.sub(" ", text).strip()
+    return text.rstrip(_TRAILING_PUNCTUATION).strip()
+
+
+async def replay_chunks(text: str, size: int = CACHE_REPLAY_CHUNK_SIZE):
+    """将缓存的回答切分为固定长度的片段，按流式接口的格式回放"""
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+class MemoryCacheBackend:
+    """进程内 LRU 缓存，带过期时间"""
+
+    def __init__(self, max_size: int = 10000, ttl: int = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: str):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    async def close(self):
+        self._data.clear()
+
+
+class RedisCacheBackend:
+    """Redis 协议缓存，多进程/多实例共享；可传入任意兼容 redis.asyncio 接口的客户端"""
+
+    def __init__(self, client=None, url: str = REDIS_URL, ttl: int = 3600, prefix: str = "answer_cache:"):
+        if client is None:
+            import redis.asyncio as redis
+            client = redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.client.get(self.prefix + key)
+
+    async def set(self, key: str, value: str):
+        await self.client.set(self.prefix + key, value, ex=self.ttl)
+
+    async def close(self):
+        await self.client.close()
+
+
+class AnswerCache:
+    """回答缓存，键为归一化问题文本 + 对话上下文指纹"""
+
+    def __init__(self, backend=None, with_context: bool = False):
+        self.backend = backend  # 为 None 时缓存关闭
+        self.with_context = with_context
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.latency_saved = 0.0  # 命中时省去的生成耗时（秒）
+
+    def make_key(self, question: str, context: str = "") -> Optional[str]:
+        """生成缓存键；不可缓存（如带历史上下文且未开启上下文缓存）时返回 None"""
+        if self.backend is None or (context and not self.with_context):
+            return None
+        digest = hashlib.sha256()
+        digest.update(normalize_question(question).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(context.encode("utf-8"))
+        return digest.hexdigest()
+
+    async def get(self, key: Optional[str]) -> Optional[str]:
+        if key is None:
+            return None
+        try:
+            raw = await self.backend.get(key)
+        except Exception as e:
+            # 缓存故障不影响正常问答
+            self.errors += 1
+            logger.warning("读取回答缓存失败: %s", e)
+            return None
+        if raw is None:
+            self.misses += 1
+            return None
+        entry = json.loads(raw)
+        self.hits += 1
+        self.latency_saved += entry.get("latency", 0.0)
+        return entry["answer"]
+
+    async def set(self, key: Optional[str], answer: str, latency: float = 0.0):
+        if key is None or not answer:
+            return
+        try:
+            await self.backend.set(key, json.dumps({"answer": answer, "latency": latency}, ensure_ascii=False))
+        except Exception as e:
+            self.errors += 1
+            logger.warning("写入回答缓存失败: %s", e)
+
+    async def close(self):
+        if self.backend is not None:
+            await self.backend.close()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.backend is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "latency_saved_seconds": round(self.latency_saved, 3)
+        }
+
+
+def create_answer_cache() -> AnswerCache:
+    """根据配置创建回答缓存"""
+    if not ANSWER_CACHE_ENABLED:
+        return AnswerCache()
+    if ANSWER_CACHE_BACKEND == "redis":
+        backend = RedisCacheBackend(url=REDIS_URL, ttl=ANSWER_CACHE_TTL)
+    else:
+        backend = MemoryCacheBackend(max_size=ANSWER_CACHE_MAX_SIZE, ttl=ANSWER_CACHE_TTL)
+    logger.info("回答缓存已启用 - 后端: %s - TTL: %ss", ANSWER_CACHE_BACKEND, ANSWER_CACHE_TTL)
+    return AnswerCache(backend, with_context=ANSWER_CACHE_WITH_CONTEXT)
+
+
+answer_cache = create_answer_cache()
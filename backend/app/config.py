@@ -0,0 +1,20 @@
+"""
+配置模块 - 进程内只加载一次 .env 文件
+
+各模块在导入时用 os.getenv 读取自己的配置，入口（main.py、database.py、start.py）需先导入本模块；
+已存在的环境变量（容器配置、启动脚本写入的值）优先于 .env 中的同名项；
+启动脚本与生产模式 worker 共用的服务进程配置也在此定义
+"""
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 事件循环与 HTTP 解析实现：auto 时已安装 uvloop/httptools 则使用，否则回退到 asyncio/h11
+UVICORN_LOOP = os.getenv("UVICORN_LOOP", "auto")
+UVICORN_HTTP = os.getenv("UVICORN_HTTP", "auto")
+# 收到 SIGTERM 后等待进行中的请求（含 SSE 流）完成的时间（秒），超时后强制关闭连接
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+# 关闭时等待后台生成任务完成的时间（秒），超时后取消并保存部分回答
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "10"))
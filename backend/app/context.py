@@ -0,0 +1,208 @@
+"""
+对话上下文模块 - 按 token 预算维护每个会话的增量滚动窗口
+
+窗口常驻进程内存，每轮只追加新问答并淘汰最早的轮次，无需重新查询历史；
+被淘汰的轮次压缩进会话的摘要（Session.context_summary），长会话的提示词大小保持恒定。
+"""
+import os
+import re
+import logging
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Session
+from .queries import get_recent_rounds
+
+logger = logging.getLogger(__name__)
+
+# 上下文配置
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "8000"))  # 历史对话的 token 预算
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "500"))  # 摘要的 token 预算
+CONTEXT_CACHE_MAX_SESSIONS = int(os.getenv("CONTEXT_CACHE_MAX_SESSIONS", "10000"))
+CONTEXT_SUMMARY_SNIPPET = 60  # 摘要中每条问答保留的字符数
+
+# 本地分词：CJK 字符各计 1 个 token，英文单词/数字约每 4 个字符计 1 个，其余符号各计 1 个
+_TOKEN_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uf900-\ufaff]|[A-Za-z]+|\d+|\S")
+
+
+def count_tokens(text: str) -> int:
+    """估算文本的 token 数"""
+    tokens = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        piece = match.group()
+        if len(piece) > 1:
+            tokens += (len(piece) + 3) // 4
+        else:
+            tokens += 1
+    return tokens
+
+
+def _summarize_turn(question: str, answer: str) -> str:
+    """将一轮问答压缩为一行摘要（合并换行，便于按行存储）"""
+    question = " ".join(question.split())[:CONTEXT_SUMMARY_SNIPPET]
+    answer = " ".join(answer.split())[:CONTEXT_SUMMARY_SNIPPET]
+    return f"用户问：{question}；助手答：{answer}"
+
+
+async def save_summary(db: AsyncSession, session_id: int, summary: str):
+    """在当前事务中写入会话摘要（由调用方提交），不改变会话的 update_time"""
+    await db.execute(
+        update(Session)
+        .where(Session.id == session_id)
+        .values(context_summary=summary, update_time=Session.update_time)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def load_summary(db: AsyncSession, session_id: int) -> Optional[str]:
+    """读取会话摘要"""
+    return (await db.execute(select(Session.context_summary).where(Session.id == session_id))).scalar_one_or_none()
+
+
+class ContextWindow:
+    """单个会话的滚动窗口：最近若干轮完整问答 + 更早轮次的摘要"""
+
+    def __init__(self, max_tokens: int, summary_max_tokens: int, summary: Optional[str] = None,
+                 user_id: Optional[int] = None):
+        self.user_id = user_id
+        self.max_tokens = max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.turns: Deque[Tuple[str, str, int]] = deque()
+        self.total_tokens = 0
+        self.summary_lines: Deque[Tuple[str, int]] = deque(
+            (line, count_tokens(line)) for line in (summary or "").splitlines() if line
+        )
+        self.summary_tokens = sum(tokens for _, tokens in self.summary_lines)
+        self.synced_count = 0  # 与 Session.question_count 对齐，用于检测其他进程写入的新轮次
+        self.history_version = 0  # 与 Session.history_version 对齐，用于检测清空历史等批外变更
+
+    @property
+    def summary(self) -> str:
+        return "\n".join(line for line, _ in self.summary_lines)
+
+    def append(self, question: str, answer: str, summarize: bool = True) -> bool:
+        """
+        追加一轮问答并淘汰超出预算的最早轮次；摘要发生变化时返回 True。
+        summarize=False 用于从数据库重建窗口：被淘汰的轮次已包含在已存储的摘要中。
+        """
+        tokens = count_tokens(f"用户：{question}") + count_tokens(f"助手：{answer}")
+        self.turns.append((question, answer, tokens))
+        self.total_tokens += tokens
+
+        summary_changed = False
+        # 至少保留最新一轮
+        while self.total_tokens > self.max_tokens and len(self.turns) > 1:
+            old_question, old_answer, tokens = self.turns.popleft()
+            self.total_tokens -= tokens
+            if summarize:
+                self._add_summary(_summarize_turn(old_question, old_answer))
+                summary_changed = True
+        return summary_changed
+
+    def _add_summary(self, line: str):
+        tokens = count_tokens(line)
+        self.summary_lines.append((line, tokens))
+        self.summary_tokens += tokens
+        while self.summary_tokens > self.summary_max_tokens and len(self.summary_lines) > 1:
+            _, dropped = self.summary_lines.popleft()
+            self.summary_tokens -= dropped
+
+    def render(self) -> str:
+        """生成写入提示词的历史对话文本"""
+        parts: List[str] = []
+        if self.summary_lines:
+            parts.append("较早对话摘要：")
+            parts.extend(line for line, _ in self.summary_lines)
+            parts.append("最近对话：")
+        for question, answer, _ in self.turns:
+            parts.append(f"用户：{question}")
+            parts.append(f"助手：{answer}")
+        return "\n".join(parts) if self.turns or self.summary_lines else ""
+
+
+class ContextStore:
+    """进程内的会话窗口缓存（LRU）"""
+
+    def __init__(self, max_sessions: int, max_tokens: int, summary_max_tokens: int):
+        self.max_sessions = max_sessions
+        self.max_tokens = max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self._windows: "OrderedDict[int, ContextWindow]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get_window(self, db: AsyncSession, session: Session, question_count: int) -> ContextWindow:
+        """
+        获取会话窗口。question_count 为本轮问题写入前会话的问题数量；
+        问题数量或历史版本与窗口记录不一致（进程重启、其他 worker 写入、回答失败、清空历史等）时从数据库重建。
+        """
+        history_version = session.history_version or 0
+        window = self._windows.get(session.id)
+        if window is not None and window.synced_count == question_count and window.history_version == history_version:
+            self._windows.move_to_end(session.id)
+            self.hits += 1
+            return window
+
+        self.misses += 1
+        # 来自会话缓存的条目不含摘要，重建窗口时从数据库读取
+        summary = session.context_summary if isinstance(session, Session) else await load_summary(db, session.id)
+        window = ContextWindow(self.max_tokens, self.summary_max_tokens, summary, session.user_id)
+        if question_count:
+            for question in await get_recent_rounds(db, session.user_id, session.id):
+                if question.answer:
+                    window.append(question.question, question.answer.answer, summarize=False)
+        window.synced_count = question_count
+        window.history_version = history_version
+        self._windows[session.id] = window
+        self._windows.move_to_end(session.id)
+        while len(self._windows) > self.max_sessions:
+            self._windows.popitem(last=False)
+        return window
+
+    def synced_count(self, session_id: int, history_version: int) -> Optional[int]:
+        """内存中窗口对应的会话问题数量；没有窗口或窗口的历史版本已过期时返回 None"""
+        window = self._windows.get(session_id)
+        if window is None or window.history_version != history_version:
+            return None
+        return window.synced_count
+
+    def advance(self, session_id: int, question: str, answer: str) -> Optional[str]:
+        """在内存窗口中追加一轮问答；窗口淘汰出新的摘要时返回新摘要，由调用方负责持久化"""
+        window = self._windows.get(session_id)
+        if window is None:
+            return None
+        window.synced_count += 1
+        if window.append(question, answer):
+            return window.summary
+        return None
+
+    async def append(self, db: AsyncSession, session_id: int, question: str, answer: str):
+        """
+        在当前事务中追加一轮问答（由调用方提交）；窗口淘汰出新的摘要时一并写入 Session.context_summary
+        """
+        summary = self.advance(session_id, question, answer)
+        if summary is not None:
+            await save_summary(db, session_id, summary)
+
+    def invalidate(self, session_id: int):
+        self._windows.pop(session_id, None)
+
+    def invalidate_user(self, user_id: int):
+        """丢弃用户所有会话的窗口（清空历史后调用）"""
+        for session_id in [session_id for session_id, window in self._windows.items() if window.user_id == user_id]:
+            del self._windows[session_id]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "sessions": len(self._windows),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+context_store = ContextStore(CONTEXT_CACHE_MAX_SESSIONS, CONTEXT_MAX_TOKENS, CONTEXT_SUMMARY_MAX_TOKENS)
@@ -1,44 +1,71 @@
-from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import QueuePool
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
-from dotenv import load_dotenv
+import time
 
-load_dotenv()
+from . import config  # 先加载 .env，之后导入的模块读取环境变量时可见
+from .metrics import DB_POOL_WAIT, instrument_engine
 
 # 数据库连接配置 - 从环境变量读取
 DATABASE_URL = os.getenv(
-    "DATABASE_URL", 
+    "DATABASE_URL",
     "sqlite:///./chatbot.db"  # 默认使用SQLite作为fallback
 )
 
+# 同步驱动到异步驱动的映射（兼容现有的 DATABASE_URL 配置）
+ASYNC_DRIVERS = {
+    "mysql+pymysql://": "mysql+aiomysql://",
+    "mysql://": "mysql+aiomysql://",
+    "sqlite:///": "sqlite+aiosqlite:///",
+}
+
+def to_async_url(url: str) -> str:
+    """将同步数据库URL转换为对应的异步驱动URL"""
+    for sync_prefix, async_prefix in ASYNC_DRIVERS.items():
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+ASYNC_DATABASE_URL = to_async_url(DATABASE_URL)
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """记录每次取连接的等待时间（池满时的排队 + 新建连接）"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - started)
+
 # 根据数据库类型配置不同的参数
-if DATABASE_URL.startswith("mysql"):
-    engine = create_engine(
-        DATABASE_URL,
-        poolclass=QueuePool,
-        pool_size=10,
-        max_overflow=20,
+if ASYNC_DATABASE_URL.startswith("mysql"):
+    engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        poolclass=TimedQueuePool,
+        pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
         pool_pre_ping=True,
         pool_recycle=3600,
         connect_args={"charset": "utf8mb4"}
     )
 else:
     # SQLite配置
-    engine = create_engine(
-        DATABASE_URL,
+    engine = create_async_engine(
+        ASYNC_DATABASE_URL,
         connect_args={"check_same_thread": False}
     )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# SQL 执行计时（按请求汇总语句数和耗时）
+instrument_engine(engine.sync_engine)
+
+# expire_on_commit=False：提交后仍可访问已加载的属性，避免在异步上下文中触发隐式IO
+SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
 # 获取数据库会话
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
\ No newline at end of file
@@ -0,0 +1,193 @@
+"""
+LLM 客户端模块 - 进程内共享的 DeepSeek 客户端及其 HTTP 连接池
+
+openai/langchain 的导入耗时约 1 秒，不在导入本模块时加载：应用启动后在后台线程预先导入，
+首次使用客户端时创建（预热尚未完成时在首次调用中导入）
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Optional
+
+from .context import count_tokens
+from .metrics import LLM_CALL_DURATION, LLM_TIME_TO_FIRST_TOKEN, LLM_TOKENS_PER_SECOND
+
+if TYPE_CHECKING:
+    import httpx
+    from langchain_openai import ChatOpenAI
+
+logger = logging.getLogger(__name__)
+
+# LLM 连接配置
+LLM_MODEL = os.getenv("LLM_MODEL", "deepseek-reasoner")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "True").lower() == "true"
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))  # 全局同时进行的上游调用上限
+
+_http_client: Optional["httpx.AsyncClient"] = None
+_llm: Optional["ChatOpenAI"] = None
+
+
+class LLMConcurrencyLimiter:
+    """上游 LLM 调用的全局并发限制器，流式与非流式接口共用，并统计排队深度"""
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        # 在事件循环中首次使用时创建：Python 3.9 的同步原语在创建时绑定当前事件循环，
+        # 预加载应用后 fork 出的 worker 运行在新的事件循环中
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.active = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.total_calls = 0
+
+    async def __aenter__(self):
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        self.total_calls += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.active -= 1
+        self._semaphore.release()
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "total_calls": self.total_calls
+        }
+
+
+llm_limiter = LLMConcurrencyLimiter(LLM_MAX_CONCURRENCY)
+
+
+def load_llm_modules():
+    """导入 LLM 客户端依赖（可在线程中执行，重复调用无开销）"""
+    import httpx
+    import openai
+    import langchain_openai
+    import langchain_core.messages
+
+
+async def warm_up_llm():
+    """应用启动后在后台线程导入依赖并创建客户端，不阻塞启动"""
+    try:
+        await asyncio.to_thread(load_llm_modules)
+    except Exception as e:
+        logger.error("预加载 LLM 依赖失败: %s", e)
+        return
+    if _llm is None:
+        init_llm()
+
+
+def build_messages(prompt: str) -> list:
+    """构造单轮对话的消息列表"""
+    from langchain_core.messages import HumanMessage
+    return [HumanMessage(content=prompt)]
+
+
+def _limits() -> "httpx.Limits":
+    import httpx
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+    )
+
+
+def init_llm():
+    """创建共享的 LLM 客户端（启动预热或首次使用时调用一次）"""
+    global _http_client, _llm
+    import httpx
+    import openai
+    from langchain_openai import ChatOpenAI
+
+    api_key = os.getenv("DEEPSEEK_API_KEY")
+    if not api_key:
+        logger.error("未配置 DEEPSEEK_API_KEY，AI服务不可用")
+        return
+
+    base_url = os.getenv("DEEPSEEK_API_BASE")
+    _http_client = httpx.AsyncClient(http2=LLM_HTTP2, limits=_limits(), timeout=httpx.Timeout(LLM_TIMEOUT))
+
+    # 显式传入异步 OpenAI 客户端，禁用其内部重试，由调用方控制重试策略；
+    # 所有调用均走 ainvoke/astream，同步客户端不会被使用
+    client_params = {
+        "api_key": api_key,
+        "base_url": base_url,
+        "timeout": LLM_TIMEOUT,
+        "max_retries": 0,
+    }
+    _llm = ChatOpenAI(
+        model=LLM_MODEL,
+        openai_api_key=api_key,
+        openai_api_base=base_url,
+        timeout=LLM_TIMEOUT,
+        max_retries=0,
+        async_client=openai.AsyncOpenAI(http_client=_http_client, **client_params).chat.completions
+    )
+    logger.info(
+        "LLM客户端已创建 - 模型: %s - HTTP/2: %s - 最大连接数: %s",
+        LLM_MODEL, LLM_HTTP2, LLM_MAX_CONNECTIONS
+    )
+
+
+async def close_llm():
+    """关闭共享的 HTTP 连接池（在应用关闭时调用）"""
+    global _http_client, _llm
+
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client = None
+    _llm = None
+
+
+def get_llm() -> "ChatOpenAI":
+    """获取共享的 LLM 客户端，尚未创建时立即创建"""
+    if _llm is None:
+        init_llm()
+    if _llm is None:
+        raise RuntimeError("LLM客户端未初始化")
+    return _llm
+
+
+async def stream_answer(prompt: str):
+    """在全局并发限制下流式调用LLM，逐段产出回答文本"""
+    llm = get_llm()
+    async with llm_limiter:
+        started = time.perf_counter()
+        first_token_at = None
+        tokens = 0
+        outcome = "error"
+        try:
+            async for chunk in llm.astream(build_messages(prompt)):
+                if chunk.content:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        LLM_TIME_TO_FIRST_TOKEN.observe(first_token_at - started)
+                    tokens += count_tokens(chunk.content)
+                    yield chunk.content
+            outcome = "success"
+        except (asyncio.CancelledError, GeneratorExit):
+            outcome = "cancelled"
+            raise
+        finally:
+            finished = time.perf_counter()
+            LLM_CALL_DURATION.labels("stream", outcome).observe(finished - started)
+            if outcome == "success" and first_token_at is not None and finished > first_token_at:
+                LLM_TOKENS_PER_SECOND.observe(tokens / (finished - first_token_at))
@@ -0,0 +1,121 @@
+"""
+日志模块 - 基于队列的非阻塞日志：事件循环只把日志记录放入队列，格式化和磁盘写入在后台线程完成
+"""
+import os
+import sys
+import atexit
+import json
+import queue
+import random
+import logging
+import logging.handlers
+from datetime import datetime
+from typing import Optional
+
+# 日志配置
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FILE = os.getenv("LOG_FILE", "logs/app.log")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json 结构化日志 | text 纯文本
+LOG_CONSOLE = os.getenv("LOG_CONSOLE", "True").lower() == "true"
+LOG_ROTATION = os.getenv("LOG_ROTATION", "size")  # size 按大小滚动 | time 按时间滚动
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "midnight")  # 按时间滚动的周期，取值同 TimedRotatingFileHandler
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "7"))
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))  # 高频 INFO 日志的保留比例
+LOG_SAMPLED_LOGGERS = [name for name in os.getenv("LOG_SAMPLED_LOGGERS", "app.middleware").split(",") if name]
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# LogRecord 的标准属性，其余属性视为通过 extra 传入的结构化字段
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+class JSONFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON，extra 传入的字段作为顶层键"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """按比例丢弃指定 logger 的 INFO 及以下日志，WARNING 及以上全部保留"""
+
+    def __init__(self, rate: float, loggers):
+        super().__init__()
+        self.rate = rate
+        self.loggers = set(loggers)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or record.name not in self.loggers:
+            return True
+        return random.random() < self.rate
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    只入队不格式化：标准 QueueHandler 会在调用线程中拼接消息，
+    这里把消息拼接和序列化都留给后台线程
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def create_file_handler(path: str) -> logging.Handler:
+    """根据配置创建按大小或按时间滚动的文件处理器"""
+    if LOG_ROTATION == "time":
+        return logging.handlers.TimedRotatingFileHandler(
+            path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+    return logging.handlers.RotatingFileHandler(
+        path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+    )
+
+
+def setup_logging(log_file: str = LOG_FILE) -> logging.handlers.QueueListener:
+    """
+    为根 logger 安装队列处理器，并启动写文件/控制台的后台监听线程。
+    后台线程不会随 fork 复制，预加载应用后 fork 出的 worker 需要重新调用
+    """
+    os.makedirs(os.path.dirname(log_file) or "logs", exist_ok=True)
+
+    formatter = JSONFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [create_file_handler(log_file)]
+    if LOG_CONSOLE:
+        handlers.append(logging.StreamHandler(sys.stderr))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = LazyQueueHandler(queue.SimpleQueue())
+    if LOG_SAMPLE_RATE < 1.0:
+        queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE, LOG_SAMPLED_LOGGERS))
+
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, LOG_LEVEL))
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging, listener)
+    return listener
+
+
+def stop_logging(listener: Optional[logging.handlers.QueueListener]):
+    """写完队列中剩余的日志并停止后台线程"""
+    if listener is not None and listener._thread is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
@@ -1,48 +1,57 @@
 import os
+import time
 import logging
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException, Depends, status, Request
+from fastapi import FastAPI, HTTPException, Depends, status, Request, Response, Query
 from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.security import HTTPBearer
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 from pydantic import BaseModel, Field
-from langchain_openai import ChatOpenAI
-from langchain.schema import HumanMessage
 import asyncio
 import json
-from dotenv import load_dotenv
-
-from .database import engine, get_db
-from .models import Base, Question, Answer, Session
-from .security import limiter, get_rate_limit, validate_user_input, validate_user_id, log_security_event
-from .middleware import RequestLoggingMiddleware, SecurityHeadersMiddleware, RequestSizeMiddleware
-
-# 加载环境变量
-load_dotenv()
-
-# 配置日志
-log_level = os.getenv("LOG_LEVEL", "INFO")
-log_file = os.getenv("LOG_FILE", "logs/app.log")
-
-# 创建日志目录
-os.makedirs(os.path.dirname(log_file) if os.path.dirname(log_file) else "logs", exist_ok=True)
-
-logging.basicConfig(
-    level=getattr(logging, log_level),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
+
+from .config import SHUTDOWN_DRAIN_TIMEOUT  # 先加载 .env，之后导入的模块读取环境变量时可见
+from .database import engine, get_db, SessionLocal
+from .models import Question, Session
+from .migrate import DB_AUTO_MIGRATE, upgrade_database
+from .llm import warm_up_llm, close_llm, get_llm, build_messages, llm_limiter, stream_answer
+from .cache import answer_cache, replay_chunks
+from .semantic_cache import semantic_cache
+from .singleflight import single_flight, prompt_key
+from .context import context_store, count_tokens
+from .streaming import (
+    ClientDisconnected, relay_chunks,
+    stream_stats, STREAM_COMPLETE_INCLUDE_ANSWER
+)
+from .resumable import resumable_streams, parse_event_id
+from .persistence import persistence, QUESTION_ANSWERED
+from .purge import purge_jobs, purge_user_history, purge_session
+from .session_cache import session_cache, find_active_session
+from .queries import (
+    get_user_questions, get_session_questions,
+    get_user_sessions,
+    encode_cursor, decode_cursor, stream_user_history
 )
+from .security import limiter, get_rate_limit, enforce_user_quota, validate_user_input, validate_user_id, log_security_event
+from .ratelimit import bucket_store, user_request_limiter, llm_token_budget
+from .log_config import setup_logging
+from .metrics import (
+    METRICS_ENABLED, LLM_CALL_ATTEMPTS, LLM_CALL_DURATION, LLM_RETRIES, SSE_ACTIVE_STREAMS,
+    metrics_response, mark_process_dead
+)
+from .middleware import RequestLoggingMiddleware, SecurityHeadersMiddleware, RequestSizeMiddleware, MetricsMiddleware
+
+# 配置日志（队列 + 后台线程写入，不阻塞事件循环）
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # 安全配置
@@ -54,11 +63,29 @@ MAX_REQUEST_SIZE = int(os.getenv("MAX_REQUEST_SIZE", "10485760"))  # 10MB
 # 创建数据库表
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # 启动时创建表
-    Base.metadata.create_all(bind=engine)
-    logger.info("数据库表创建完成")
+    # 启动时把表结构升级到最新迁移版本（DDL 走同步驱动，放到线程中执行）
+    if DB_AUTO_MIGRATE:
+        await asyncio.to_thread(upgrade_database)
+        logger.info("数据库迁移完成")
+    await persistence.start()
+    session_cache.start()
+    async with SessionLocal() as db:
+        await semantic_cache.load_or_build(db)
+    # openai/langchain 在后台线程导入，不计入启动时间
+    spawn_background(warm_up_llm())
     yield
-    # 关闭时的清理工作
+    # 关闭时的清理工作：先等待仍在生成的回答（客户端已断开、等待重连的流）写完
+    await drain_background_tasks(SHUTDOWN_DRAIN_TIMEOUT)
+    await close_llm()
+    await answer_cache.close()
+    await resumable_streams.close()
+    await purge_jobs.close()
+    await persistence.stop()
+    await bucket_store.close()
+    await session_cache.close()
+    await semantic_cache.close()
+    await engine.dispose()
+    mark_process_dead()
     logger.info("应用关闭")
 
 # 创建FastAPI应用
@@ -77,6 +104,8 @@ app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 app.add_middleware(RequestLoggingMiddleware)
 app.add_middleware(SecurityHeadersMiddleware)
 app.add_middleware(RequestSizeMiddleware, max_size=MAX_REQUEST_SIZE)
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware, routes=app.routes)
 
 # 安全中间件
 app.add_middleware(
@@ -91,6 +120,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
     max_age=3600,
 )
 
@@ -117,9 +147,38 @@ class QuestionResponse(BaseModel):
     question: str
     answer: Optional[str] = None
     create_time: str
-    status: int = Field(description="状态：0-未回答，1-已回答")
+    status: int = Field(description="状态：0-未回答，1-已回答，2-客户端中断，3-AI服务不可用")
     session_id: Optional[int] = None
 
+def build_question_response(question: Question) -> QuestionResponse:
+    """由已加载回答的问题对象构建响应"""
+    return QuestionResponse(
+        id=question.id,
+        question=question.question,
+        answer=question.answer.answer if question.answer else None,
+        create_time=question.create_time.isoformat(),
+        status=question.status,
+        session_id=question.session_id
+    )
+
+def parse_cursor(before: Optional[str]):
+    """解析分页游标参数"""
+    if not before:
+        return None
+    try:
+        return decode_cursor(before)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="无效的分页游标"
+        )
+
+def set_next_cursor(response: Response, page: List[Question], limit: Optional[int]):
+    """页满时通过 X-Next-Cursor 响应头返回下一页游标（当前页最早的一条）"""
+    if limit and len(page) == limit:
+        oldest = min(page, key=lambda q: (q.create_time, q.id))
+        response.headers["X-Next-Cursor"] = encode_cursor(oldest)
+
 class ErrorResponse(BaseModel):
     error: str
     message: str
@@ -128,19 +187,20 @@ class ErrorResponse(BaseModel):
 # 全局异常处理器
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
-    logger.error(f"HTTP异常: {exc.detail}")
+    logger.error("HTTP异常: %s", exc.detail)
     return JSONResponse(
         status_code=exc.status_code,
         content=ErrorResponse(
             error="HTTP_ERROR",
             message=exc.detail,
             timestamp=datetime.now().isoformat()
-        ).dict()
+        ).dict(),
+        headers=getattr(exc, "headers", None)
     )
 
 @app.exception_handler(SQLAlchemyError)
 async def sqlalchemy_exception_handler(request, exc):
-    logger.error(f"数据库异常: {str(exc)}")
+    logger.error("数据库异常: %s", exc)
     return JSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
         content=ErrorResponse(
@@ -150,87 +210,139 @@ async def sqlalchemy_exception_handler(request, exc):
         ).dict()
     )
 
+# 问题状态
+QUESTION_INTERRUPTED = 2
+QUESTION_FAILED = 3  # AI服务不可用，保存的是面向用户的提示语
+
+async def load_chat_session(db: AsyncSession, session_id: int, user_id: int):
+    """
+    校验会话属于该用户且未关闭，返回 (会话, 本轮问题写入前的问题数量)，不存在时抛出 404。
+    依次查找本进程尚未落库的会话（批量写入模式）、会话缓存、数据库；
+    会话缓存命中且上下文窗口在内存中时，问题数量取自窗口，无需读取会话行。
+    """
+    session = persistence.find_pending_session(session_id, user_id)
+    if session is None:
+        cached = session_cache.get(session_id, user_id)
+        synced_count = context_store.synced_count(session_id, cached.history_version) if cached is not None else None
+        if synced_count is not None:
+            return cached, synced_count
+        session = await find_active_session(db, session_id, user_id)
+    if not session:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="会话不存在或已关闭"
+        )
+    # 含尚未落库的问题，用于校验上下文窗口是否最新
+    return session, session.question_count + persistence.pending_question_count(session_id)
+
+# 后台任务引用，防止未完成的任务被回收
+background_tasks = set()
+
+def spawn_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def drain_background_tasks(timeout: float):
+    """等待后台任务在期限内结束，剩余的取消（生成任务被取消时会保存已生成的部分回答）"""
+    if not background_tasks:
+        return
+    logger.info("等待 %s 个后台任务完成，最长 %s 秒", len(background_tasks), timeout)
+    _, pending = await asyncio.wait(set(background_tasks), timeout=timeout)
+    if pending:
+        logger.warning("关闭时仍有 %s 个后台任务未完成，已取消", len(pending))
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        # 被取消的生成任务转到后台保存部分回答，等待保存完成
+        if background_tasks:
+            await asyncio.wait(set(background_tasks), timeout=timeout)
+
+async def save_interrupted_answer(question_id: int, session_id: int, question: str, answer_parts: List[str]):
+    """
+    客户端中断时保存已生成的部分回答，并将问题标记为已中断
+    用户主动停止时只保存客户端已收到的片段（序号 1 为问题事件，片段从序号 2 开始）
+    """
+    seen_seq = await resumable_streams.delivered_seq(question_id)
+    if seen_seq is not None:
+        answer_parts = answer_parts[:max(seen_seq - 1, 0)]
+    partial_answer = "".join(answer_parts)
+    stream_stats.record_interrupted(partial_answer)
+    try:
+        await persistence.save_answer(question_id, session_id, question, partial_answer, QUESTION_INTERRUPTED)
+        logger.info("客户端已断开，部分回答已保存，问题ID: %s，长度: %s", question_id, len(partial_answer))
+    except SQLAlchemyError as e:
+        logger.error("保存中断的回答失败: %s", e)
+        context_store.invalidate(session_id)
+
 # 创建问题并流式返回AI回答
+# SSE 响应头
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "Content-Type": "text/event-stream"
+}
+
 @app.get("/api/questions/stream")
 @limiter.limit(get_rate_limit())
-async def create_question_stream(request: Request, user_id: int, question: str, session_id: Optional[int] = None, db: Session = Depends(get_db)):
+async def create_question_stream(request: Request, user_id: int, question: str, session_id: Optional[int] = None):
     """
     创建问题并以流式方式返回AI回答
+    数据库会话只在准备阶段持有，返回响应前即归还连接；回答完成后再用短生命周期会话保存
+    携带 Last-Event-ID 的重连请求从回放缓冲续传同一回答
     """
     # 验证输入
     validate_user_id(user_id)
     validate_user_input(question)
     
-    logger.info(f"收到用户 {user_id} 的流式问题: {question[:50]}...")
+    # EventSource 断线重连时携带最后收到的事件ID：从回放缓冲续传，不再新建问题或重新调用 LLM
+    last_event_id = request.headers.get("last-event-id")
+    resume_from = parse_event_id(last_event_id) if last_event_id and resumable_streams.enabled else None
+    if resume_from is not None:
+        stream_id, after_seq = resume_from
+        if await resumable_streams.owner(stream_id) != user_id:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="回答流不存在或已过期"
+            )
+        return StreamingResponse(
+            resumable_streams.subscribe(request, stream_id, after_seq),
+            media_type="text/plain",
+            headers=SSE_HEADERS
+        )
+    
+    logger.info("收到用户 %s 的流式问题: %s...", user_id, question[:50])
     
+    # 按用户限流（重连续传不计入），在写入任何数据之前拒绝
+    await enforce_user_quota(user_id, request)
+    
+    db = SessionLocal()
     try:
         # 获取或创建会话
         if not session_id:
             # 创建新会话
             session_title = question[:50] + "..." if len(question) > 50 else question
-            db_session = Session(
-                user_id=user_id,
-                title=session_title,
-                status=1
-            )
-            db.add(db_session)
-            db.commit()
-            db.refresh(db_session)
-            session_id = db_session.id
-            logger.info(f"创建新会话，ID: {session_id}")
+            chat_session = await persistence.create_session(db, user_id, session_title)
+            session_id = chat_session.id
+            logger.info("创建新会话，ID: %s", session_id)
+            question_count = 0
         else:
-            # 验证会话是否存在且属于该用户
-            existing_session = db.query(Session).filter(
-                Session.id == session_id,
-                Session.user_id == user_id,
-                Session.status == 1
-            ).first()
-            
-            if not existing_session:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="会话不存在或已关闭"
-                )
-        
-        # 保存问题到数据库
-        db_question = Question(
-            user_id=user_id,
-            question=question,
-            session_id=session_id,
-            status=0  # 初始状态为未回答
-        )
-        db.add(db_question)
-        db.commit()
-        db.refresh(db_question)
-        logger.info(f"问题已保存，ID: {db_question.id}")
+            # 验证会话是否存在且属于该用户，并取得本轮问题写入前的问题数量
+            chat_session, question_count = await load_chat_session(db, session_id, user_id)
+        
+        # 保存问题：ID由应用层分配，会话与问题在同一事务中提交（批量写入模式下进入后台队列）
+        db_question = await persistence.create_question(db, user_id, session_id, question)
+        await db.commit()
+        await session_cache.notify(session_id)
+        logger.info("问题已保存，ID: %s", db_question.id)
         
-        # 获取对话历史上下文
+        # 获取对话历史上下文（按token预算的增量滚动窗口）
+        context_text = ""
         try:
-            recent_questions = db.query(Question).filter(
-                Question.user_id == user_id,
-                Question.session_id == session_id
-            ).order_by(Question.create_time.desc()).limit(100).all()
-            
-            context_messages = []
-            total_context_length = 0
-            max_context_length = 20000
-            
-            for q in reversed(recent_questions):
-                answer = db.query(Answer).filter(Answer.question_id == q.id).first()
-                if answer:
-                    question_text = f"用户：{q.question}"
-                    answer_text = f"助手：{answer.answer}"
-                    
-                    round_length = len(question_text) + len(answer_text)
-                    if total_context_length + round_length > max_context_length:
-                        break
-                    
-                    context_messages.append(question_text)
-                    context_messages.append(answer_text)
-                    total_context_length += round_length
-            
-            context_text = "\n".join(context_messages) if context_messages else ""
-            context_rounds = len(context_messages) // 2
+            window = await context_store.get_window(db, chat_session, question_count)
+            context_text = window.render()
+            context_rounds = len(window.turns)
             
             if context_text:
                 prompt = f"""你是一个专业、友好的智能客服助手。请根据用户的问题和对话历史提供准确、有用的回答。
@@ -252,10 +364,10 @@ async def create_question_stream(request: Request, user_id: int, question: str,
 
 回答："""
             
-            logger.info(f"正在调用DeepSeek API流式响应，包含 {context_rounds} 轮历史对话")
+            logger.info("正在调用DeepSeek API流式响应，包含 %s 轮历史对话，约 %s tokens", context_rounds, window.total_tokens)
             
         except Exception as e:
-            logger.warning(f"获取对话历史失败，使用无上下文模式: {str(e)}")
+            logger.warning("获取对话历史失败，使用无上下文模式: %s", e)
             prompt = f"""你是一个专业、友好的智能客服助手。请根据用户的问题提供准确、有用的回答。
 
 用户问题：{question}
@@ -264,9 +376,20 @@ async def create_question_stream(request: Request, user_id: int, question: str,
 
 回答："""
         
-        # 流式生成器函数
-        async def generate_stream():
-            full_answer = ""
+        # 查询回答缓存（默认仅缓存无历史上下文的首轮问题）
+        cache_key = answer_cache.make_key(question, context_text)
+        cached_answer = await answer_cache.get(cache_key)
+        if cached_answer is None and not context_text:
+            # 精确缓存未命中时尝试语义缓存
+            cached_answer = await semantic_cache.lookup(db, question)
+        
+        # 回答在独立任务中生成并写入回放缓冲，响应作为缓冲的订阅者输出，断线后可按 Last-Event-ID 续传
+        writer = await resumable_streams.start(db_question.id, user_id)
+        
+        async def generate_answer():
+            answer_parts: List[str] = []  # 以列表累积片段，避免长回答的反复字符串拼接
+            stream_stats.active += 1
+            SSE_ACTIVE_STREAMS.inc()
             try:
                 # 发送初始响应，包含问题信息
                 initial_data = {
@@ -278,59 +401,65 @@ async def create_question_stream(request: Request, user_id: int, question: str,
                         "session_id": session_id
                     }
                 }
-                yield f"data: {json.dumps(initial_data, ensure_ascii=False)}\n\n"
+                await writer.emit(initial_data)
                 
-                # 使用真正的流式响应
-                llm = ChatOpenAI(
-                    model="deepseek-reasoner", 
-                    openai_api_key=os.getenv("DEEPSEEK_API_KEY"),
-                    openai_api_base=os.getenv("DEEPSEEK_API_BASE"),
-                    timeout=60,
-                    max_retries=0,
-                    streaming=True  # 启用流式响应
-                )
-                message = HumanMessage(content=prompt)
+                if cached_answer is not None:
+                    # 命中缓存：按SSE分片回放
+                    logger.info("命中回答缓存，问题ID: %s", db_question.id)
+                    chunks = replay_chunks(cached_answer)
+                else:
+                    logger.info("开始流式生成回答，问题: %s", question)
+                    # 相同提示词的并发请求共享同一路上游流
+                    chunks = single_flight.stream(prompt_key(prompt), lambda: stream_answer_charged(prompt, user_id))
                 
-                # 使用流式响应
-                logger.info(f"开始流式生成回答，问题: {question}")
-                async for chunk in llm.astream([message]):
-                    if chunk.content:
-                        full_answer += chunk.content
-                        chunk_data = {
-                            "type": "chunk",
-                            "data": {
-                                "chunk": chunk.content,
-                                "is_final": False
-                            }
+                started = time.monotonic()
+                # 所有客户端断开且超过续传宽限期时停止读取并取消上游；细碎片段按合并窗口批量发送
+                async for content in relay_chunks(resumable_streams.watch(db_question.id), chunks):
+                    answer_parts.append(content)
+                    chunk_data = {
+                        "type": "chunk",
+                        "data": {
+                            "chunk": content,
+                            "is_final": False
                         }
-                        yield f"data: {json.dumps(chunk_data, ensure_ascii=False)}\n\n"
+                    }
+                    await writer.emit(chunk_data)
+                
+                full_answer = "".join(answer_parts)
+                if cached_answer is None:
+                    await answer_cache.set(cache_key, full_answer, time.monotonic() - started)
                 
-                logger.info(f"流式生成完成，总长度: {len(full_answer)} 字符")
+                logger.info("流式生成完成，总长度: %s 字符", len(full_answer))
                 
                 # 保存完整回答到数据库
-                db_answer = Answer(
-                    question_id=db_question.id,
-                    answer=full_answer
-                )
-                db.add(db_answer)
-                db_question.status = 1
-                db.commit()
+                await persistence.save_answer(db_question.id, session_id, question, full_answer)
+                if cached_answer is None and not context_text:
+                    semantic_cache.add(db_question.id, question)
+                stream_stats.record_completed(full_answer)
                 
                 # 发送完成信号
                 final_data = {
                     "type": "complete",
                     "data": {
                         "question_id": db_question.id,
-                        "full_answer": full_answer,
                         "session_id": session_id
                     }
                 }
-                yield f"data: {json.dumps(final_data, ensure_ascii=False)}\n\n"
+                if STREAM_COMPLETE_INCLUDE_ANSWER:
+                    final_data["data"]["full_answer"] = full_answer
+                await writer.emit(final_data)
                 
-                logger.info(f"流式回答完成，问题ID: {db_question.id}")
+                logger.info("流式回答完成，问题ID: %s", db_question.id)
                 
+            except ClientDisconnected:
+                await save_interrupted_answer(db_question.id, session_id, question, answer_parts)
+            except asyncio.CancelledError:
+                # 用户停止生成或应用关闭时生成任务被取消，当前任务内无法再等待IO，转到后台保存
+                spawn_background(save_interrupted_answer(db_question.id, session_id, question, list(answer_parts)))
+                raise
             except Exception as e:
-                logger.error(f"流式生成回答失败: {str(e)}")
+                logger.error("流式生成回答失败: %s", e)
+                context_store.invalidate(session_id)
                 error_data = {
                     "type": "error",
                     "data": {
@@ -338,113 +467,182 @@ async def create_question_stream(request: Request, user_id: int, question: str,
                         "question_id": db_question.id
                     }
                 }
-                yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+                await writer.emit(error_data)
+            finally:
+                stream_stats.active -= 1
+                SSE_ACTIVE_STREAMS.dec()
+                await writer.close()
+        
+        resumable_streams.track(db_question.id, spawn_background(generate_answer()))
         
         return StreamingResponse(
-            generate_stream(),
+            resumable_streams.subscribe(request, db_question.id),
             media_type="text/plain",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Content-Type": "text/event-stream"
-            }
+            headers=SSE_HEADERS
         )
         
     except HTTPException:
         raise
     except SQLAlchemyError as e:
-        logger.error(f"数据库操作失败: {str(e)}")
-        db.rollback()
+        logger.error("数据库操作失败: %s", e)
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="数据库操作失败"
         )
     except Exception as e:
-        logger.error(f"创建流式问题时发生未知错误: {str(e)}")
+        logger.error("创建流式问题时发生未知错误: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="服务器内部错误"
         )
+    finally:
+        # 在开始推送之前归还连接
+        await db.close()
+
+# 停止生成：立即取消回答生成任务（连接意外断开时仍保留续传宽限期）
+@app.delete("/api/questions/{question_id}/stream")
+@limiter.limit(get_rate_limit())
+async def cancel_question_stream(
+    request: Request,
+    question_id: int,
+    user_id: int,
+    seq: Optional[int] = Query(None, ge=0, description="客户端已收到的最后事件序号，只保存此前的回答片段")
+):
+    validate_user_id(user_id)
+    if await resumable_streams.owner(question_id) != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="回答流不存在或已过期"
+        )
+    await resumable_streams.cancel(question_id, seq)
+    logger.info("用户停止生成，问题ID: %s，已收到序号: %s", question_id, seq)
+    return {"message": "已停止生成"}
+
+async def invoke_llm_with_retry(prompt: str, request: Request, user_id: int) -> Tuple[str, bool]:
+    """
+    调用DeepSeek API获取回答（带重试机制）
+    返回 (回答文本, 是否成功)；全部重试失败时回答文本为面向用户的提示语
+    """
+    answer_text = ""
+    succeeded = False
+    max_retries = 3
+    retry_delay = 1  # 秒
+    api_timeout = 60  # 增加到60秒
+    
+    for attempt in range(max_retries):
+        try:
+            logger.info("正在调用DeepSeek API（第 %s 次尝试）...", attempt + 1)
+            
+            llm = get_llm()  # 共享客户端已禁用内部重试，由此处控制
+            messages = build_messages(prompt)
+            # 原生异步调用：超时会取消上游请求，不再占用线程池
+            async with llm_limiter:
+                started = time.perf_counter()
+                outcome = "error"
+                try:
+                    response = await asyncio.wait_for(
+                        llm.ainvoke(messages),
+                        timeout=api_timeout
+                    )
+                    outcome = "success"
+                except asyncio.TimeoutError:
+                    outcome = "timeout"
+                    raise
+                finally:
+                    LLM_CALL_DURATION.labels("invoke", outcome).observe(time.perf_counter() - started)
+            answer_text = response.content
+            logger.info("AI回答生成成功，长度: %s，尝试次数: %s", len(answer_text), attempt + 1)
+            succeeded = True
+            break  # 成功则跳出重试循环
+            
+        except asyncio.TimeoutError:
+            logger.warning("DeepSeek API调用超时（第 %s 次尝试）", attempt + 1)
+            if attempt == max_retries - 1:  # 最后一次尝试
+                logger.error("DeepSeek API调用最终超时，所有重试均失败")
+                answer_text = "抱歉，AI服务响应较慢，请稍后再试。我们正在努力改善服务质量。"
+                log_security_event("API_TIMEOUT", f"用户 {user_id} 的请求超时（{max_retries}次重试后）", request)
+            else:
+                # 等待后重试
+                LLM_RETRIES.inc()
+                await asyncio.sleep(retry_delay * (attempt + 1))  # 递增延迟
+                continue
+                
+        except Exception as e:
+            logger.warning("调用DeepSeek API失败（第 %s 次尝试）: %s", attempt + 1, e)
+            if attempt == max_retries - 1:  # 最后一次尝试
+                logger.error("DeepSeek API调用最终失败: %s", e)
+                answer_text = "抱歉，AI服务暂时不可用，请稍后再试。如问题持续，请联系技术支持。"
+                log_security_event("API_ERROR", f"AI服务错误（{max_retries}次重试后）: {str(e)}", request)
+            else:
+                # 等待后重试
+                LLM_RETRIES.inc()
+                await asyncio.sleep(retry_delay * (attempt + 1))
+                continue
+    
+    LLM_CALL_ATTEMPTS.observe(attempt + 1)
+    return answer_text, succeeded
+
+# 请求合并时只有发起上游调用的请求执行以下函数，token 预算按每次上游调用扣减一次，不向共享结果的请求重复计费
+async def stream_answer_charged(prompt: str, user_id: int):
+    """流式调用LLM，结束或取消时按实际消耗的 token 扣减发起者的预算（含中断时的部分回答）"""
+    answer_parts: List[str] = []
+    try:
+        async for content in stream_answer(prompt):
+            answer_parts.append(content)
+            yield content
+    finally:
+        if answer_parts:
+            spawn_background(llm_token_budget.charge(user_id, count_tokens(prompt) + count_tokens("".join(answer_parts))))
+
+async def invoke_llm_charged(prompt: str, request: Request, user_id: int) -> Tuple[str, bool]:
+    """调用LLM（带重试），成功时按实际消耗的 token 扣减发起者的预算"""
+    answer_text, succeeded = await invoke_llm_with_retry(prompt, request, user_id)
+    if succeeded:
+        await llm_token_budget.charge(user_id, count_tokens(prompt) + count_tokens(answer_text))
+    return answer_text, succeeded
 
 # 创建问题（保留原有的非流式API）并获取回答
 @app.post("/api/questions", response_model=QuestionResponse)
 @limiter.limit(get_rate_limit())
-async def create_question(request: Request, question_request: QuestionRequest, db: Session = Depends(get_db)):
+async def create_question(request: Request, question_request: QuestionRequest, db: AsyncSession = Depends(get_db)):
     # 验证用户输入
     validate_user_id(question_request.user_id)
     validate_user_input(question_request.question)
     
-    logger.info(f"收到用户 {question_request.user_id} 的问题: {question_request.question[:50]}...")
+    logger.info("收到用户 %s 的问题: %s...", question_request.user_id, question_request.question[:50])
+    
+    # 按用户限流，在写入任何数据之前拒绝
+    await enforce_user_quota(question_request.user_id, request)
     
     try:
         # 处理会话逻辑
         session_id = question_request.session_id
         if session_id:
-            # 验证会话是否存在且属于该用户
-            session = db.query(Session).filter(
-                Session.id == session_id,
-                Session.user_id == question_request.user_id,
-                Session.status == 1
-            ).first()
-            if not session:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="会话不存在或已关闭"
-                )
+            # 验证会话是否存在且属于该用户，并取得本轮问题写入前的问题数量
+            session, question_count = await load_chat_session(db, session_id, question_request.user_id)
         else:
             # 创建新会话
             session_title = question_request.question[:50] + "..." if len(question_request.question) > 50 else question_request.question
-            session = Session(
-                user_id=question_request.user_id,
-                title=session_title,
-                status=1
-            )
-            db.add(session)
-            db.commit()
-            db.refresh(session)
+            session = await persistence.create_session(db, question_request.user_id, session_title)
             session_id = session.id
-            logger.info(f"创建新会话，ID: {session_id}")
+            question_count = 0
+            logger.info("创建新会话，ID: %s", session_id)
         
         # 保存问题
-        db_question = Question(
-            user_id=question_request.user_id,
-            question=question_request.question,
-            session_id=session_id
-        )
-        db.add(db_question)
-        db.commit()
-        db.refresh(db_question)
-        logger.info(f"问题已保存，ID: {db_question.id}")
+        db_question = await persistence.create_question(db, question_request.user_id, session_id, question_request.question)
+        await db.commit()
+        await session_cache.notify(session_id)
+        logger.info("问题已保存，ID: %s", db_question.id)
         
-        # 获取当前会话的对话历史作为上下文
+        # 获取当前会话的对话历史作为上下文（按token预算的增量滚动窗口）
+        context_text = ""
         try:
-            recent_questions = db.query(Question).filter(
-                Question.user_id == question_request.user_id,
-                Question.session_id == session_id
-            ).order_by(Question.create_time.desc()).limit(100).all()
-            
-            context_messages = []
-            total_context_length = 0
-            max_context_length = 20000  # 限制上下文总长度
-            
-            for q in reversed(recent_questions):  # 按时间正序排列
-                answer = db.query(Answer).filter(Answer.question_id == q.id).first()
-                if answer:
-                    question_text = f"用户：{q.question}"
-                    answer_text = f"助手：{answer.answer}"
-                    
-                    # 检查添加这轮对话是否会超过长度限制
-                    round_length = len(question_text) + len(answer_text)
-                    if total_context_length + round_length > max_context_length:
-                        break
-                    
-                    context_messages.append(question_text)
-                    context_messages.append(answer_text)
-                    total_context_length += round_length
+            window = await context_store.get_window(db, session, question_count)
+            context_text = window.render()
+            context_rounds = len(window.turns)
             
             # 构建包含上下文的提示词
-            context_text = "\n".join(context_messages) if context_messages else ""
-            context_rounds = len(context_messages) // 2
             
             if context_text:
                 prompt = f"""你是一个专业、友好的智能客服助手。请根据用户的问题和对话历史提供准确、有用的回答。
@@ -473,10 +671,10 @@ async def create_question(request: Request, question_request: QuestionRequest, d
 
 回答："""
             
-            logger.info(f"正在调用DeepSeek API，包含 {context_rounds} 轮历史对话，上下文长度: {total_context_length}")
+            logger.info("正在调用DeepSeek API，包含 %s 轮历史对话，约 %s tokens", context_rounds, window.total_tokens)
             
         except Exception as e:
-            logger.warning(f"获取对话历史失败，使用无上下文模式: {str(e)}")
+            logger.warning("获取对话历史失败，使用无上下文模式: %s", e)
             prompt = f"""你是一个专业、友好的智能客服助手。请根据用户的问题提供准确、有用的回答。
 
 用户问题：{question_request.question}
@@ -488,69 +686,43 @@ async def create_question(request: Request, question_request: QuestionRequest, d
 
 回答："""
         
-        # 调用DeepSeek API获取回答（带重试机制）
-        max_retries = 3
-        retry_delay = 1  # 秒
-        api_timeout = 60  # 增加到60秒
-        
-        for attempt in range(max_retries):
-            try:
-                logger.info(f"正在调用DeepSeek API（第 {attempt + 1} 次尝试）...")
-                
-                llm = ChatOpenAI(
-                    model="deepseek-reasoner", 
-                    openai_api_key=os.getenv("DEEPSEEK_API_KEY"),
-                    openai_api_base=os.getenv("DEEPSEEK_API_BASE"),
-                    timeout=api_timeout,
-                    max_retries=0  # 禁用langchain内部重试，我们自己控制
-                )
-                message = HumanMessage(content=prompt)
-                response = await asyncio.wait_for(
-                    asyncio.to_thread(llm.invoke, [message]),
-                    timeout=api_timeout
-                )
-                answer_text = response.content
-                logger.info(f"AI回答生成成功，长度: {len(answer_text)}，尝试次数: {attempt + 1}")
-                break  # 成功则跳出重试循环
-                
-            except asyncio.TimeoutError:
-                logger.warning(f"DeepSeek API调用超时（第 {attempt + 1} 次尝试）")
-                if attempt == max_retries - 1:  # 最后一次尝试
-                    logger.error("DeepSeek API调用最终超时，所有重试均失败")
-                    answer_text = "抱歉，AI服务响应较慢，请稍后再试。我们正在努力改善服务质量。"
-                    log_security_event("API_TIMEOUT", f"用户 {question_request.user_id} 的请求超时（{max_retries}次重试后）", request)
-                else:
-                    # 等待后重试
-                    await asyncio.sleep(retry_delay * (attempt + 1))  # 递增延迟
-                    continue
-                    
-            except Exception as e:
-                logger.warning(f"调用DeepSeek API失败（第 {attempt + 1} 次尝试）: {str(e)}")
-                if attempt == max_retries - 1:  # 最后一次尝试
-                    logger.error(f"DeepSeek API调用最终失败: {str(e)}")
-                    answer_text = "抱歉，AI服务暂时不可用，请稍后再试。如问题持续，请联系技术支持。"
-                    log_security_event("API_ERROR", f"AI服务错误（{max_retries}次重试后）: {str(e)}", request)
-                else:
-                    # 等待后重试
-                    await asyncio.sleep(retry_delay * (attempt + 1))
-                    continue
+        # 查询回答缓存（默认仅缓存无历史上下文的首轮问题）
+        cache_key = answer_cache.make_key(question_request.question, context_text)
+        answer_text = await answer_cache.get(cache_key)
+        if answer_text is None and not context_text:
+            # 精确缓存未命中时尝试语义缓存
+            answer_text = await semantic_cache.lookup(db, question_request.question)
+        generated = False
+        question_status = QUESTION_ANSWERED
+        if answer_text is not None:
+            logger.info("命中回答缓存，问题ID: %s", db_question.id)
+        else:
+            started = time.monotonic()
+            # 相同提示词的并发请求共享同一次上游调用
+            answer_text, generated = await single_flight.call(
+                prompt_key(prompt),
+                lambda: invoke_llm_charged(prompt, request, question_request.user_id)
+            )
+            if generated:
+                await answer_cache.set(cache_key, answer_text, time.monotonic() - started)
+            else:
+                # 重试耗尽后的提示语不是真实回答，单独标记，不作为语义缓存来源
+                question_status = QUESTION_FAILED
         
         # 保存回答
         try:
-            db_answer = Answer(
-                question_id=db_question.id,
-                answer=answer_text
-            )
-            db.add(db_answer)
+            await persistence.save_answer(db_question.id, session_id, question_request.question, answer_text, question_status)
             
             # 更新问题状态
-            db_question.status = 1
-            db.commit()
-            logger.info(f"回答已保存，问题ID: {db_question.id}")
+            db_question.status = question_status
+            logger.info("回答已保存，问题ID: %s", db_question.id)
+            if generated and not context_text:
+                semantic_cache.add(db_question.id, question_request.question)
             
         except SQLAlchemyError as e:
-            logger.error(f"保存回答失败: {str(e)}")
-            db.rollback()
+            logger.error("保存回答失败: %s", e)
+            await db.rollback()
+            context_store.invalidate(session_id)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="保存回答失败"
@@ -566,15 +738,15 @@ async def create_question(request: Request, question_request: QuestionRequest, d
         )
         
     except SQLAlchemyError as e:
-        logger.error(f"数据库操作失败: {str(e)}")
-        db.rollback()
+        logger.error("数据库操作失败: %s", e)
+        await db.rollback()
         log_security_event("DATABASE_ERROR", f"数据库错误: {str(e)}", request)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="数据库操作失败"
         )
     except Exception as e:
-        logger.error(f"创建问题时发生未知错误: {str(e)}")
+        logger.error("创建问题时发生未知错误: %s", e)
         log_security_event("UNKNOWN_ERROR", f"未知错误: {str(e)}", request)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -584,74 +756,118 @@ async def create_question(request: Request, question_request: QuestionRequest, d
 # 获取用户历史记录
 @app.get("/api/history/{user_id}", response_model=List[QuestionResponse])
 @limiter.limit(get_rate_limit())
-async def get_history(request: Request, user_id: int, db: Session = Depends(get_db)):
+async def get_history(
+    request: Request,
+    response: Response,
+    user_id: int,
+    limit: Optional[int] = Query(None, ge=1, le=500, description="每页条数，为空则返回全部"),
+    before: Optional[str] = Query(None, description="分页游标，取自上一页的 X-Next-Cursor 响应头"),
+    db: AsyncSession = Depends(get_db)
+):
     # 验证用户ID
     validate_user_id(user_id)
+    cursor = parse_cursor(before)
     
-    logger.info(f"获取用户 {user_id} 的历史记录")
+    logger.info("获取用户 %s 的历史记录", user_id)
     
     try:
         # 查询用户的问题和回答
-        questions = db.query(Question).filter(Question.user_id == user_id).order_by(Question.create_time.desc()).all()
-        
-        result = []
-        for question in questions:
-            answer = db.query(Answer).filter(Answer.question_id == question.id).first()
-            result.append(QuestionResponse(
-                id=question.id,
-                question=question.question,
-                answer=answer.answer if answer else None,
-                create_time=question.create_time.isoformat(),
-                status=question.status
-            ))
-        
-        logger.info(f"成功获取用户 {user_id} 的 {len(result)} 条历史记录")
+        questions = await get_user_questions(db, user_id, limit=limit, before=cursor)
+        result = [build_question_response(question) for question in questions]
+        set_next_cursor(response, questions, limit)
+        
+        logger.info("成功获取用户 %s 的 %s 条历史记录", user_id, len(result))
         return result
         
     except SQLAlchemyError as e:
-        logger.error(f"获取历史记录时数据库错误: {str(e)}")
+        logger.error("获取历史记录时数据库错误: %s", e)
         log_security_event("DATABASE_ERROR", f"获取历史记录失败: {str(e)}", request)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="获取历史记录失败"
         )
     except Exception as e:
-        logger.error(f"获取历史记录时发生未知错误: {str(e)}")
+        logger.error("获取历史记录时发生未知错误: %s", e)
         log_security_event("UNKNOWN_ERROR", f"获取历史记录错误: {str(e)}", request)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="服务器内部错误"
         )
 
+# 以 NDJSON 流式导出用户历史记录
+@app.get("/api/history/{user_id}/export")
+@limiter.limit(get_rate_limit())
+async def export_history(request: Request, user_id: int, db: AsyncSession = Depends(get_db)):
+    validate_user_id(user_id)
+    logger.info("导出用户 %s 的历史记录", user_id)
+    
+    async def generate_ndjson():
+        exported = 0
+        try:
+            async for row in stream_user_history(db, user_id):
+                record = {
+                    "id": row.id,
+                    "question": row.question,
+                    "answer": row.answer,
+                    "create_time": row.create_time.isoformat(),
+                    "status": row.status,
+                    "session_id": row.session_id
+                }
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+                exported += 1
+            logger.info("用户 %s 的历史记录导出完成，共 %s 条", user_id, exported)
+        except SQLAlchemyError as e:
+            # 响应头已发送，只能记录错误并中止流
+            logger.error("导出历史记录时数据库错误: %s", e)
+            log_security_event("DATABASE_ERROR", f"导出历史记录失败: {str(e)}", request)
+    
+    return StreamingResponse(
+        generate_ndjson(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="history_{user_id}.ndjson"'}
+    )
+
+def ensure_background_purge(background: bool):
+    """后台清理在多 worker 部署中需要共享任务存储，未配置时拒绝请求"""
+    if background and not purge_jobs.background_enabled:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="当前部署不支持后台清理任务，请去掉 background 参数"
+        )
+
 # 清空用户历史记录（删除数据库数据）
 @app.delete("/api/history/{user_id}")
 @limiter.limit(get_rate_limit())
-async def clear_history(request: Request, user_id: int, db: Session = Depends(get_db)):
+async def clear_history(
+    request: Request,
+    response: Response,
+    user_id: int,
+    background: bool = Query(False, description="为 True 时提交后台清理任务并立即返回任务ID"),
+    db: AsyncSession = Depends(get_db)
+):
     # 验证用户ID
     validate_user_id(user_id)
+    ensure_background_purge(background)
     
-    logger.info(f"开始清空用户 {user_id} 的历史记录")
+    if background:
+        job = await purge_jobs.submit("history", user_id, user_id, lambda job_db, job: purge_user_history(job_db, user_id, job))
+        logger.info("已提交用户 %s 的历史记录清理任务 %s", user_id, job.id)
+        log_security_event("HISTORY_CLEARED", f"用户 {user_id} 提交了历史记录清理任务 {job.id}", request)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {"message": "清理任务已提交", **job.to_dict()}
+    
+    logger.info("开始清空用户 %s 的历史记录", user_id)
     
     try:
-        # 获取用户的所有问题ID
-        questions = db.query(Question).filter(Question.user_id == user_id).all()
-        question_ids = [q.id for q in questions]
+        # 分批删除问题及其回答，每批单独提交
+        deleted_questions, deleted_answers = await purge_user_history(db, user_id)
         
-        if not question_ids:
-            logger.info(f"用户 {user_id} 没有历史记录需要清空")
+        if not deleted_questions:
+            logger.info("用户 %s 没有历史记录需要清空", user_id)
             return {"message": "没有历史记录需要清空", "deleted_count": 0}
         
-        # 删除所有相关的回答
-        deleted_answers = db.query(Answer).filter(Answer.question_id.in_(question_ids)).delete(synchronize_session=False)
-        
-        # 删除所有问题
-        deleted_questions = db.query(Question).filter(Question.user_id == user_id).delete(synchronize_session=False)
-        
-        # 提交事务
-        db.commit()
-        
         total_deleted = deleted_questions + deleted_answers
-        logger.info(f"成功清空用户 {user_id} 的历史记录，删除了 {deleted_questions} 个问题和 {deleted_answers} 个回答")
+        logger.info("成功清空用户 %s 的历史记录，删除了 %s 个问题和 %s 个回答", user_id, deleted_questions, deleted_answers)
         log_security_event("HISTORY_CLEARED", f"用户 {user_id} 清空了历史记录，删除 {total_deleted} 条数据", request)
         
         return {
@@ -662,45 +878,49 @@ async def clear_history(request: Request, user_id: int, db: Session = Depends(ge
         }
         
     except SQLAlchemyError as e:
-        logger.error(f"清空历史记录时数据库错误: {str(e)}")
-        db.rollback()
+        logger.error("清空历史记录时数据库错误: %s", e)
+        await db.rollback()
         log_security_event("DATABASE_ERROR", f"清空历史记录失败: {str(e)}", request)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="数据库操作失败"
         )
     except Exception as e:
-        logger.error(f"清空历史记录时发生未知错误: {str(e)}")
-        db.rollback()
+        logger.error("清空历史记录时发生未知错误: %s", e)
+        await db.rollback()
         log_security_event("UNKNOWN_ERROR", f"清空历史记录未知错误: {str(e)}", request)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="服务器内部错误"
         )
 
+# 查询后台清理任务进度
+@app.get("/api/purge-jobs/{job_id}")
+@limiter.limit(get_rate_limit())
+async def get_purge_job(request: Request, job_id: str, user_id: int):
+    validate_user_id(user_id)
+    job = await purge_jobs.get(job_id, user_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="清理任务不存在或已过期"
+        )
+    return job.to_dict()
+
 # 健康检查接口
 # 获取用户会话列表
 @app.get("/api/sessions/{user_id}", response_model=List[SessionResponse])
 @limiter.limit(get_rate_limit())
-async def get_sessions(request: Request, user_id: int, db: Session = Depends(get_db)):
+async def get_sessions(request: Request, user_id: int, db: AsyncSession = Depends(get_db)):
     validate_user_id(user_id)
-    logger.info(f"获取用户 {user_id} 的会话列表")
+    logger.info("获取用户 %s 的会话列表", user_id)
     
     try:
-        # 获取用户的所有会话，按更新时间倒序
-        sessions = db.query(Session).filter(
-            Session.user_id == user_id,
-            Session.status == 1
-        ).order_by(Session.update_time.desc()).all()
-        
-        # 为每个会话计算问题数量
-        session_responses = []
-        for session in sessions:
-            question_count = db.query(Question).filter(
-                Question.session_id == session.id
-            ).count()
-            
-            session_responses.append(SessionResponse(
+        # 获取用户的所有会话及问题数量，按更新时间倒序
+        sessions = await get_user_sessions(db, user_id)
+        
+        session_responses = [
+            SessionResponse(
                 id=session.id,
                 user_id=session.user_id,
                 title=session.title,
@@ -708,13 +928,15 @@ async def get_sessions(request: Request, user_id: int, db: Session = Depends(get
                 update_time=session.update_time.isoformat(),
                 status=session.status,
                 question_count=question_count
-            ))
+            )
+            for session, question_count in sessions
+        ]
         
-        logger.info(f"返回 {len(session_responses)} 个会话记录")
+        logger.info("返回 %s 个会话记录", len(session_responses))
         return session_responses
         
     except SQLAlchemyError as e:
-        logger.error(f"获取会话列表失败: {str(e)}")
+        logger.error("获取会话列表失败: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="获取会话列表失败"
@@ -723,48 +945,39 @@ async def get_sessions(request: Request, user_id: int, db: Session = Depends(get
 # 获取指定会话的对话历史
 @app.get("/api/sessions/{session_id}/history", response_model=List[QuestionResponse])
 @limiter.limit(get_rate_limit())
-async def get_session_history(request: Request, session_id: int, user_id: int, db: Session = Depends(get_db)):
+async def get_session_history(
+    request: Request,
+    response: Response,
+    session_id: int,
+    user_id: int,
+    limit: Optional[int] = Query(None, ge=1, le=500, description="每页条数，为空则返回全部"),
+    before: Optional[str] = Query(None, description="分页游标，取自上一页的 X-Next-Cursor 响应头"),
+    db: AsyncSession = Depends(get_db)
+):
     validate_user_id(user_id)
-    logger.info(f"获取会话 {session_id} 的对话历史")
+    cursor = parse_cursor(before)
+    logger.info("获取会话 %s 的对话历史", session_id)
     
     try:
-        # 验证会话是否存在且属于该用户
-        session = db.query(Session).filter(
-            Session.id == session_id,
-            Session.user_id == user_id,
-            Session.status == 1
-        ).first()
-        
-        if not session:
+        # 验证会话是否存在且属于该用户（先查会话缓存）
+        if session_cache.get(session_id, user_id) is None and await find_active_session(db, session_id, user_id) is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="会话不存在或已关闭"
             )
         
         # 获取会话的所有问题和答案
-        questions = db.query(Question).filter(
-            Question.session_id == session_id
-        ).order_by(Question.create_time.asc()).all()
-        
-        history = []
-        for question in questions:
-            answer = db.query(Answer).filter(Answer.question_id == question.id).first()
-            history.append(QuestionResponse(
-                id=question.id,
-                question=question.question,
-                answer=answer.answer if answer else None,
-                create_time=question.create_time.isoformat(),
-                status=question.status,
-                session_id=question.session_id
-            ))
-        
-        logger.info(f"返回会话 {session_id} 的 {len(history)} 条对话记录")
+        questions = await get_session_questions(db, session_id, limit=limit, before=cursor)
+        history = [build_question_response(question) for question in questions]
+        set_next_cursor(response, questions, limit)
+        
+        logger.info("返回会话 %s 的 %s 条对话记录", session_id, len(history))
         return history
         
     except HTTPException:
         raise
     except SQLAlchemyError as e:
-        logger.error(f"获取会话历史失败: {str(e)}")
+        logger.error("获取会话历史失败: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="获取会话历史失败"
@@ -773,37 +986,40 @@ async def get_session_history(request: Request, session_id: int, user_id: int, d
 # 关闭会话
 @app.put("/api/sessions/{session_id}/close")
 @limiter.limit(get_rate_limit())
-async def close_session(request: Request, session_id: int, user_id: int, db: Session = Depends(get_db)):
+async def close_session(request: Request, session_id: int, user_id: int, db: AsyncSession = Depends(get_db)):
     validate_user_id(user_id)
-    logger.info(f"关闭会话 {session_id}")
+    logger.info("关闭会话 %s", session_id)
     
     try:
-        # 验证会话是否存在且属于该用户
-        session = db.query(Session).filter(
-            Session.id == session_id,
-            Session.user_id == user_id,
-            Session.status == 1
-        ).first()
+        # 关闭会话：归属校验与状态更新在同一条语句中完成
+        closed = (await db.execute(
+            update(Session)
+            .where(
+                Session.id == session_id,
+                Session.user_id == user_id,
+                Session.status == 1
+            )
+            .values(status=0, update_time=datetime.now())
+            .execution_options(synchronize_session=False)
+        )).rowcount
         
-        if not session:
+        if not closed:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="会话不存在或已关闭"
             )
         
-        # 关闭会话
-        session.status = 0
-        session.update_time = datetime.now()
-        db.commit()
+        await db.commit()
+        await session_cache.invalidate(session_id)
         
-        logger.info(f"会话 {session_id} 已关闭")
+        logger.info("会话 %s 已关闭", session_id)
         return {"message": "会话已关闭", "session_id": session_id}
         
     except HTTPException:
         raise
     except SQLAlchemyError as e:
-        logger.error(f"关闭会话失败: {str(e)}")
-        db.rollback()
+        logger.error("关闭会话失败: %s", e)
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="关闭会话失败"
@@ -812,16 +1028,26 @@ async def close_session(request: Request, session_id: int, user_id: int, db: Ses
 # 删除会话
 @app.delete("/api/sessions/{session_id}")
 @limiter.limit(get_rate_limit())
-async def delete_session(request: Request, session_id: int, user_id: int, db: Session = Depends(get_db)):
+async def delete_session(
+    request: Request,
+    response: Response,
+    session_id: int,
+    user_id: int,
+    background: bool = Query(False, description="为 True 时提交后台清理任务并立即返回任务ID"),
+    db: AsyncSession = Depends(get_db)
+):
     validate_user_id(user_id)
-    logger.info(f"删除会话 {session_id}")
+    ensure_background_purge(background)
+    logger.info("删除会话 %s", session_id)
     
     try:
         # 验证会话是否存在且属于该用户
-        session = db.query(Session).filter(
-            Session.id == session_id,
-            Session.user_id == user_id
-        ).first()
+        session = (await db.execute(
+            select(Session).where(
+                Session.id == session_id,
+                Session.user_id == user_id
+            )
+        )).scalars().first()
         
         if not session:
             raise HTTPException(
@@ -829,32 +1055,55 @@ async def delete_session(request: Request, session_id: int, user_id: int, db: Se
                 detail="会话不存在"
             )
         
-        # 删除会话相关的所有答案
-        questions = db.query(Question).filter(Question.session_id == session_id).all()
-        for question in questions:
-            # 删除答案
-            db.query(Answer).filter(Answer.question_id == question.id).delete()
+        if background:
+            # 先关闭会话，使其立即从会话列表中消失，再由后台任务删除数据
+            session.status = 0
+            session.update_time = datetime.now()
+            await db.commit()
+            await session_cache.invalidate(session_id)
+            job = await purge_jobs.submit("session", user_id, session_id, lambda job_db, job: purge_session(job_db, session_id, job))
+            logger.info("已提交会话 %s 的删除任务 %s", session_id, job.id)
+            response.status_code = status.HTTP_202_ACCEPTED
+            return {"message": "删除任务已提交", "session_id": session_id, **job.to_dict()}
         
-        # 删除会话相关的所有问题
-        db.query(Question).filter(Question.session_id == session_id).delete()
+        # 分批删除会话的问题及其回答，最后删除会话
+        await purge_session(db, session_id)
         
-        # 删除会话
-        db.delete(session)
-        db.commit()
-        
-        logger.info(f"会话 {session_id} 及其相关数据已删除")
+        logger.info("会话 %s 及其相关数据已删除", session_id)
         return {"message": "会话已删除", "session_id": session_id}
         
     except HTTPException:
         raise
     except SQLAlchemyError as e:
-        logger.error(f"删除会话失败: {str(e)}")
-        db.rollback()
+        logger.error("删除会话失败: %s", e)
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="删除会话失败"
         )
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus 指标（多 worker 时汇总所有进程）"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="指标未启用")
+    return metrics_response()
+
 @app.get("/api/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
\ No newline at end of file
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "llm": llm_limiter.stats(),
+        "answer_cache": answer_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "context": context_store.stats(),
+        "session_cache": session_cache.stats(),
+        "streams": stream_stats.stats(),
+        "resumable_streams": resumable_streams.stats(),
+        "persistence": persistence.stats(),
+        "purge_jobs": purge_jobs.stats(),
+        "user_rate_limit": user_request_limiter.stats(),
+        "llm_token_budget": llm_token_budget.stats()
+    }
\ No newline at end of file
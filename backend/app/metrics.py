@@ -0,0 +1,120 @@
+"""
+监控指标模块 - Prometheus 格式的请求、LLM、数据库指标
+
+多 worker 部署时设置 PROMETHEUS_MULTIPROC_DIR（启动前清空该目录），
+各进程把指标写入共享目录，/metrics 汇总所有进程的数据
+"""
+import os
+import time
+import contextvars
+from typing import Optional
+
+from sqlalchemy import event
+from starlette.responses import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True").lower() == "true"
+MULTIPROCESS_MODE = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+# 请求
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "请求处理耗时（流式响应包含整个流）",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+SSE_ACTIVE_STREAMS = Gauge(
+    "sse_active_streams", "正在生成的流式回答数量", multiprocess_mode="livesum"
+)
+
+# LLM
+LLM_CALL_DURATION = Histogram(
+    "llm_call_duration_seconds", "单次上游 LLM 调用耗时",
+    ["mode", "outcome"],
+    buckets=(0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds", "流式调用从发起到收到首个片段的时间",
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30)
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "llm_stream_tokens_per_second", "流式调用首个片段之后的生成速度（估算 token）",
+    buckets=(1, 5, 10, 20, 35, 50, 75, 100, 200, 500)
+)
+LLM_CALL_ATTEMPTS = Histogram(
+    "llm_call_attempts", "非流式问答每次请求的上游调用次数（含重试）",
+    buckets=(1, 2, 3, 4, 5)
+)
+LLM_RETRIES = Counter("llm_retries", "非流式问答的上游重试次数")
+
+# 数据库
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "单条 SQL 语句执行耗时",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request", "每个请求执行的 SQL 语句数",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "db_time_per_request_seconds", "每个请求的 SQL 执行总耗时",
+    ["route"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+)
+DB_POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "从连接池取得连接的等待时间（含新建连接）",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+)
+
+
+class RequestDBStats:
+    """单个请求内的 SQL 统计"""
+
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+# 当前请求的 SQL 统计；请求中派生的后台任务继承同一对象
+request_db_stats: contextvars.ContextVar[Optional[RequestDBStats]] = contextvars.ContextVar(
+    "request_db_stats", default=None
+)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    DB_QUERY_DURATION.observe(elapsed)
+    stats = request_db_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += elapsed
+
+
+def instrument_engine(engine):
+    """在引擎上注册 SQL 执行计时事件（异步引擎需传入 engine.sync_engine）"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def metrics_response() -> Response:
+    """导出所有指标；多进程模式下汇总共享目录中各 worker 的数据"""
+    registry = REGISTRY
+    if MULTIPROCESS_MODE:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+def mark_process_dead():
+    """worker 退出时清理其 livesum 类型的 Gauge 数据"""
+    if MULTIPROCESS_MODE:
+        multiprocess.mark_process_dead(os.getpid())
+
@@ -1,77 +1,133 @@
 """
 中间件模块 - 提供请求日志、安全检查等功能
+
+均实现为纯 ASGI 中间件：直接包装 receive/send，不为每个请求额外创建任务或缓冲响应流，
+流式响应的背压和取消可以直接传递到接口
 """
 import time
 import logging
-from typing import Callable
-from fastapi import Request, Response
-from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import ASGIApp
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import HTTP_REQUEST_DURATION, DB_QUERIES_PER_REQUEST, DB_TIME_PER_REQUEST, RequestDBStats, request_db_stats
 
 logger = logging.getLogger(__name__)
 
-class RequestLoggingMiddleware(BaseHTTPMiddleware):
+class RequestLoggingMiddleware:
     """请求日志中间件"""
-    
+
     def __init__(self, app: ASGIApp):
-        super().__init__(app)
-    
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
         start_time = time.time()
-        
-        # 记录请求信息
-        client_ip = request.client.host if request.client else "unknown"
-        user_agent = request.headers.get("user-agent", "unknown")
-        method = request.method
-        url = str(request.url)
-        
-        logger.info(f"请求开始 - {method} {url} - IP: {client_ip} - User-Agent: {user_agent[:100]}")
-        
+
+        # 记录请求信息：只取路径和查询串，不拼接完整URL；消息由日志线程按需格式化
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
+        method = scope["method"]
+        path = scope["path"]
+        if scope.get("query_string"):
+            path = f"{path}?{scope['query_string'].decode('latin-1')}"
+
+        if logger.isEnabledFor(logging.DEBUG):
+            user_agent = Headers(scope=scope).get("user-agent", "unknown")
+            logger.debug("请求开始 - %s %s - IP: %s - User-Agent: %s", method, path, client_ip, user_agent[:100])
+
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                # 添加处理时间到响应头（到开始发送响应为止）
+                MutableHeaders(scope=message).append("X-Process-Time", str(time.time() - start_time))
+            await send(message)
+
         try:
-            response = await call_next(request)
-            
-            # 计算处理时间
-            process_time = time.time() - start_time
-            
-            # 记录响应信息
-            logger.info(
-                f"请求完成 - {method} {url} - "
-                f"状态码: {response.status_code} - "
-                f"处理时间: {process_time:.3f}s - "
-                f"IP: {client_ip}"
-            )
-            
-            # 添加处理时间到响应头
-            response.headers["X-Process-Time"] = str(process_time)
-            
-            return response
-            
+            await self.app(scope, receive, send_wrapper)
         except Exception as e:
             process_time = time.time() - start_time
             logger.error(
-                f"请求异常 - {method} {url} - "
-                f"错误: {str(e)} - "
-                f"处理时间: {process_time:.3f}s - "
-                f"IP: {client_ip}"
+                "请求异常 - %s %s - 错误: %s - 处理时间: %.3fs - IP: %s",
+                method, path, e, process_time, client_ip,
+                extra={"method": method, "path": path, "client_ip": client_ip, "duration_ms": round(process_time * 1000, 1)}
             )
             raise
 
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
+        # 记录响应信息（流式响应在发送完毕后记录，处理时间包含整个流）
+        process_time = time.time() - start_time
+        logger.info(
+            "请求完成 - %s %s - 状态码: %s - 处理时间: %.3fs - IP: %s",
+            method, path, status_code, process_time, client_ip,
+            extra={
+                "method": method,
+                "path": path,
+                "status": status_code,
+                "client_ip": client_ip,
+                "duration_ms": round(process_time * 1000, 1)
+            }
+        )
+
+class MetricsMiddleware:
+    """请求指标中间件：按路由模板统计请求耗时，以及请求内的 SQL 语句数和耗时"""
+
+    def __init__(self, app: ASGIApp, routes=None):
+        self.app = app
+        self.routes = routes if routes is not None else []  # 应用的路由列表，用于把接口函数映射为路由模板
+        self._route_paths = {}
+
+    def route_path(self, scope: Scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._route_paths.get(endpoint)
+        if path is None:
+            self._route_paths = {getattr(route, "endpoint", None): route.path for route in self.routes}
+            path = self._route_paths.get(endpoint, "unmatched")
+        return path
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        db_stats = RequestDBStats()
+        token = request_db_stats.set(db_stats)
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_db_stats.reset(token)
+            # 路由匹配后 scope 中带有接口函数
+            route = self.route_path(scope)
+            HTTP_REQUEST_DURATION.labels(scope["method"], route, str(status_code)).observe(time.perf_counter() - start_time)
+            DB_QUERIES_PER_REQUEST.labels(route).observe(db_stats.queries)
+            DB_TIME_PER_REQUEST.labels(route).observe(db_stats.seconds)
+
+class SecurityHeadersMiddleware:
     """安全头中间件"""
-    
-    def __init__(self, app: ASGIApp):
-        super().__init__(app)
-    
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        response = await call_next(request)
-        
-        # 添加安全头
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        response.headers["Content-Security-Policy"] = (
+
+    # 安全头
+    SECURITY_HEADERS = {
+        "X-Content-Type-Options": "nosniff",
+        "X-Frame-Options": "DENY",
+        "X-XSS-Protection": "1; mode=block",
+        "Referrer-Policy": "strict-origin-when-cross-origin",
+        "Content-Security-Policy": (
             "default-src 'self'; "
             "script-src 'self' 'unsafe-inline'; "
             "style-src 'self' 'unsafe-inline'; "
@@ -79,34 +135,95 @@ class SecurityHeadersMiddleware(BaseHTTPMiddleware):
             "font-src 'self' https:; "
             "connect-src 'self' https:; "
             "frame-ancestors 'none';"
-        )
-        
-        return response
+        ),
+    }
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        # 预先编码为原始响应头，每个响应只做一次列表拼接
+        self.raw_headers = [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in self.SECURITY_HEADERS.items()
+        ]
+        self.header_names = {name for name, _ in self.raw_headers}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                # 覆盖接口已设置的同名头
+                headers = [item for item in message.get("headers", []) if item[0] not in self.header_names]
+                message["headers"] = headers + self.raw_headers
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+class RequestTooLarge(Exception):
+    """读取请求体时超过大小限制"""
+
+class RequestSizeMiddleware:
+    """请求大小限制中间件：先检查 Content-Length，再在读取请求体时累计字节数（覆盖分块传输）"""
 
-class RequestSizeMiddleware(BaseHTTPMiddleware):
-    """请求大小限制中间件"""
-    
     def __init__(self, app: ASGIApp, max_size: int = 10 * 1024 * 1024):  # 默认10MB
-        super().__init__(app)
+        self.app = app
         self.max_size = max_size
-    
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+
+    def too_large_response(self, scope: Scope, size: int) -> JSONResponse:
+        client = scope.get("client")
+        logger.warning(
+            "请求体过大 - IP: %s - 大小: %s bytes - 限制: %s bytes",
+            client[0] if client else "unknown", size, self.max_size
+        )
+        return JSONResponse(
+            status_code=413,
+            content={
+                "error": "REQUEST_TOO_LARGE",
+                "message": f"请求体过大，最大允许 {self.max_size // (1024*1024)} MB",
+                "timestamp": time.time()
+            }
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
         # 检查Content-Length头
-        content_length = request.headers.get("content-length")
-        if content_length:
-            content_length = int(content_length)
-            if content_length > self.max_size:
-                logger.warning(
-                    f"请求体过大 - IP: {request.client.host if request.client else 'unknown'} - "
-                    f"大小: {content_length} bytes - 限制: {self.max_size} bytes"
-                )
-                return JSONResponse(
-                    status_code=413,
-                    content={
-                        "error": "REQUEST_TOO_LARGE",
-                        "message": f"请求体过大，最大允许 {self.max_size // (1024*1024)} MB",
-                        "timestamp": time.time()
-                    }
-                )
-        
-        return await call_next(request)
\ No newline at end of file
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and int(content_length) > self.max_size:
+            await self.too_large_response(scope, int(content_length))(scope, receive, send)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def receive_wrapper() -> Message:
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    exceeded = True
+                    raise RequestTooLarge()
+            return message
+
+        async def send_wrapper(message: Message):
+            nonlocal response_started
+            if exceeded:
+                # 接口把读取异常转换成的错误响应不再发送，由本中间件返回 413
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not response_started:
+            await self.too_large_response(scope, received)(scope, receive, send)
@@ -0,0 +1,71 @@
+"""
+数据库迁移模块 - 基于 Alembic 的版本化表结构管理，在启动 worker 之前升级到最新版本
+
+部署时可单独执行：python -m app.migrate；alembic 只在执行迁移时导入，不计入应用启动时间
+"""
+import os
+import logging
+from typing import TYPE_CHECKING
+
+from sqlalchemy import create_engine, inspect
+
+from .database import DATABASE_URL
+
+if TYPE_CHECKING:
+    from alembic.config import Config
+
+logger = logging.getLogger(__name__)
+
+# 应用启动时（lifespan）自动执行迁移；通过 start.py 启动时由其在启动服务之前执行一次，lifespan 中关闭
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "True").lower() == "true"
+
+ALEMBIC_INI = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic.ini")
+
+# 引入迁移之前由 create_all 建立的表结构对应的版本
+BASELINE_REVISION = "0001"
+
+
+def sync_database_url(url: str = DATABASE_URL) -> str:
+    """迁移使用同步驱动执行 DDL"""
+    if url.startswith("mysql://"):
+        return "mysql+pymysql://" + url[len("mysql://"):]
+    return url
+
+
+def alembic_config(connection=None) -> "Config":
+    """加载 alembic.ini；传入连接时迁移在该连接上执行"""
+    from alembic.config import Config
+
+    config = Config(ALEMBIC_INI)
+    config.set_main_option("script_location", os.path.join(os.path.dirname(ALEMBIC_INI), "migrations"))
+    if connection is not None:
+        config.attributes["connection"] = connection
+    return config
+
+
+def is_legacy_schema(connection) -> bool:
+    """已有业务表但没有版本记录：由旧版本的 create_all 创建"""
+    tables = set(inspect(connection).get_table_names())
+    return "alembic_version" not in tables and "questions" in tables
+
+
+def upgrade_database(url: str = DATABASE_URL):
+    """把数据库结构升级到最新版本（同步执行，异步环境中放到线程里调用）"""
+    from alembic import command
+
+    engine = create_engine(sync_database_url(url))
+    try:
+        with engine.begin() as connection:
+            config = alembic_config(connection)
+            if is_legacy_schema(connection):
+                # 旧库从基线版本开始，后续迁移按实际缺少的列和索引补齐
+                logger.info("检测到未纳入迁移管理的表结构，标记为基线版本 %s", BASELINE_REVISION)
+                command.stamp(config, BASELINE_REVISION)
+            command.upgrade(config, "head")
+    finally:
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    upgrade_database()
@@ -1,32 +1,74 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, func
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, ForeignKey, Index, func
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.sqlite import DATETIME as SQLiteDateTime
 
 Base = declarative_base()
 
+# SQLite 以字符串保存时间，统一为 func.now() 写入的秒级格式，保证 (create_time, id) 游标比较正确
+TimestampType = DateTime().with_variant(
+    SQLiteDateTime(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite"
+)
+
+# 表结构变更通过 migrations/ 下的版本化迁移发布，修改模型后需同步新增迁移
+
 class Session(Base):
     __tablename__ = "sessions"
+    __table_args__ = (
+        # 会话列表：WHERE user_id = ? AND status = 1 ORDER BY update_time DESC
+        Index("ix_sessions_user_status_updated", "user_id", "status", "update_time"),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, nullable=False, index=True)
+    user_id = Column(Integer, nullable=False)
     title = Column(String(200), nullable=False)  # 会话标题（基于第一个问题生成）
-    create_time = Column(DateTime, default=func.now())
-    update_time = Column(DateTime, default=func.now(), onupdate=func.now())
+    create_time = Column(TimestampType, default=func.now())
+    update_time = Column(TimestampType, default=func.now(), onupdate=func.now())
     status = Column(Integer, default=1)  # 1-活跃，0-已结束
+    question_count = Column(Integer, nullable=False, default=0, server_default="0")  # 冗余计数，随问题增删在同一事务内维护
+    context_summary = Column(Text, nullable=True)  # 滚出上下文窗口的早期对话摘要
+    history_version = Column(Integer, nullable=False, default=0, server_default="0")  # 清空历史等批外变更时递增，使各进程的上下文窗口失效
 
 class Question(Base):
     __tablename__ = "questions"
+    __table_args__ = (
+        # 用户历史 / 导出 / 清空：WHERE user_id = ? ORDER BY create_time DESC, id DESC
+        Index("ix_questions_user_time", "user_id", "create_time", "id"),
+        # 会话历史 / 删除会话：WHERE session_id = ? ORDER BY create_time DESC, id DESC
+        Index("ix_questions_session_time", "session_id", "create_time", "id"),
+        # 对话上下文：WHERE user_id = ? AND session_id = ? ORDER BY create_time DESC, id DESC；
+        # 前缀 (user_id, session_id) 同时覆盖会话列表的按会话计数
+        Index("ix_questions_user_session_time", "user_id", "session_id", "create_time", "id"),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, nullable=False, index=True)
-    session_id = Column(Integer, ForeignKey("sessions.id"), nullable=True, index=True)  # 关联会话
+    user_id = Column(Integer, nullable=False)
+    session_id = Column(Integer, ForeignKey("sessions.id"), nullable=True)  # 关联会话
     question = Column(Text(1000), nullable=False)
-    create_time = Column(DateTime, default=func.now())
-    status = Column(Integer, default=0)  # 0-未回答，1-已回答
+    create_time = Column(TimestampType, default=func.now())
+    status = Column(Integer, default=0)  # 0-未回答，1-已回答，2-客户端中断（已保存部分回答），3-AI服务不可用（已保存提示语）
+
+    # 一问一答；lazy="raise" 防止异步环境下的隐式懒加载，必须通过查询显式加载
+    answer = relationship("Answer", back_populates="question", uselist=False, lazy="raise")
 
 class Answer(Base):
     __tablename__ = "answers"
+    __table_args__ = (
+        # 一问一答：按问题加载回答，唯一约束防止重复保存
+        Index("uq_answers_question_id", "question_id", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    question_id = Column(Integer, ForeignKey("questions.id"), index=True)
+    question_id = Column(Integer, ForeignKey("questions.id"))
     answer = Column(Text(2000), nullable=False)
-    create_time = Column(DateTime, default=func.now())
\ No newline at end of file
+    create_time = Column(TimestampType, default=func.now())
+
+    question = relationship("Question", back_populates="answer", lazy="raise")
+
+class IdBlock(Base):
+    """应用层主键分配：各 worker 每次预留一段连续ID，写入数据库前即可得到主键"""
+    __tablename__ = "id_blocks"
+
+    name = Column(String(50), primary_key=True)  # 表名
+    next_id = Column(BigInteger, nullable=False)  # 下一段的起始ID
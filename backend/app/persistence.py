@@ -0,0 +1,362 @@
+"""
+持久化模块 - 会话/问题/回答的写入，支持同步提交与后台批量写入（write-behind）两种模式
+
+主键由应用层按段预留分配（hi/lo），写入数据库前即可确定会话ID和问题ID，
+因此批量模式下 SSE 的 question 事件无需等待提交即可返回ID。
+"""
+import os
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import insert, select, update, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .context import context_store, save_summary
+from .database import SessionLocal
+from .models import Answer, IdBlock, Question, Session
+from .queries import increment_question_count
+from .session_cache import session_cache
+
+logger = logging.getLogger(__name__)
+
+# 持久化配置
+PERSIST_MODE = os.getenv("PERSIST_MODE", "sync")  # sync 请求内提交 | batched 后台批量写入（进程崩溃时可能丢失未落库的数据）
+PERSIST_QUEUE_SIZE = int(os.getenv("PERSIST_QUEUE_SIZE", "10000"))  # 队列满时写入方等待（背压）
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "200"))
+PERSIST_FLUSH_INTERVAL = float(os.getenv("PERSIST_FLUSH_INTERVAL", "0.05"))  # 攒批窗口（秒）
+ID_BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE", "100"))  # 每次预留的ID数量
+
+# 问题状态
+QUESTION_ANSWERED = 1
+
+
+def _now() -> datetime:
+    # 与数据库时间列的秒级精度保持一致，保证 (create_time, id) 游标比较正确
+    return datetime.now().replace(microsecond=0)
+
+
+def _row(obj) -> dict:
+    """ORM 对象转换为批量插入使用的列字典"""
+    return {column.key: getattr(obj, column.key) for column in obj.__table__.columns}
+
+
+class IdAllocator:
+    """按段预留主键：一次原子 UPDATE 预留 block_size 个ID，用完后再预留下一段；进程重启会留下未使用的空洞"""
+
+    def __init__(self, model, block_size: int = 100):
+        self.model = model
+        self.name = model.__tablename__
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock: Optional[asyncio.Lock] = None  # 首次使用时创建，绑定 worker 的事件循环
+        self.blocks = 0
+
+    async def next_id(self) -> int:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = await self._reserve()
+                self.blocks += 1
+            value = self._next
+            self._next += 1
+            return value
+
+    async def _reserve(self) -> Tuple[int, int]:
+        async with SessionLocal() as db:
+            while True:
+                # 先执行 UPDATE 取得行锁，多个 worker 并发预留时不会拿到重叠的区间
+                result = await db.execute(
+                    update(IdBlock)
+                    .where(IdBlock.name == self.name)
+                    .values(next_id=IdBlock.next_id + self.block_size)
+                )
+                if result.rowcount:
+                    end = (await db.execute(
+                        select(IdBlock.next_id).where(IdBlock.name == self.name)
+                    )).scalar_one()
+                    await db.commit()
+                    return end - self.block_size, end
+                # 首次使用：从表中现有的最大ID之后开始分配
+                start = (await db.execute(select(func.coalesce(func.max(self.model.id), 0)))).scalar_one() + 1
+                db.add(IdBlock(name=self.name, next_id=start))
+                try:
+                    await db.commit()
+                except IntegrityError:
+                    # 其他 worker 已完成初始化
+                    await db.rollback()
+
+
+class WriteBehindQueue:
+    """有界写入队列：后台任务按批次合并为多行 INSERT / 批量 UPDATE，在一个事务内提交"""
+
+    def __init__(self, maxsize: int = 10000, batch_size: int = 200, flush_interval: float = 0.05):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.maxsize = maxsize
+        self._queue: Optional[asyncio.Queue] = None  # 在 start 中创建，绑定 worker 的事件循环
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # 尚未落库的数据，供同一进程内的后续请求读取（read-your-writes）
+        self.pending_sessions: Dict[int, Session] = {}
+        self.pending_questions: Counter = Counter()  # session_id -> 未落库的问题数
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._stopping
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """写入结束标记，等待队列中已有的数据全部落库"""
+        if self._task is None:
+            return
+        self._stopping = True
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def put(self, kind: str, row: dict):
+        if kind == "question" and row.get("session_id"):
+            self.pending_questions[row["session_id"]] += 1
+        await self._queue.put((kind, row))
+
+    async def flush(self):
+        """等待已写入队列的数据全部落库（或最终失败丢弃）"""
+        if self._task is not None:
+            await self._queue.join()
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            ops: List[Tuple[str, dict]] = []
+            if item is None:
+                stopping = True
+                self._queue.task_done()
+            else:
+                ops.append(item)
+                # 等待一个攒批窗口，让并发请求的写入合并到同一批次
+                await asyncio.sleep(self.flush_interval)
+            while len(ops) < self.batch_size or stopping:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if item is None:
+                    stopping = True
+                    self._queue.task_done()
+                else:
+                    ops.append(item)
+                if len(ops) >= self.batch_size:
+                    await self._flush_with_retry(ops)
+                    ops = []
+            if ops:
+                await self._flush_with_retry(ops)
+
+    async def _flush_with_retry(self, ops: List[Tuple[str, dict]]):
+        try:
+            for attempt in range(2):
+                try:
+                    await self._flush(ops)
+                    self.batches += 1
+                    self.written += len(ops)
+                    return
+                except Exception as e:
+                    if attempt == 0:
+                        logger.warning("批量写入失败，稍后重试，条数: %s，错误: %s", len(ops), e)
+                        await asyncio.sleep(0.5)
+                    else:
+                        self.failed += len(ops)
+                        question_ids = [row["id"] for kind, row in ops if kind == "question"]
+                        logger.error("批量写入最终失败，丢弃 %s 条，问题ID: %s，错误: %s", len(ops), question_ids, e)
+                        # 内存中的窗口和缓存的会话已计入丢弃的轮次，作废后从数据库重建
+                        for session_id in {row["session_id"] for kind, row in ops if row.get("session_id")}:
+                            context_store.invalidate(session_id)
+                            await session_cache.invalidate(session_id)
+        finally:
+            for kind, row in ops:
+                self._queue.task_done()
+                if kind == "session":
+                    self.pending_sessions.pop(row["id"], None)
+                elif kind == "question" and row.get("session_id"):
+                    self.pending_questions[row["session_id"]] -= 1
+                    if self.pending_questions[row["session_id"]] <= 0:
+                        del self.pending_questions[row["session_id"]]
+
+    async def _flush(self, ops: List[Tuple[str, dict]]):
+        sessions = [row for kind, row in ops if kind == "session"]
+        questions = [row for kind, row in ops if kind == "question"]
+        answers = [row for kind, row in ops if kind == "answer"]
+        statuses: Dict[int, List[int]] = {}
+        summaries: Dict[int, str] = {}
+        for row in answers:
+            statuses.setdefault(row["status"], []).append(row["question_id"])
+            if row["summary"] is not None:
+                summaries[row["session_id"]] = row["summary"]  # 同一会话只保留最新摘要
+        question_counts = Counter(row["session_id"] for row in questions if row["session_id"])
+
+        async with SessionLocal() as db:
+            # 按外键依赖顺序写入：会话 -> 问题 -> 回答
+            if sessions:
+                await db.execute(insert(Session), sessions)
+            if questions:
+                await db.execute(insert(Question), questions)
+            for session_id, count in question_counts.items():
+                await increment_question_count(db, session_id, count)
+            if answers:
+                await db.execute(insert(Answer), [
+                    {"question_id": row["question_id"], "answer": row["answer"], "create_time": row["create_time"]}
+                    for row in answers
+                ])
+            for question_status, question_ids in statuses.items():
+                await db.execute(
+                    update(Question)
+                    .where(Question.id.in_(question_ids))
+                    .values(status=question_status)
+                    .execution_options(synchronize_session=False)
+                )
+            for session_id, summary in summaries.items():
+                await save_summary(db, session_id, summary)
+            await db.commit()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "batches": self.batches,
+            "written": self.written,
+            "failed": self.failed
+        }
+
+
+class Persistence:
+    """对外的写入接口：sync 模式在调用方事务中写入，batched 模式写入后台队列"""
+
+    def __init__(self, queue: Optional[WriteBehindQueue] = None, id_block_size: int = 100):
+        self.queue = queue  # 为 None 时为 sync 模式
+        self.session_ids = IdAllocator(Session, id_block_size)
+        self.question_ids = IdAllocator(Question, id_block_size)
+
+    @property
+    def batched(self) -> bool:
+        # 队列停止（应用关闭）后的写入回退为同步提交
+        return self.queue is not None and self.queue.running
+
+    async def start(self):
+        if self.queue is not None:
+            self.queue.start()
+            logger.info("批量写入已启用 - 批大小: %s - 攒批窗口: %ss", self.queue.batch_size, self.queue.flush_interval)
+
+    async def stop(self):
+        if self.queue is not None:
+            await self.queue.stop()
+            logger.info("批量写入队列已清空 - %s", self.queue.stats())
+
+    async def create_session(self, db: AsyncSession, user_id: int, title: str) -> Session:
+        """创建会话；sync 模式加入调用方事务（由调用方提交）"""
+        now = _now()
+        session = Session(
+            id=await self.session_ids.next_id(),
+            user_id=user_id,
+            title=title,
+            status=1,
+            question_count=0,
+            history_version=0,
+            create_time=now,
+            update_time=now
+        )
+        if self.batched:
+            self.queue.pending_sessions[session.id] = session
+            await self.queue.put("session", _row(session))
+        else:
+            db.add(session)
+        return session
+
+    async def create_question(self, db: AsyncSession, user_id: int, session_id: int, question: str) -> Question:
+        """创建问题并累加会话问题计数；sync 模式加入调用方事务（由调用方提交）"""
+        db_question = Question(
+            id=await self.question_ids.next_id(),
+            user_id=user_id,
+            question=question,
+            session_id=session_id,
+            status=0,  # 初始状态为未回答
+            create_time=_now()
+        )
+        if self.batched:
+            await self.queue.put("question", _row(db_question))
+        else:
+            db.add(db_question)
+            # 先写入同一事务中新建的会话，计数更新才能命中
+            await db.flush()
+            await increment_question_count(db, session_id)
+        return db_question
+
+    async def flush(self):
+        """batched 模式下等待队列中的数据落库；清理数据前调用，避免稍后落库的行逃过删除"""
+        if self.queue is not None:
+            await self.queue.flush()
+
+    def find_pending_session(self, session_id: int, user_id: int) -> Optional[Session]:
+        """查找本进程创建但尚未落库的会话"""
+        if self.queue is None:
+            return None
+        session = self.queue.pending_sessions.get(session_id)
+        return session if session is not None and session.user_id == user_id else None
+
+    def pending_question_count(self, session_id: int) -> int:
+        """会话中尚未落库的问题数量，用于校正数据库中的问题计数"""
+        if self.queue is None:
+            return 0
+        return self.queue.pending_questions.get(session_id, 0)
+
+    async def save_answer(self, question_id: int, session_id: int, question: str, answer: str,
+                          question_status: int = QUESTION_ANSWERED):
+        """保存回答、更新问题状态并推进上下文窗口；sync 模式使用独立的短生命周期会话立即提交"""
+        if self.batched:
+            summary = context_store.advance(session_id, question, answer)
+            await self.queue.put("answer", {
+                "question_id": question_id,
+                "session_id": session_id,
+                "answer": answer,
+                "status": question_status,
+                "summary": summary,
+                "create_time": _now()
+            })
+            return
+        async with SessionLocal() as db:
+            db.add(Answer(question_id=question_id, answer=answer))
+            await db.execute(
+                update(Question)
+                .where(Question.id == question_id)
+                .values(status=question_status)
+            )
+            await context_store.append(db, session_id, question, answer)
+            await db.commit()
+
+    def stats(self) -> dict:
+        stats = {"mode": "batched" if self.batched else "sync"}
+        if self.queue is not None:
+            stats.update(self.queue.stats())
+        return stats
+
+
+def create_persistence() -> Persistence:
+    """根据配置创建持久化接口"""
+    queue = None
+    if PERSIST_MODE == "batched":
+        queue = WriteBehindQueue(PERSIST_QUEUE_SIZE, PERSIST_BATCH_SIZE, PERSIST_FLUSH_INTERVAL)
+    return Persistence(queue, ID_BLOCK_SIZE)
+
+
+persistence = create_persistence()
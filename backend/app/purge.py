@@ -0,0 +1,373 @@
+"""
+数据清理模块 - 分批删除问答记录，支持提交为后台清理任务
+
+每批只取一组问题ID（不加载 ORM 对象），用两条集合删除语句删除回答和问题后立即提交，
+大量数据的清理不会长时间持有行锁，也不会生成超长的 IN 列表。
+后台任务的状态保存在任务存储中（memory 进程内 / redis 多 worker 共享），任一 worker 都可查询进度
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .cache import REDIS_URL
+from .context import context_store
+from .database import SessionLocal
+from .models import Answer, Question, Session
+from .persistence import persistence
+from .queries import bump_history_versions, bump_session_history_version, reset_question_counts
+from .session_cache import session_cache
+
+logger = logging.getLogger(__name__)
+
+# 清理配置
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "1000"))  # 每个事务删除的问题数
+PURGE_JOB_TTL = int(os.getenv("PURGE_JOB_TTL", "3600"))  # 已结束任务的状态保留时间（秒）
+PURGE_JOB_BACKEND = os.getenv("PURGE_JOB_BACKEND", "memory")  # memory 单进程 | redis 多 worker 共享
+# 运行中的任务超过该时间（秒）没有进度更新视为所在 worker 已退出，可重新提交
+PURGE_JOB_HEARTBEAT_TTL = int(os.getenv("PURGE_JOB_HEARTBEAT_TTL", "300"))
+# 为 False 时拒绝后台清理请求（多 worker 且任务存储为 memory 时由 start.py 关闭）
+PURGE_BACKGROUND_ENABLED = os.getenv("PURGE_BACKGROUND_ENABLED", "True").lower() == "true"
+
+
+class PurgeJob:
+    """一个清理任务的进度"""
+
+    STATE_FIELDS = (
+        "id", "kind", "user_id", "target", "status", "questions_total", "questions_deleted",
+        "answers_deleted", "batches", "error", "created_at", "finished_at"
+    )
+
+    def __init__(self, kind: str, user_id: int, target: int, store=None):
+        self.store = store  # 进度写入的任务存储，为 None 时只保存在对象中
+        self.id = uuid.uuid4().hex
+        self.kind = kind  # history 清空用户历史 | session 删除会话
+        self.user_id = user_id
+        self.target = target
+        self.status = "pending"  # pending | running | completed | failed
+        self.questions_total: Optional[int] = None
+        self.questions_deleted = 0
+        self.answers_deleted = 0
+        self.batches = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def advance(self, questions: int, answers: int):
+        self.questions_deleted += questions
+        self.answers_deleted += answers
+        self.batches += 1
+
+    async def checkpoint(self):
+        """把当前进度写入任务存储，供其他 worker 查询"""
+        if self.store is not None:
+            await self.store.save(self)
+
+    def to_state(self) -> dict:
+        return {field: getattr(self, field) for field in self.STATE_FIELDS}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "PurgeJob":
+        job = cls(state["kind"], state["user_id"], state["target"])
+        for field in cls.STATE_FIELDS:
+            setattr(job, field, state[field])
+        return job
+
+    def to_dict(self) -> dict:
+        progress = 1.0 if self.status == "completed" else 0.0
+        if self.status != "completed" and self.questions_total:
+            progress = round(self.questions_deleted / self.questions_total, 4)
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "target": self.target,
+            "status": self.status,
+            "progress": min(progress, 1.0),
+            "questions_total": self.questions_total,
+            "questions_deleted": self.questions_deleted,
+            "answers_deleted": self.answers_deleted,
+            "batches": self.batches,
+            "error": self.error,
+            "elapsed": round((self.finished_at or time.time()) - self.created_at, 3)
+        }
+
+
+async def delete_question_batch(db: AsyncSession, condition, batch_size: int = PURGE_BATCH_SIZE) -> Tuple[int, int]:
+    """删除一批满足条件的问题及其回答，返回 (问题数, 回答数)；由调用方提交"""
+    question_ids = (await db.execute(
+        select(Question.id).where(condition).limit(batch_size)
+    )).scalars().all()
+    if not question_ids:
+        return 0, 0
+    deleted_answers = (await db.execute(
+        delete(Answer).where(Answer.question_id.in_(question_ids)).execution_options(synchronize_session=False)
+    )).rowcount
+    deleted_questions = (await db.execute(
+        delete(Question).where(Question.id.in_(question_ids)).execution_options(synchronize_session=False)
+    )).rowcount
+    return deleted_questions, deleted_answers
+
+
+async def purge_questions(
+    db: AsyncSession,
+    condition,
+    batch_size: int = PURGE_BATCH_SIZE,
+    job: Optional[PurgeJob] = None
+) -> Tuple[int, int]:
+    """分批删除满足条件的问题及其回答，每批单独提交，返回 (问题数, 回答数)"""
+    if job is not None:
+        job.questions_total = (await db.execute(
+            select(func.count()).select_from(Question).where(condition)
+        )).scalar_one()
+        await job.checkpoint()
+    total_questions = total_answers = 0
+    while True:
+        deleted_questions, deleted_answers = await delete_question_batch(db, condition, batch_size)
+        if not deleted_questions:
+            break
+        await db.commit()
+        total_questions += deleted_questions
+        total_answers += deleted_answers
+        if job is not None:
+            job.advance(deleted_questions, deleted_answers)
+            await job.checkpoint()
+        if deleted_questions < batch_size:
+            break
+    return total_questions, total_answers
+
+
+async def purge_user_history(db: AsyncSession, user_id: int, job: Optional[PurgeJob] = None) -> Tuple[int, int]:
+    """删除用户的全部问答记录，清零会话的问题计数和上下文摘要"""
+    await persistence.flush()
+    session_ids = (await db.execute(select(Session.id).where(Session.user_id == user_id))).scalars().all()
+    try:
+        deleted = await purge_questions(db, Question.user_id == user_id, job=job)
+        await reset_question_counts(db, user_id)
+        await db.commit()
+    except Exception:
+        # 已提交的批次不回滚：递增历史版本，其他 worker 据此重建上下文窗口
+        await db.rollback()
+        try:
+            await bump_history_versions(db, user_id)
+            await db.commit()
+        except Exception as e:
+            logger.error("清理失败后递增会话历史版本失败，用户ID: %s，错误: %s", user_id, e)
+        raise
+    finally:
+        # 每批单独提交，中途失败时已删除的部分同样生效：本进程的窗口和各 worker 的会话缓存一律作废
+        context_store.invalidate_user(user_id)
+        for session_id in session_ids:
+            await session_cache.invalidate(session_id)
+    return deleted
+
+
+async def purge_session(db: AsyncSession, session_id: int, job: Optional[PurgeJob] = None) -> Tuple[int, int]:
+    """删除会话的全部问答记录后删除会话本身"""
+    await persistence.flush()
+    try:
+        deleted = await purge_questions(db, Question.session_id == session_id, job=job)
+        await db.execute(delete(Session).where(Session.id == session_id).execution_options(synchronize_session=False))
+        await db.commit()
+    except Exception:
+        # 已提交的批次不回滚，会话仍然存在：递增历史版本，其他 worker 据此重建上下文窗口
+        await db.rollback()
+        try:
+            await bump_session_history_version(db, session_id)
+            await db.commit()
+        except Exception as e:
+            logger.error("删除会话失败后递增历史版本失败，会话ID: %s，错误: %s", session_id, e)
+        raise
+    finally:
+        context_store.invalidate(session_id)
+        await session_cache.invalidate(session_id)
+    return deleted
+
+
+class MemoryPurgeJobStore:
+    """进程内任务存储，仅适用于单 worker 部署"""
+
+    def __init__(self, ttl: int = 3600):
+        self.ttl = ttl
+        self._jobs: Dict[str, PurgeJob] = {}
+        self._active: Dict[Tuple[str, int], str] = {}
+
+    async def claim(self, job: PurgeJob) -> Optional[PurgeJob]:
+        """登记新任务；同一对象已有未结束的任务时返回该任务"""
+        self._expire()
+        active = self._jobs.get(self._active.get((job.kind, job.target)))
+        if active is not None and not active.done:
+            return active
+        self._active[(job.kind, job.target)] = job.id
+        self._jobs[job.id] = job
+        return None
+
+    async def save(self, job: PurgeJob):
+        self._jobs[job.id] = job
+
+    async def release(self, job: PurgeJob):
+        if self._active.get((job.kind, job.target)) == job.id:
+            del self._active[(job.kind, job.target)]
+
+    async def get(self, job_id: str) -> Optional[PurgeJob]:
+        return self._jobs.get(job_id)
+
+    def _expire(self):
+        deadline = time.time() - self.ttl
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.done and job.finished_at < deadline]:
+            del self._jobs[job_id]
+
+    async def close(self):
+        pass
+
+
+class RedisPurgeJobStore:
+    """
+    Redis 协议任务存储，多 worker 共享任务状态与去重；可传入任意兼容 redis.asyncio 接口的客户端
+    运行中的任务状态以心跳 TTL 过期，所在 worker 退出后同一对象可重新提交
+    """
+
+    def __init__(self, client=None, url: str = REDIS_URL, ttl: int = 3600,
+                 heartbeat_ttl: int = 300, prefix: str = "purge_job:"):
+        if client is None:
+            import redis.asyncio as redis
+            client = redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.ttl = ttl
+        self.heartbeat_ttl = heartbeat_ttl
+        self.prefix = prefix
+
+    def _active_key(self, job: PurgeJob) -> str:
+        return f"{self.prefix}active:{job.kind}:{job.target}"
+
+    async def claim(self, job: PurgeJob) -> Optional[PurgeJob]:
+        active_key = self._active_key(job)
+        if not await self.client.set(active_key, job.id, nx=True, ex=self.heartbeat_ttl):
+            active = await self.get(await self.client.get(active_key) or "")
+            if active is not None and not active.done:
+                return active
+            await self.client.set(active_key, job.id, ex=self.heartbeat_ttl)
+        await self.save(job)
+        return None
+
+    async def save(self, job: PurgeJob):
+        ttl = self.ttl if job.done else self.heartbeat_ttl
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.set(self.prefix + job.id, json.dumps(job.to_state()), ex=ttl)
+            if not job.done:
+                pipe.expire(self._active_key(job), self.heartbeat_ttl)
+            await pipe.execute()
+
+    async def release(self, job: PurgeJob):
+        active_key = self._active_key(job)
+        if await self.client.get(active_key) == job.id:
+            await self.client.delete(active_key)
+
+    async def get(self, job_id: str) -> Optional[PurgeJob]:
+        state = await self.client.get(self.prefix + job_id)
+        return PurgeJob.from_state(json.loads(state)) if state else None
+
+    async def close(self):
+        await self.client.close()
+
+
+class PurgeJobs:
+    """后台清理任务：提交后立即返回任务ID，通过任务ID查询进度（任务状态保存在任务存储中）"""
+
+    def __init__(self, store, background_enabled: bool = True):
+        self.store = store
+        self.background_enabled = background_enabled
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.completed = 0
+        self.failed = 0
+
+    async def submit(
+        self,
+        kind: str,
+        user_id: int,
+        target: int,
+        run: Callable[[AsyncSession, PurgeJob], Awaitable[Tuple[int, int]]]
+    ) -> PurgeJob:
+        """提交清理任务；同一对象已有未结束的任务（可能在其他 worker 上）时直接返回该任务"""
+        job = PurgeJob(kind, user_id, target, self.store)
+        active = await self.store.claim(job)
+        if active is not None:
+            return active
+        self._tasks[job.id] = asyncio.create_task(self._run(job, run))
+        return job
+
+    async def _run(self, job: PurgeJob, run: Callable[[AsyncSession, PurgeJob], Awaitable[Tuple[int, int]]]):
+        job.status = "running"
+        try:
+            await job.checkpoint()
+            async with SessionLocal() as db:
+                await run(db, job)
+            job.status = "completed"
+            self.completed += 1
+            logger.info(
+                "清理任务 %s 完成 - %s %s - 删除 %s 个问题和 %s 个回答",
+                job.id, job.kind, job.target, job.questions_deleted, job.answers_deleted
+            )
+        except Exception as e:
+            # 已提交的批次不回滚，重新提交任务会从剩余数据继续
+            job.status = "failed"
+            job.error = str(e)
+            self.failed += 1
+            logger.error("清理任务 %s 失败 - %s %s - 错误: %s", job.id, job.kind, job.target, e)
+        except asyncio.CancelledError:
+            job.status = "failed"
+            job.error = "服务关闭，任务已取消"
+            raise
+        finally:
+            job.finished_at = time.time()
+            self._tasks.pop(job.id, None)
+            try:
+                await job.checkpoint()
+                await self.store.release(job)
+            except Exception as e:
+                logger.error("保存清理任务 %s 的状态失败: %s", job.id, e)
+
+    async def get(self, job_id: str, user_id: int) -> Optional[PurgeJob]:
+        """按任务ID获取任务，只返回属于该用户的任务"""
+        job = await self.store.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
+
+    async def close(self):
+        """取消未完成的任务（每批单独提交，已删除的数据不受影响）"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.store.close()
+
+    def stats(self) -> dict:
+        return {
+            "running": len(self._tasks),
+            "completed": self.completed,
+            "failed": self.failed,
+            "batch_size": PURGE_BATCH_SIZE,
+            "background_enabled": self.background_enabled
+        }
+
+
+def create_purge_jobs() -> PurgeJobs:
+    """根据配置创建清理任务的状态存储"""
+    if PURGE_JOB_BACKEND == "redis":
+        store = RedisPurgeJobStore(url=REDIS_URL, ttl=PURGE_JOB_TTL, heartbeat_ttl=PURGE_JOB_HEARTBEAT_TTL)
+    else:
+        store = MemoryPurgeJobStore(ttl=PURGE_JOB_TTL)
+    return PurgeJobs(store, background_enabled=PURGE_BACKGROUND_ENABLED)
+
+
+purge_jobs = create_purge_jobs()
@@ -0,0 +1,179 @@
+"""
+查询模块 - 提供问答记录与会话列表的公共查询，避免逐行回查数据库
+"""
+import os
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import select, update, func, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from .models import Question, Answer, Session
+
+# 会话列表的问题数量来源：True 读取 Session.question_count 冗余列，False 使用 GROUP BY 聚合
+USE_DENORMALIZED_QUESTION_COUNT = os.getenv("USE_DENORMALIZED_QUESTION_COUNT", "False").lower() == "true"
+
+
+def _questions_with_answers():
+    """问题 LEFT OUTER JOIN 回答的基础查询"""
+    return select(Question).options(joinedload(Question.answer))
+
+
+def encode_cursor(question: Question) -> str:
+    """将问题的 (create_time, id) 编码为分页游标"""
+    return f"{question.create_time.isoformat()}_{question.id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """解析分页游标，格式错误时抛出 ValueError"""
+    create_time, _, question_id = cursor.rpartition("_")
+    return datetime.fromisoformat(create_time), int(question_id)
+
+
+def _before(cursor: Tuple[datetime, int]):
+    """(create_time, id) 严格早于游标位置的键集条件"""
+    create_time, question_id = cursor
+    return or_(
+        Question.create_time < create_time,
+        and_(Question.create_time == create_time, Question.id < question_id)
+    )
+
+
+async def get_user_questions(
+    db: AsyncSession,
+    user_id: int,
+    limit: Optional[int] = None,
+    before: Optional[Tuple[datetime, int]] = None
+) -> List[Question]:
+    """获取用户的问答记录，按时间倒序；指定 limit/before 时按键集分页"""
+    stmt = _questions_with_answers().where(Question.user_id == user_id)
+    if before:
+        stmt = stmt.where(_before(before))
+    stmt = stmt.order_by(Question.create_time.desc(), Question.id.desc())
+    if limit:
+        stmt = stmt.limit(limit)
+    result = await db.execute(stmt)
+    return result.scalars().all()
+
+
+async def get_session_questions(
+    db: AsyncSession,
+    session_id: int,
+    limit: Optional[int] = None,
+    before: Optional[Tuple[datetime, int]] = None
+) -> List[Question]:
+    """获取会话的问答记录，按时间正序；指定 limit/before 时返回游标之前最近的一页"""
+    stmt = _questions_with_answers().where(Question.session_id == session_id)
+    if before:
+        stmt = stmt.where(_before(before))
+    stmt = stmt.order_by(Question.create_time.desc(), Question.id.desc())
+    if limit:
+        stmt = stmt.limit(limit)
+    result = await db.execute(stmt)
+    return list(reversed(result.scalars().all()))
+
+
+async def stream_user_history(db: AsyncSession, user_id: int, batch_size: int = 500):
+    """以服务端游标逐批读取用户问答记录（按时间倒序），内存占用与记录总数无关"""
+    stmt = (
+        select(
+            Question.id,
+            Question.question,
+            Answer.answer,
+            Question.create_time,
+            Question.status,
+            Question.session_id
+        )
+        .outerjoin(Answer, Answer.question_id == Question.id)
+        .where(Question.user_id == user_id)
+        .order_by(Question.create_time.desc(), Question.id.desc())
+        .execution_options(yield_per=batch_size)
+    )
+    result = await db.stream(stmt)
+    async for row in result:
+        yield row
+
+
+async def get_recent_rounds(db: AsyncSession, user_id: int, session_id: Optional[int], limit: int = 100) -> List[Question]:
+    """获取会话最近的问答记录（用于构建对话上下文），按时间正序返回"""
+    result = await db.execute(
+        _questions_with_answers()
+        .where(
+            Question.user_id == user_id,
+            Question.session_id == session_id
+        )
+        .order_by(Question.create_time.desc(), Question.id.desc())
+        .limit(limit)
+    )
+    return list(reversed(result.scalars().all()))
+
+
+async def get_user_sessions(db: AsyncSession, user_id: int) -> List[Tuple[Session, int]]:
+    """获取用户的活跃会话及其问题数量，按更新时间倒序，单次查询完成"""
+    if USE_DENORMALIZED_QUESTION_COUNT:
+        stmt = select(Session, Session.question_count)
+    else:
+        counts = (
+            select(Question.session_id, func.count(Question.id).label("question_count"))
+            .where(Question.user_id == user_id)
+            .group_by(Question.session_id)
+            .subquery()
+        )
+        stmt = (
+            select(Session, func.coalesce(counts.c.question_count, 0))
+            .outerjoin(counts, counts.c.session_id == Session.id)
+        )
+    result = await db.execute(
+        stmt.where(
+            Session.user_id == user_id,
+            Session.status == 1
+        ).order_by(Session.update_time.desc())
+    )
+    return result.all()
+
+
+async def increment_question_count(db: AsyncSession, session_id: int, delta: int = 1):
+    """在当前事务中调整会话的冗余问题计数（由调用方提交）"""
+    await db.execute(
+        update(Session)
+        .where(Session.id == session_id)
+        # 显式保留 update_time，避免 onupdate 改变会话排序
+        .values(question_count=Session.question_count + delta, update_time=Session.update_time)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def reset_question_counts(db: AsyncSession, user_id: int):
+    """在当前事务中清零用户所有会话的冗余问题计数并清除上下文摘要（由调用方提交）"""
+    await db.execute(
+        update(Session)
+        .where(Session.user_id == user_id)
+        # 摘要由已删除的问答生成，保留会在下一轮提示词中带出已清空的内容
+        .values(
+            question_count=0,
+            context_summary=None,
+            history_version=Session.history_version + 1,
+            update_time=Session.update_time
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def bump_history_versions(db: AsyncSession, user_id: int):
+    """在当前事务中递增用户所有会话的历史版本，使各进程内存中的上下文窗口失效（由调用方提交）"""
+    await db.execute(
+        update(Session)
+        .where(Session.user_id == user_id)
+        .values(history_version=Session.history_version + 1, update_time=Session.update_time)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def bump_session_history_version(db: AsyncSession, session_id: int):
+    """在当前事务中递增单个会话的历史版本（由调用方提交）"""
+    await db.execute(
+        update(Session)
+        .where(Session.id == session_id)
+        .values(history_version=Session.history_version + 1, update_time=Session.update_time)
+        .execution_options(synchronize_session=False)
+    )
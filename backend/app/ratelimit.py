@@ -0,0 +1,310 @@
+"""
+限流存储模块 - 多 worker 共享的限流计数与按用户的令牌桶
+
+RATE_LIMIT_STORAGE_URI 同时决定 slowapi 请求计数和令牌桶的存储位置：
+- memory://            进程内存储，每个 worker 独立计数（默认）
+- sqlite:///path.db    单机多 worker 共享（WAL 模式的 SQLite 文件）
+- redis://host:port/0  多实例共享（任意兼容 Redis 协议的服务）
+"""
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+from limits.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+# 限流配置
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+USER_RATE_LIMIT_PER_MINUTE = int(os.getenv("USER_RATE_LIMIT_PER_MINUTE", "60"))  # 每个用户的提问令牌补充速率，0 为关闭
+USER_RATE_LIMIT_BURST = int(os.getenv("USER_RATE_LIMIT_BURST", "20"))  # 令牌桶容量（允许的突发请求数）
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))  # 每个用户每分钟可消耗的 LLM token 数，0 为关闭
+LLM_TOKENS_BURST = int(os.getenv("LLM_TOKENS_BURST", "0"))  # token 预算上限，0 表示等于每分钟配额
+
+# 每执行多少次写入清理一次过期记录
+_PURGE_EVERY = 1000
+
+
+def sqlite_path(uri: str) -> str:
+    """sqlite:///relative.db -> relative.db，sqlite:////abs.db -> /abs.db"""
+    path = uri.split("://", 1)[1][1:]
+    if not path:
+        raise ValueError(f"无效的 SQLite 限流存储地址: {uri}")
+    return path
+
+
+class SQLiteDatabase:
+    """SQLite 文件连接：每个线程一个连接，写事务使用 BEGIN IMMEDIATE 在多进程间串行化"""
+
+    def __init__(self, path: str, schema: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.schema = schema
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(self.schema)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+class SQLiteStorage(Storage):
+    """limits 的 SQLite 存储，供 slowapi 的固定窗口计数在同一主机的多个 worker 间共享"""
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri: str, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.db = SQLiteDatabase(sqlite_path(uri), (
+            "CREATE TABLE IF NOT EXISTS rate_limits ("
+            "key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL)"
+        ))
+        self._writes = 0
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+        now = time.time()
+        self._writes += 1
+        with self.db.transaction() as conn:
+            if self._writes % _PURGE_EVERY == 0:
+                conn.execute("DELETE FROM rate_limits WHERE expires_at <= ?", (now,))
+            else:
+                conn.execute("DELETE FROM rate_limits WHERE key = ? AND expires_at <= ?", (key, now))
+            conn.execute(
+                "INSERT INTO rate_limits (key, count, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET count = count + excluded.count",
+                (key, amount, now + expiry)
+            )
+            if elastic_expiry:
+                conn.execute("UPDATE rate_limits SET expires_at = ? WHERE key = ?", (now + expiry, key))
+            return conn.execute("SELECT count FROM rate_limits WHERE key = ?", (key,)).fetchone()[0]
+
+    def get(self, key: str) -> int:
+        row = self.db.connection().execute(
+            "SELECT count FROM rate_limits WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key: str) -> float:
+        now = time.time()
+        row = self.db.connection().execute(
+            "SELECT expires_at FROM rate_limits WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return row[0] if row else now
+
+    def check(self) -> bool:
+        try:
+            self.db.connection().execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> Optional[int]:
+        with self.db.transaction() as conn:
+            return conn.execute("DELETE FROM rate_limits").rowcount
+
+    def clear(self, key: str) -> None:
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+
+class MemoryBucketStore:
+    """进程内令牌桶存储"""
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}  # key -> (tokens, 更新时间, 补满时间)
+        self._writes = 0
+
+    async def take(self, key: str, amount: float, minimum: Optional[float],
+                   rate: float, capacity: float) -> Tuple[bool, float]:
+        now = time.time()
+        self._writes += 1
+        if self._writes % _PURGE_EVERY == 0:
+            # 已补满的桶与新建的桶等价，可以删除
+            self._buckets = {k: v for k, v in self._buckets.items() if v[2] > now}
+        tokens, updated_at, _ = self._buckets.get(key, (capacity, now, now))
+        tokens = min(capacity, tokens + max(0.0, now - updated_at) * rate)
+        allowed = minimum is None or tokens >= minimum
+        if allowed:
+            tokens -= amount
+        self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+        return allowed, tokens
+
+    async def close(self):
+        self._buckets.clear()
+
+
+class SQLiteBucketStore:
+    """SQLite 令牌桶存储，单机多 worker 共享；数据库操作在线程池中执行"""
+
+    def __init__(self, path: str):
+        self.db = SQLiteDatabase(path, (
+            "CREATE TABLE IF NOT EXISTS token_buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, full_at REAL NOT NULL)"
+        ))
+        self._writes = 0
+
+    def _take(self, key: str, amount: float, minimum: Optional[float],
+              rate: float, capacity: float) -> Tuple[bool, float]:
+        now = time.time()
+        self._writes += 1
+        with self.db.transaction() as conn:
+            if self._writes % _PURGE_EVERY == 0:
+                conn.execute("DELETE FROM token_buckets WHERE full_at <= ?", (now,))
+            row = conn.execute("SELECT tokens, updated_at FROM token_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated_at = row if row else (capacity, now)
+            tokens = min(capacity, tokens + max(0.0, now - updated_at) * rate)
+            allowed = minimum is None or tokens >= minimum
+            if allowed:
+                tokens -= amount
+            conn.execute(
+                "INSERT OR REPLACE INTO token_buckets (key, tokens, updated_at, full_at) VALUES (?, ?, ?, ?)",
+                (key, tokens, now, now + (capacity - tokens) / rate)
+            )
+        return allowed, tokens
+
+    async def take(self, key: str, amount: float, minimum: Optional[float],
+                   rate: float, capacity: float) -> Tuple[bool, float]:
+        return await asyncio.to_thread(self._take, key, amount, minimum, rate, capacity)
+
+    async def close(self):
+        pass
+
+
+# 读取、补充、扣减在一个脚本内原子完成；使用服务端时钟，避免多实例时钟偏差
+_TAKE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local amount = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or capacity
+local ts = tonumber(data[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if ARGV[4] == '' or tokens >= tonumber(ARGV[4]) then
+    tokens = tokens - amount
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBucketStore:
+    """Redis 协议令牌桶存储，多实例共享；可传入任意兼容 redis.asyncio 接口（支持 EVAL）的客户端"""
+
+    def __init__(self, client=None, url: str = "redis://localhost:6379/0", prefix: str = "token_bucket:"):
+        if client is None:
+            import redis.asyncio as redis
+            client = redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(_TAKE_SCRIPT)
+
+    async def take(self, key: str, amount: float, minimum: Optional[float],
+                   rate: float, capacity: float) -> Tuple[bool, float]:
+        allowed, tokens = await self._script(
+            keys=[self.prefix + key],
+            args=[rate, capacity, amount, "" if minimum is None else minimum]
+        )
+        return bool(int(allowed)), float(tokens)
+
+    async def close(self):
+        await self.client.close()
+
+
+class TokenBucket:
+    """按键（用户ID）限流的令牌桶；存储故障时放行，不影响正常问答"""
+
+    def __init__(self, store=None, name: str = "bucket", per_minute: int = 0, burst: int = 0):
+        self.store = store  # 为 None 时限流关闭
+        self.name = name
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0  # 每秒补充的令牌数
+        self.capacity = float(burst or per_minute)
+        self.limited = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.store is not None and self.rate > 0
+
+    async def _take(self, key, amount: float, minimum: Optional[float]) -> float:
+        """扣减令牌，返回需要等待的秒数，0 表示放行"""
+        if not self.enabled:
+            return 0.0
+        try:
+            allowed, tokens = await self.store.take(f"{self.name}:{key}", amount, minimum, self.rate, self.capacity)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("限流存储访问失败，本次放行: %s", e)
+            return 0.0
+        if allowed:
+            return 0.0
+        self.limited += 1
+        return (minimum - tokens) / self.rate
+
+    async def acquire(self, key, cost: float = 1) -> float:
+        """令牌足够时扣减 cost 个，返回需要等待的秒数"""
+        return await self._take(key, cost, cost)
+
+    async def check_balance(self, key) -> float:
+        """只检查是否还有余量，不扣减；用于事后按实际用量计费的预算"""
+        return await self._take(key, 0, 1)
+
+    async def charge(self, key, cost: float):
+        """按实际用量扣减，可透支为负数，后续请求需等待补回"""
+        if cost > 0:
+            await self._take(key, cost, None)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "per_minute": self.per_minute,
+            "burst": int(self.capacity),
+            "limited": self.limited,
+            "errors": self.errors
+        }
+
+
+def create_bucket_store(uri: str = RATE_LIMIT_STORAGE_URI):
+    """根据限流存储地址创建令牌桶存储"""
+    if uri.startswith("sqlite://"):
+        return SQLiteBucketStore(sqlite_path(uri))
+    if uri.startswith(("redis://", "rediss://")):
+        return RedisBucketStore(url=uri)
+    return MemoryBucketStore()
+
+
+bucket_store = create_bucket_store()
+user_request_limiter = TokenBucket(bucket_store, "user_requests", USER_RATE_LIMIT_PER_MINUTE, USER_RATE_LIMIT_BURST)
+llm_token_budget = TokenBucket(bucket_store, "llm_tokens", LLM_TOKENS_PER_MINUTE, LLM_TOKENS_BURST)
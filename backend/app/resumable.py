@@ -0,0 +1,406 @@
+"""
+可恢复流模块 - 为进行中的回答保留有界的事件回放缓冲，断线重连时按 Last-Event-ID 续传
+
+回答在独立任务中生成并写入回放缓冲，流式响应只是缓冲的订阅者：连接中断不会立即取消上游，
+宽限期内带 Last-Event-ID 重连即可从断点继续，无需新建问题记录或重新调用 LLM。
+用户主动停止生成时由客户端显式取消，不经过宽限期。
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from .cache import REDIS_URL
+from .streaming import STREAM_DISCONNECT_POLL_INTERVAL, encode_data
+
+logger = logging.getLogger(__name__)
+
+# 可恢复流配置
+STREAM_RESUME_ENABLED = os.getenv("STREAM_RESUME_ENABLED", "True").lower() == "true"
+STREAM_REPLAY_BACKEND = os.getenv("STREAM_REPLAY_BACKEND", "memory")  # memory | redis
+STREAM_REPLAY_MAX_EVENTS = int(os.getenv("STREAM_REPLAY_MAX_EVENTS", "2000"))  # 每个回答保留的事件数
+STREAM_REPLAY_TTL = int(os.getenv("STREAM_REPLAY_TTL", "300"))  # 回答结束后缓冲保留时间（秒）
+STREAM_RESUME_GRACE = float(os.getenv("STREAM_RESUME_GRACE", "30"))  # 客户端全部断开后继续生成、等待重连的时间（秒）
+STREAM_REPLAY_POLL_INTERVAL = float(os.getenv("STREAM_REPLAY_POLL_INTERVAL", "0.1"))  # Redis 后端订阅者的轮询间隔（秒）
+
+ReplayEvent = Tuple[int, str]  # (序号, 事件数据)
+
+
+def format_event_id(stream_id: int, seq: int) -> str:
+    return f"{stream_id}-{seq}"
+
+
+def parse_event_id(value: str) -> Optional[Tuple[int, int]]:
+    """解析 Last-Event-ID，格式为 <问题ID>-<序号>；无效时返回 None"""
+    stream_id, _, seq = value.strip().partition("-")
+    if not (stream_id.isdigit() and seq.isdigit()):
+        return None
+    return int(stream_id), int(seq)
+
+
+class _ReplayBuffer:
+    def __init__(self, user_id: int, max_events: int):
+        self.user_id = user_id
+        self.events: Deque[ReplayEvent] = deque(maxlen=max_events)
+        self.done = False
+        self.subscribers = 0
+        self.detached_at = time.monotonic()
+        self.cancelled_seq: Optional[int] = None  # 用户停止生成时客户端已收到的最后序号（未知时为 0）
+        self._changed = asyncio.Event()
+
+    def notify(self):
+        # 唤醒当前所有等待者，并为下一轮等待换上新的事件
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class MemoryReplayStore:
+    """进程内回放缓冲；只有生成回答的 worker 能续传（多 worker 部署需开启会话粘滞或使用 Redis）"""
+
+    def __init__(self, max_events: int = 2000, ttl: int = 300):
+        self.max_events = max_events
+        self.ttl = ttl
+        self._buffers: Dict[int, _ReplayBuffer] = {}
+        self._expiry: Deque[Tuple[float, int]] = deque()  # 按结束顺序排列，TTL 相同因此也按过期顺序
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        while self._expiry and self._expiry[0][0] <= now:
+            _, stream_id = self._expiry.popleft()
+            self._buffers.pop(stream_id, None)
+
+    async def create(self, stream_id: int, user_id: int):
+        self._evict_expired()
+        self._buffers[stream_id] = _ReplayBuffer(user_id, self.max_events)
+
+    async def get_owner(self, stream_id: int) -> Optional[int]:
+        self._evict_expired()
+        buffer = self._buffers.get(stream_id)
+        return buffer.user_id if buffer else None
+
+    async def append(self, stream_id: int, seq: int, data: str):
+        buffer = self._buffers.get(stream_id)
+        if buffer is not None:
+            buffer.events.append((seq, data))
+            buffer.notify()
+
+    async def finish(self, stream_id: int):
+        buffer = self._buffers.get(stream_id)
+        if buffer is not None:
+            buffer.done = True
+            buffer.notify()
+            self._expiry.append((time.monotonic() + self.ttl, stream_id))
+
+    async def read(self, stream_id: int, after_seq: int) -> Optional[Tuple[List[ReplayEvent], bool]]:
+        """返回序号大于 after_seq 的事件及是否已结束；缓冲不存在时返回 None"""
+        buffer = self._buffers.get(stream_id)
+        if buffer is None:
+            return None
+        return [event for event in buffer.events if event[0] > after_seq], buffer.done
+
+    async def wait(self, stream_id: int, timeout: float):
+        buffer = self._buffers.get(stream_id)
+        if buffer is None:
+            return
+        try:
+            await asyncio.wait_for(buffer._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def attach(self, stream_id: int):
+        buffer = self._buffers.get(stream_id)
+        if buffer is not None:
+            buffer.subscribers += 1
+
+    async def detach(self, stream_id: int):
+        buffer = self._buffers.get(stream_id)
+        if buffer is not None:
+            buffer.subscribers -= 1
+            buffer.detached_at = time.monotonic()
+
+    async def cancel(self, stream_id: int, seen_seq: int):
+        buffer = self._buffers.get(stream_id)
+        if buffer is not None:
+            buffer.cancelled_seq = seen_seq
+
+    async def get_cancelled_seq(self, stream_id: int) -> Optional[int]:
+        buffer = self._buffers.get(stream_id)
+        return buffer.cancelled_seq if buffer is not None else None
+
+    async def idle_time(self, stream_id: int) -> Optional[float]:
+        """无订阅者的持续时间（秒），有订阅者时为 0，已被用户停止时为无穷大；缓冲不存在时返回 None"""
+        buffer = self._buffers.get(stream_id)
+        if buffer is None:
+            return None
+        if buffer.cancelled_seq is not None:
+            return float("inf")
+        return 0.0 if buffer.subscribers > 0 else time.monotonic() - buffer.detached_at
+
+    def __len__(self) -> int:
+        return len(self._buffers)
+
+    async def close(self):
+        self._buffers.clear()
+
+
+class RedisReplayStore:
+    """
+    Redis 回放缓冲，多 worker 共享：任意 worker 都能续传其他 worker 正在生成的回答。
+    订阅者以轮询方式读取新事件；worker 异常退出遗留的订阅计数只会让生成照常完成，不影响正确性。
+    """
+
+    def __init__(self, client=None, url: str = REDIS_URL, max_events: int = 2000, ttl: int = 300,
+                 poll_interval: float = 0.1, prefix: str = "stream_replay:"):
+        if client is None:
+            import redis.asyncio as redis
+            client = redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.max_events = max_events
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.prefix = prefix
+
+    def _keys(self, stream_id: int) -> Tuple[str, str]:
+        return f"{self.prefix}{stream_id}:events", f"{self.prefix}{stream_id}:meta"
+
+    async def create(self, stream_id: int, user_id: int):
+        _, meta_key = self._keys(stream_id)
+        # 生成期间同样设置过期时间，防止 worker 异常退出后遗留数据
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hset(meta_key, mapping={"user_id": user_id, "done": 0, "subscribers": 0, "detached_at": time.time()})
+            pipe.expire(meta_key, self.ttl)
+            await pipe.execute()
+
+    async def get_owner(self, stream_id: int) -> Optional[int]:
+        _, meta_key = self._keys(stream_id)
+        user_id = await self.client.hget(meta_key, "user_id")
+        return int(user_id) if user_id is not None else None
+
+    async def append(self, stream_id: int, seq: int, data: str):
+        events_key, meta_key = self._keys(stream_id)
+        async with self.client.pipeline(transaction=False) as pipe:
+            # 有序集合以序号为分值，续传时按分值区间读取断点之后的事件
+            pipe.zadd(events_key, {json.dumps([seq, data], ensure_ascii=False): seq})
+            pipe.zremrangebyrank(events_key, 0, -self.max_events - 1)
+            pipe.expire(events_key, self.ttl)
+            pipe.expire(meta_key, self.ttl)
+            await pipe.execute()
+
+    async def finish(self, stream_id: int):
+        events_key, meta_key = self._keys(stream_id)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hset(meta_key, "done", 1)
+            pipe.expire(events_key, self.ttl)
+            pipe.expire(meta_key, self.ttl)
+            await pipe.execute()
+
+    async def read(self, stream_id: int, after_seq: int) -> Optional[Tuple[List[ReplayEvent], bool]]:
+        events_key, meta_key = self._keys(stream_id)
+        # 事务内同时读取事件与结束标记，保证读到结束标记时事件已完整
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hget(meta_key, "done")
+            pipe.zrangebyscore(events_key, f"({after_seq}", "+inf")
+            done, raw_events = await pipe.execute()
+        if done is None:
+            return None
+        return [tuple(json.loads(raw)) for raw in raw_events], done == "1"
+
+    async def wait(self, stream_id: int, timeout: float):
+        await asyncio.sleep(min(timeout, self.poll_interval))
+
+    async def attach(self, stream_id: int):
+        _, meta_key = self._keys(stream_id)
+        await self.client.hincrby(meta_key, "subscribers", 1)
+
+    async def detach(self, stream_id: int):
+        _, meta_key = self._keys(stream_id)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hincrby(meta_key, "subscribers", -1)
+            pipe.hset(meta_key, "detached_at", time.time())
+            await pipe.execute()
+
+    async def cancel(self, stream_id: int, seen_seq: int):
+        _, meta_key = self._keys(stream_id)
+        await self.client.hset(meta_key, "cancelled", seen_seq)
+
+    async def get_cancelled_seq(self, stream_id: int) -> Optional[int]:
+        _, meta_key = self._keys(stream_id)
+        seen_seq = await self.client.hget(meta_key, "cancelled")
+        return int(seen_seq) if seen_seq is not None else None
+
+    async def idle_time(self, stream_id: int) -> Optional[float]:
+        _, meta_key = self._keys(stream_id)
+        subscribers, detached_at, cancelled = await self.client.hmget(meta_key, "subscribers", "detached_at", "cancelled")
+        if subscribers is None:
+            return None
+        if cancelled is not None:
+            return float("inf")
+        return 0.0 if int(subscribers) > 0 else time.time() - float(detached_at)
+
+    async def close(self):
+        await self.client.close()
+
+
+class StreamWriter:
+    """回答生成任务向回放缓冲写入事件"""
+
+    def __init__(self, store, stream_id: int):
+        self.store = store
+        self.stream_id = stream_id
+        self.seq = 0
+
+    async def emit(self, payload: dict):
+        self.seq += 1
+        await self.store.append(self.stream_id, self.seq, encode_data(payload))
+
+    async def close(self):
+        try:
+            await self.store.finish(self.stream_id)
+        except Exception as e:
+            logger.warning("标记回放缓冲结束失败，问题ID: %s，错误: %s", self.stream_id, e)
+
+
+class SubscriberWatch:
+    """
+    供 relay_chunks 轮询的连接状态：所有订阅者离开超过宽限期后视为客户端断开，生成任务随之取消上游。
+    """
+
+    def __init__(self, store, stream_id: int, grace: float, check_interval: float = STREAM_DISCONNECT_POLL_INTERVAL):
+        self.store = store
+        self.stream_id = stream_id
+        self.grace = grace
+        self.check_interval = check_interval
+        self._next_check = 0.0
+
+    async def is_disconnected(self) -> bool:
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self.check_interval
+        try:
+            idle = await self.store.idle_time(self.stream_id)
+        except Exception as e:
+            logger.warning("读取订阅状态失败，问题ID: %s，错误: %s", self.stream_id, e)
+            return False
+        # 至少留出一个检查间隔，供刚创建的响应完成订阅
+        return idle is None or idle > self.grace + self.check_interval
+
+
+class ResumableStreams:
+    """管理进行中回答的回放缓冲与订阅"""
+
+    def __init__(self, store, enabled: bool = True, grace: float = 30.0):
+        self.store = store
+        self.enabled = enabled
+        # 关闭续传时不保留宽限期，客户端断开即取消上游
+        self.grace = grace if enabled else 0.0
+        self.resumed = 0
+        self.gaps = 0
+        self.cancelled = 0
+        self._tasks: Dict[int, asyncio.Task] = {}  # 本进程中正在生成的回答任务
+
+    async def start(self, stream_id: int, user_id: int) -> StreamWriter:
+        await self.store.create(stream_id, user_id)
+        return StreamWriter(self.store, stream_id)
+
+    def track(self, stream_id: int, task: asyncio.Task):
+        """登记生成任务，用户停止生成时在本进程内直接取消"""
+        self._tasks[stream_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(stream_id, None))
+
+    async def cancel(self, stream_id: int, seen_seq: Optional[int] = None):
+        """
+        用户停止生成：标记缓冲（其他 worker 上的生成任务在下次检查连接时停止），
+        任务在本进程时立即取消，不等待续传宽限期。seen_seq 为客户端已收到的最后序号。
+        """
+        await self.store.cancel(stream_id, seen_seq or 0)
+        self.cancelled += 1
+        task = self._tasks.get(stream_id)
+        if task is not None:
+            task.cancel()
+
+    async def delivered_seq(self, stream_id: int) -> Optional[int]:
+        """用户停止生成时客户端已收到的最后序号；未被停止或序号未知时返回 None"""
+        try:
+            seen_seq = await self.store.get_cancelled_seq(stream_id)
+        except Exception as e:
+            logger.warning("读取停止状态失败，问题ID: %s，错误: %s", stream_id, e)
+            return None
+        return seen_seq or None
+
+    def watch(self, stream_id: int) -> SubscriberWatch:
+        return SubscriberWatch(self.store, stream_id, self.grace)
+
+    async def owner(self, stream_id: int) -> Optional[int]:
+        return await self.store.get_owner(stream_id)
+
+    def _format(self, stream_id: int, seq: int, data: str) -> str:
+        if self.enabled:
+            return f"id: {format_event_id(stream_id, seq)}\ndata: {data}\n\n"
+        return f"data: {data}\n\n"
+
+    async def subscribe(self, request, stream_id: int, after_seq: int = 0) -> AsyncIterator[str]:
+        """订阅回放缓冲，输出序号大于 after_seq 的 SSE 事件，直至回答结束或客户端断开"""
+        if after_seq:
+            self.resumed += 1
+            logger.info("续传流式回答，问题ID: %s，断点序号: %s", stream_id, after_seq)
+        await self.store.attach(stream_id)
+        try:
+            while True:
+                result = await self.store.read(stream_id, after_seq)
+                if result is None:
+                    return
+                events, done = result
+                if events and events[0][0] > after_seq + 1:
+                    # 断点之后的事件已被淘汰出有界缓冲，无法无缝续传
+                    self.gaps += 1
+                    yield self._format(stream_id, events[-1][0], encode_data({
+                        "type": "error",
+                        "data": {"error": "回答过长，无法从断点续传，请刷新后查看完整回答", "question_id": stream_id}
+                    }))
+                    return
+                for seq, data in events:
+                    yield self._format(stream_id, seq, data)
+                    after_seq = seq
+                if done:
+                    return
+                if not events:
+                    await self.store.wait(stream_id, STREAM_DISCONNECT_POLL_INTERVAL)
+                if await request.is_disconnected():
+                    return
+        finally:
+            try:
+                await self.store.detach(stream_id)
+            except Exception as e:
+                logger.warning("注销订阅失败，问题ID: %s，错误: %s", stream_id, e)
+
+    async def close(self):
+        await self.store.close()
+
+    def stats(self) -> dict:
+        stats = {
+            "enabled": self.enabled,
+            "backend": "redis" if isinstance(self.store, RedisReplayStore) else "memory",
+            "resumed": self.resumed,
+            "gaps": self.gaps,
+            "cancelled": self.cancelled
+        }
+        if isinstance(self.store, MemoryReplayStore):
+            stats["buffers"] = len(self.store)
+        return stats
+
+
+def create_resumable_streams() -> ResumableStreams:
+    """根据配置创建回放缓冲存储"""
+    if STREAM_RESUME_ENABLED and STREAM_REPLAY_BACKEND == "redis":
+        store = RedisReplayStore(url=REDIS_URL, max_events=STREAM_REPLAY_MAX_EVENTS, ttl=STREAM_REPLAY_TTL,
+                                 poll_interval=STREAM_REPLAY_POLL_INTERVAL)
+    else:
+        store = MemoryReplayStore(max_events=STREAM_REPLAY_MAX_EVENTS, ttl=STREAM_REPLAY_TTL)
+    return ResumableStreams(store, enabled=STREAM_RESUME_ENABLED, grace=STREAM_RESUME_GRACE)
+
+
+resumable_streams = create_resumable_streams()
@@ -3,23 +3,92 @@
 """
 import os
 import re
+import html
+import math
 from typing import Optional
 from fastapi import HTTPException, Request, status
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 import logging
+from .ratelimit import RATE_LIMIT_STORAGE_URI, user_request_limiter, llm_token_budget
 
 logger = logging.getLogger(__name__)
 
-# 创建限流器
-limiter = Limiter(key_func=get_remote_address)
+# 创建限流器：计数存储由 RATE_LIMIT_STORAGE_URI 指定，共享存储不可用时回退为进程内计数
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri=RATE_LIMIT_STORAGE_URI,
+    in_memory_fallback_enabled=not RATE_LIMIT_STORAGE_URI.startswith("memory://")
+)
 
 def get_rate_limit() -> str:
     """获取限流配置"""
     rate_limit = os.getenv("RATE_LIMIT_PER_MINUTE", "60")
     return f"{rate_limit}/minute"
 
+async def enforce_user_quota(user_id: int, request: Optional[Request] = None):
+    """
+    按用户ID限流，在创建问题之前调用
+    - 提问次数：令牌桶，允许短时突发
+    - LLM token 预算：按实际消耗事后扣减，预算耗尽后拒绝新问题直到补回
+    """
+    retry_after = await user_request_limiter.acquire(user_id)
+    detail = "提问过于频繁，请稍后再试"
+    if not retry_after:
+        retry_after = await llm_token_budget.check_balance(user_id)
+        detail = "AI 使用额度已用尽，请稍后再试"
+    if retry_after:
+        log_security_event("USER_RATE_LIMITED", f"用户 {user_id}: {detail}", request)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=detail,
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
+# 潜在恶意内容的检查（不区分大小写），模式只编译一次；每一项都是对输入的线性扫描，不会逐字符回溯
+_SCRIPT_PROTOCOL = re.compile(r"javascript:", re.IGNORECASE)
+# 事件属性 on\w+\s*=：先查找 on\w，再检查所在单词之后是否紧跟等号
+_EVENT_HANDLER = re.compile(r"on\w", re.IGNORECASE)
+_WORD_TAIL = re.compile(r"\w*(\s*=)?")
+# <tag[^>]*>.*?</tag>：每种标签的 (开头, 闭合) 模式
+_TAGS = [
+    (re.compile(f"<{tag}", re.IGNORECASE), re.compile(f"</{tag}>", re.IGNORECASE))
+    for tag in ("script", "iframe", "object", "embed")
+]
+
+def _has_event_handler(text: str) -> bool:
+    """等价于 on\\w+\\s*=；同一单词中的 on 结果相同，检查后从单词末尾继续"""
+    if "=" not in text:
+        return False
+    pos = 0
+    while True:
+        match = _EVENT_HANDLER.search(text, pos)
+        if match is None:
+            return False
+        tail = _WORD_TAIL.match(text, match.end())
+        if tail.group(1):
+            return True
+        pos = tail.end()
+
+def _has_closed_tag(text: str) -> bool:
+    """
+    等价于 <tag[^>]*>.*?</tag>：标签开头之后的第一个 > 之后出现闭合标签。
+    最早出现的开头对应最早的 >，每种标签只需检查第一次出现的位置
+    """
+    for opening, closing in _TAGS:
+        match = opening.search(text)
+        if match is None:
+            continue
+        end = text.find(">", match.end())
+        if end >= 0 and closing.search(text, end + 1):
+            return True
+    return False
+
+def contains_dangerous_content(text: str) -> bool:
+    """检查文本是否包含潜在的恶意脚本，耗时与文本长度成线性关系"""
+    return bool(_SCRIPT_PROTOCOL.search(text)) or _has_event_handler(text) or _has_closed_tag(text)
+
 def validate_user_input(text: str, max_length: int = 1000) -> bool:
     """
     验证用户输入
@@ -27,7 +96,7 @@ def validate_user_input(text: str, max_length: int = 1000) -> bool:
     - 检查是否包含恶意内容
     - 基本的XSS防护
     """
-    if not text or len(text.strip()) == 0:
+    if not text or text.isspace():
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="输入内容不能为空"
@@ -40,45 +109,23 @@ def validate_user_input(text: str, max_length: int = 1000) -> bool:
         )
     
     # 检查潜在的恶意脚本
-    dangerous_patterns = [
-        r'<script[^>]*>.*?</script>',
-        r'javascript:',
-        r'on\w+\s*=',
-        r'<iframe[^>]*>.*?</iframe>',
-        r'<object[^>]*>.*?</object>',
-        r'<embed[^>]*>.*?</embed>',
-    ]
-    
-    for pattern in dangerous_patterns:
-        if re.search(pattern, text, re.IGNORECASE | re.DOTALL):
-            logger.warning(f"检测到潜在恶意输入: {text[:100]}...")
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="输入内容包含不安全的字符"
-            )
+    if contains_dangerous_content(text):
+        logger.warning("检测到潜在恶意输入: %s...", text[:100])
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="输入内容包含不安全的字符"
+        )
     
     return True
 
 def sanitize_output(text: str) -> str:
     """
     清理输出内容，防止XSS攻击
+    转义 & < > " '（' 转为 &#x27;），& 最先转义，不会重复转义
     """
     if not text:
         return ""
-    
-    # 转义HTML特殊字符
-    html_escape_table = {
-        "&": "&amp;",
-        '"': "&quot;",
-        "'": "&#x27;",
-        ">": "&gt;",
-        "<": "&lt;",
-    }
-    
-    for char, escape in html_escape_table.items():
-        text = text.replace(char, escape)
-    
-    return text
+    return html.escape(text, quote=True)
 
 def validate_user_id(user_id: int) -> bool:
     """验证用户ID"""
@@ -106,8 +153,6 @@ def log_security_event(event_type: str, details: str, request: Optional[Request]
         user_agent = request.headers.get("user-agent", "unknown")
     
     logger.warning(
-        f"安全事件 - 类型: {event_type}, "
-        f"详情: {details}, "
-        f"IP: {client_ip}, "
-        f"User-Agent: {user_agent}"
+        "安全事件 - 类型: %s, 详情: %s, IP: %s, User-Agent: %s",
+        event_type, details, client_ip, user_agent
     )
\ No newline at end of file
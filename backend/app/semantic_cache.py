@@ -0,0 +1,313 @@
+"""
+语义缓存模块 - 为语义相近的首轮问题复用已保存的回答
+
+使用本地哈希字符 n-gram 向量（无需网络或模型下载）和 NumPy 最近邻检索，
+索引可增量追加，并以 .npy 文件持久化，启动时以内存映射方式加载。
+多 worker 共用同一份索引文件：构建与落盘在文件锁内进行，索引只构建一次，落盘前合并其他 worker 写入的条目；
+等待文件锁与读写文件都在线程中执行，不阻塞事件循环。
+"""
+import os
+import zlib
+import asyncio
+import logging
+from typing import Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows 下仅支持单进程运行，无需文件锁
+    fcntl = None
+
+import numpy as np
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .cache import normalize_question
+from .models import Question, Answer
+from .persistence import QUESTION_ANSWERED
+
+logger = logging.getLogger(__name__)
+
+# 语义缓存配置
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "False").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))  # 余弦相似度阈值
+SEMANTIC_CACHE_DIM = int(os.getenv("SEMANTIC_CACHE_DIM", "1024"))
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", "data/semantic_index")
+SEMANTIC_CACHE_SAVE_EVERY = int(os.getenv("SEMANTIC_CACHE_SAVE_EVERY", "100"))  # 每新增多少条落盘一次
+
+
+class FileLock:
+    """以 path.lock 文件加排他锁，在多个 worker 进程之间串行化索引的构建与写入；acquire 会阻塞，需在线程中调用"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        if fcntl is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            lock_file = open(f"{self.path}.lock", "a")
+        except OSError as e:
+            logger.warning("无法创建语义索引锁文件，不加锁继续: %s", e)
+            return
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        self._file = lock_file
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class HashedNgramVectorizer:
+    """字符 n-gram 哈希向量化，结果为 L2 归一化的 float32 向量"""
+
+    def __init__(self, dim: int = 1024, ngram_range: Tuple[int, int] = (1, 3)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def transform(self, text: str) -> np.ndarray:
+        text = normalize_question(text)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        low, high = self.ngram_range
+        for n in range(low, high + 1):
+            for i in range(len(text) - n + 1):
+                # crc32 在各进程间稳定，保证持久化的索引可被其他 worker 复用
+                vector[zlib.crc32(text[i:i + n].encode("utf-8")) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+
+class VectorIndex:
+    """基于 NumPy 的暴力最近邻索引，支持增量追加与内存映射加载"""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, item_id: int, vector: np.ndarray):
+        if self._size == len(self._vectors):
+            # 容量翻倍；已有的行不再修改，正在进行的检索持有的视图保持有效
+            capacity = max(64, self._size * 2)
+            vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+            ids = np.zeros(capacity, dtype=np.int64)
+            vectors[:self._size] = self._vectors[:self._size]
+            ids[:self._size] = self._ids[:self._size]
+            self._vectors, self._ids = vectors, ids
+        self._vectors[self._size] = vector
+        self._ids[self._size] = item_id
+        self._size += 1
+
+    def snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self._vectors[:self._size], self._ids[:self._size]
+
+    @staticmethod
+    def search(snapshot: Tuple[np.ndarray, np.ndarray], vector: np.ndarray) -> Tuple[Optional[int], float]:
+        """返回 (最相似条目ID, 相似度)"""
+        vectors, ids = snapshot
+        if len(ids) == 0:
+            return None, 0.0
+        scores = vectors @ vector
+        best = int(np.argmax(scores))
+        return int(ids[best]), float(scores[best])
+
+    @staticmethod
+    def write(path: str, snapshot: Tuple[np.ndarray, np.ndarray]):
+        """以原子替换的方式写入 .npy 文件"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        vectors, ids = snapshot
+        for suffix, array in (("vectors", vectors), ("ids", ids)):
+            target = f"{path}.{suffix}.npy"
+            # 临时文件名带进程号，多个 worker 同时写入时互不覆盖
+            tmp = f"{path}.{suffix}.{os.getpid()}.tmp.npy"
+            np.save(tmp, array)
+            os.replace(tmp, target)
+
+    def _read(self, path: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        vectors_file, ids_file = f"{path}.vectors.npy", f"{path}.ids.npy"
+        if not (os.path.exists(vectors_file) and os.path.exists(ids_file)):
+            return None
+        vectors = np.load(vectors_file, mmap_mode="r")
+        ids = np.load(ids_file)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dim or len(vectors) != len(ids):
+            logger.warning("语义索引文件与当前配置不符，忽略: %s", path)
+            return None
+        return vectors, ids
+
+    def load(self, path: str) -> bool:
+        """以内存映射方式加载索引；文件不存在或维度不符时返回 False"""
+        arrays = self._read(path)
+        if arrays is None:
+            return False
+        self._vectors, self._ids = arrays
+        self._size = len(self._ids)
+        return True
+
+    def merge_write(self, path: str, snapshot: Tuple[np.ndarray, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        把快照与索引文件中快照尚未包含的条目（其他 worker 写入的）合并后写回文件，返回这些条目；
+        只读取文件与快照，不修改本索引，可在线程中执行
+        """
+        vectors, ids = snapshot
+        arrays = self._read(path)
+        if arrays is None:
+            extra_vectors, extra_ids = vectors[:0], ids[:0]
+        else:
+            missing = np.flatnonzero(~np.isin(arrays[1], ids))
+            extra_vectors, extra_ids = np.array(arrays[0][missing]), arrays[1][missing]
+        if len(extra_ids):
+            vectors, ids = np.concatenate([vectors, extra_vectors]), np.concatenate([ids, extra_ids])
+        self.write(path, (vectors, ids))
+        return extra_vectors, extra_ids
+
+    def extend(self, vectors: np.ndarray, ids: np.ndarray) -> int:
+        """追加本索引尚未包含的条目，返回追加的条数"""
+        missing = np.flatnonzero(~np.isin(ids, self._ids[:self._size]))
+        for row in missing:
+            self.add(int(ids[row]), vectors[row])
+        return len(missing)
+
+
+class SemanticCache:
+    """语义回答缓存：索引条目为已回答问题的ID，命中后从数据库读取对应回答"""
+
+    def __init__(self, enabled: bool = False, threshold: float = 0.9, dim: int = 1024, path: str = SEMANTIC_CACHE_PATH):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.path = path
+        self.vectorizer = HashedNgramVectorizer(dim)
+        self.index = VectorIndex(dim)
+        self._unsaved = 0
+        self._save_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+
+    async def load_or_build(self, db: AsyncSession):
+        """加载持久化索引；不存在时从数据库中已回答的会话首问构建"""
+        if not self.enabled:
+            return
+        # 第一个拿到锁的 worker 构建并落盘，其余 worker 等待后直接加载
+        lock = FileLock(self.path)
+        await asyncio.to_thread(lock.acquire)
+        try:
+            if await asyncio.to_thread(self.index.load, self.path):
+                logger.info("语义索引已加载，条目数: %s", len(self.index))
+                return
+            await self._build(db)
+            try:
+                await asyncio.to_thread(VectorIndex.write, self.path, self.index.snapshot())
+            except OSError as e:
+                logger.warning("保存语义索引失败: %s", e)
+        finally:
+            await asyncio.to_thread(lock.release)
+        logger.info("语义索引已从数据库构建，条目数: %s", len(self.index))
+
+    async def _build(self, db: AsyncSession):
+        # 只索引已完整回答的首问；中断的部分回答与服务不可用时的提示语不作为缓存来源
+        first_questions = (
+            select(func.min(Question.id))
+            .where(Question.session_id.isnot(None))
+            .group_by(Question.session_id)
+        )
+        rows = (await db.execute(
+            select(Question.id, Question.question)
+            .join(Answer, Answer.question_id == Question.id)
+            .where(Question.id.in_(first_questions), Question.status == QUESTION_ANSWERED)
+        )).all()
+        for question_id, text in rows:
+            self.index.add(question_id, self.vectorizer.transform(text))
+
+    async def lookup(self, db: AsyncSession, question: str) -> Optional[str]:
+        """查找语义相近的已回答问题，相似度达到阈值时返回其回答"""
+        if not self.enabled or len(self.index) == 0:
+            return None
+        vector = self.vectorizer.transform(question)
+        question_id, score = await asyncio.to_thread(VectorIndex.search, self.index.snapshot(), vector)
+        if question_id is None or score < self.threshold:
+            self.misses += 1
+            return None
+        answer = (await db.execute(
+            select(Answer.answer).where(Answer.question_id == question_id)
+        )).scalars().first()
+        if answer is None:
+            # 原记录已被删除
+            self.misses += 1
+            return None
+        self.hits += 1
+        logger.info("命中语义缓存，相似问题ID: %s，相似度: %.3f", question_id, score)
+        return answer
+
+    def add(self, question_id: int, question: str):
+        """将新保存的问答加入索引，并按配置周期性在后台落盘（同一时间只有一个落盘任务）"""
+        if not self.enabled:
+            return
+        self.index.add(question_id, self.vectorizer.transform(question))
+        self._unsaved += 1
+        if self._unsaved >= SEMANTIC_CACHE_SAVE_EVERY and self._save_task is None:
+            self._save_task = asyncio.create_task(self._background_save())
+
+    async def _background_save(self):
+        try:
+            await self.save()
+        finally:
+            self._save_task = None
+
+    async def save(self):
+        """在线程中加锁、合并其他 worker 写入的条目并落盘，合并得到的条目回到事件循环中追加"""
+        if not self.enabled:
+            return
+        saving = self._unsaved
+        try:
+            vectors, ids = await asyncio.to_thread(self._merge_write, self.index.snapshot())
+        except OSError as e:
+            logger.warning("保存语义索引失败: %s", e)
+            return
+        self.index.extend(vectors, ids)
+        self._unsaved = max(0, self._unsaved - saving)
+
+    def _merge_write(self, snapshot: Tuple[np.ndarray, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        with FileLock(self.path):
+            return self.index.merge_write(self.path, snapshot)
+
+    async def close(self):
+        """等待进行中的落盘任务，并保存尚未落盘的条目"""
+        if self._save_task is not None:
+            await self._save_task
+        if self._unsaved:
+            await self.save()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self.index),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+semantic_cache = SemanticCache(
+    enabled=SEMANTIC_CACHE_ENABLED,
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    dim=SEMANTIC_CACHE_DIM
+)
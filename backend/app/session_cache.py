@@ -0,0 +1,244 @@
+"""
+会话归属缓存模块 - 进程内缓存活跃会话的归属与状态，每轮对话省去一次会话校验查询
+
+缓存只在会话关闭/删除时失效（用户ID不会变化）。多 worker 部署时各进程通过 Redis 发布失效消息：
+消息带全局递增的版本号，订阅方发现版本不连续（漏收消息或重连）时清空整个缓存；
+订阅未建立期间不使用缓存，直接查询数据库。
+"""
+import os
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .cache import REDIS_URL
+from .models import Session
+
+logger = logging.getLogger(__name__)
+
+# 会话缓存配置
+SESSION_CACHE_ENABLED = os.getenv("SESSION_CACHE_ENABLED", "True").lower() == "true"
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", "300"))  # 缓存条目有效期（秒），兜底漏收的失效消息
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "10000"))
+SESSION_INVALIDATION_BACKEND = os.getenv("SESSION_INVALIDATION_BACKEND", "memory")  # memory 单进程 | redis 多 worker
+
+
+class CachedSession:
+    """缓存中的会话归属与状态"""
+
+    __slots__ = ("id", "user_id", "status", "history_version", "expires_at")
+
+    def __init__(self, session_id: int, user_id: int, status: int, history_version: int, expires_at: float):
+        self.id = session_id
+        self.user_id = user_id
+        self.status = status
+        self.history_version = history_version
+        self.expires_at = expires_at
+
+
+# 原子地递增版本号并发布 "版本:来源进程:会话ID"，保证消息按版本顺序发出
+PUBLISH_SCRIPT = """
+local version = redis.call('INCR', KEYS[1])
+redis.call('PUBLISH', KEYS[2], version .. ':' .. ARGV[1] .. ':' .. ARGV[2])
+return version
+"""
+
+
+class RedisInvalidationChannel:
+    """Redis 发布/订阅失效通道；可传入任意兼容 redis.asyncio 接口的客户端"""
+
+    def __init__(self, client=None, url: str = REDIS_URL, prefix: str = "session_cache:", reconnect_delay: float = 1.0):
+        if client is None:
+            import redis.asyncio as redis
+            client = redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.version_key = f"{prefix}version"
+        self.channel = f"{prefix}invalidate"
+        self.reconnect_delay = reconnect_delay
+        self.node_id = uuid.uuid4().hex
+        self.connected = False
+        self.version = 0
+        self._task: Optional[asyncio.Task] = None
+        self._script = client.register_script(PUBLISH_SCRIPT)
+
+    async def publish(self, session_id: int):
+        await self._script(keys=[self.version_key, self.channel], args=[self.node_id, session_id])
+
+    def start(self, cache: "SessionCache"):
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen(cache))
+
+    async def _listen(self, cache: "SessionCache"):
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                # 订阅建立之前缓存的条目可能已漏收失效消息，以当前版本为起点重新开始
+                self.version = int(await self.client.get(self.version_key) or 0)
+                cache.clear()
+                self.connected = True
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    version, origin, session_id = message["data"].split(":")
+                    version = int(version)
+                    if version <= self.version:
+                        continue
+                    if version != self.version + 1:
+                        logger.warning("会话失效消息版本不连续（%s -> %s），清空会话缓存", self.version, version)
+                        cache.clear()
+                        cache.resyncs += 1
+                    elif origin != self.node_id:
+                        cache.discard(int(session_id))
+                        cache.remote_invalidations += 1
+                    self.version = version
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("会话失效订阅中断，%s 秒后重连: %s", self.reconnect_delay, e)
+            finally:
+                self.connected = False
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.client.close()
+
+
+class SessionCache:
+    """
+    活跃会话归属的 TTL/LRU 缓存。
+    只缓存状态为活跃的会话；关闭、删除或其他 worker 写入该会话时失效。
+    """
+
+    def __init__(self, channel: Optional[RedisInvalidationChannel] = None, enabled: bool = True,
+                 ttl: int = 300, max_entries: int = 10000):
+        self.channel = channel
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, CachedSession]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.remote_invalidations = 0
+        self.resyncs = 0
+
+    @property
+    def usable(self) -> bool:
+        # 多 worker 模式下订阅中断期间可能漏收失效消息，不使用缓存
+        return self.enabled and (self.channel is None or self.channel.connected)
+
+    def get(self, session_id: int, user_id: int) -> Optional[CachedSession]:
+        """查找属于该用户的活跃会话，未命中返回 None"""
+        if not self.usable:
+            return None
+        entry = self._entries.get(session_id)
+        if entry is None or entry.expires_at < time.monotonic():
+            self.misses += 1
+            return None
+        self._entries.move_to_end(session_id)
+        if entry.user_id != user_id or entry.status != 1:
+            # 不属于该用户：交给数据库查询给出统一的 404
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, session):
+        """缓存从数据库读到（或新建）的活跃会话"""
+        if not self.usable or session.status != 1:
+            return
+        self._entries[session.id] = CachedSession(
+            session.id, session.user_id, session.status, session.history_version or 0, time.monotonic() + self.ttl
+        )
+        self._entries.move_to_end(session.id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def discard(self, session_id: int):
+        self._entries.pop(session_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def invalidate(self, session_id: int):
+        """会话关闭或删除后调用：删除本地条目并通知其他 worker"""
+        self.discard(session_id)
+        self.invalidations += 1
+        await self.notify(session_id)
+
+    async def notify(self, session_id: int):
+        """会话有其他 worker 需要感知的变化（如写入了新问题）时通知其他 worker，本地条目保留"""
+        if self.channel is None:
+            return
+        try:
+            await self.channel.publish(session_id)
+        except Exception as e:
+            # 无法通知时其他 worker 依靠条目有效期兜底
+            logger.warning("发布会话失效消息失败，会话ID: %s，错误: %s", session_id, e)
+
+    def start(self):
+        if self.channel is not None and self.enabled:
+            self.channel.start(self)
+
+    async def close(self):
+        if self.channel is not None:
+            await self.channel.close()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        stats = {
+            "enabled": self.enabled,
+            "backend": "redis" if self.channel is not None else "memory",
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations
+        }
+        if self.channel is not None:
+            stats.update({
+                "connected": self.channel.connected,
+                "version": self.channel.version,
+                "remote_invalidations": self.remote_invalidations,
+                "resyncs": self.resyncs
+            })
+        return stats
+
+
+async def find_active_session(db: AsyncSession, session_id: int, user_id: int) -> Optional[Session]:
+    """查询属于该用户的活跃会话，找到时写入缓存"""
+    session = (await db.execute(
+        select(Session).where(
+            Session.id == session_id,
+            Session.user_id == user_id,
+            Session.status == 1
+        )
+    )).scalars().first()
+    if session is not None:
+        session_cache.put(session)
+    return session
+
+
+def create_session_cache() -> SessionCache:
+    """根据配置创建会话缓存"""
+    channel = None
+    if SESSION_CACHE_ENABLED and SESSION_INVALIDATION_BACKEND == "redis":
+        channel = RedisInvalidationChannel(url=REDIS_URL)
+    return SessionCache(channel, enabled=SESSION_CACHE_ENABLED, ttl=SESSION_CACHE_TTL, max_entries=SESSION_CACHE_MAX_ENTRIES)
+
+
+session_cache = create_session_cache()
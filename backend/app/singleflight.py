@@ -0,0 +1,151 @@
+"""
+请求合并模块 - 相同提示词的并发请求共享同一次上游 LLM 调用
+"""
+import os
+import asyncio
+import hashlib
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "True").lower() == "true"
+
+
+def prompt_key(prompt: str) -> str:
+    """以提示词哈希作为合并键"""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+class StreamBroadcast:
+    """将一路上游流式输出分发给多个订阅者；迟到的订阅者先收到已产生的片段"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.cancelled = False  # 所有订阅者已离开、上游已取消，不再接受新的订阅者
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        # 唤醒当前所有等待者，并为下一轮等待换上新的事件
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, chunk: str):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def subscribe(self) -> AsyncIterator[str]:
+        """
+        登记订阅者并返回片段迭代器。调用时即计数：迭代开始之前其他订阅者离开也不会取消上游；
+        从未开始迭代就被丢弃的订阅不会注销，上游照常运行到结束
+        """
+        self.subscribers += 1
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[str]:
+        index = 0
+        try:
+            while True:
+                if index < len(self.chunks):
+                    chunk = self.chunks[index]
+                    index += 1
+                    yield chunk
+                elif self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                else:
+                    await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done and self.task is not None:
+                # 所有订阅者都已离开（客户端断开），取消上游调用；取消生效前到达的相同请求另起上游
+                logger.info("所有订阅者已断开，取消上游流式调用")
+                self.cancelled = True
+                self.task.cancel()
+
+
+class SingleFlight:
+    """
+    进程内请求合并：同一键同时只有一个上游调用在进行，其余请求等待并共享结果。
+    上游调用在独立任务中运行，单个请求断开不会影响其他等待者。
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._streams: Dict[str, StreamBroadcast] = {}
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def stream(self, key: str, factory: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """订阅键对应的流式调用，不存在时以 factory 发起"""
+        if not self.enabled:
+            return factory()
+        broadcast = self._streams.get(key)
+        if broadcast is None or broadcast.cancelled:
+            self.leaders += 1
+            broadcast = StreamBroadcast()
+            self._streams[key] = broadcast
+            broadcast.task = asyncio.create_task(self._run_stream(key, broadcast, factory))
+        else:
+            self.followers += 1
+            logger.info("合并流式请求，键: %s，已产生片段: %s", key[:12], len(broadcast.chunks))
+        return broadcast.subscribe()
+
+    async def _run_stream(self, key: str, broadcast: StreamBroadcast, factory: Callable[[], AsyncIterator[str]]):
+        try:
+            async for chunk in factory():
+                broadcast.publish(chunk)
+        except BaseException as e:
+            broadcast.finish(e)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        else:
+            broadcast.finish()
+        finally:
+            # 取消期间该键可能已换成新的广播，只移除自己
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+
+    async def call(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """执行或加入键对应的非流式调用，返回共享结果"""
+        if not self.enabled:
+            return await factory()
+        task = self._calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.create_task(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._on_call_done(key, t))
+        else:
+            self.followers += 1
+            logger.info("合并请求，键: %s", key[:12])
+        # shield：某个等待者被取消时不取消共享的上游调用
+        return await asyncio.shield(task)
+
+    def _on_call_done(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # 标记异常已读取，避免所有等待者均已离开时产生告警
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._streams) + len(self._calls),
+            "leaders": self.leaders,
+            "followers": self.followers
+        }
+
+
+single_flight = SingleFlight(enabled=SINGLE_FLIGHT_ENABLED)
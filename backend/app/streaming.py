@@ -0,0 +1,146 @@
+"""
+流式响应模块 - SSE 流的客户端断开检测、片段合并、事件编码与统计
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import AsyncIterator, List
+
+from fastapi import Request
+
+from .context import count_tokens
+
+try:
+    import orjson  # 可选依赖：安装后用于加速事件编码
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+STREAM_DISCONNECT_POLL_INTERVAL = float(os.getenv("STREAM_DISCONNECT_POLL_INTERVAL", "0.5"))  # 秒
+# 片段合并窗口：缓冲超过时间间隔或字节数时发送一次，均为 0 时逐片段发送
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.05"))  # 秒
+STREAM_FLUSH_BYTES = int(os.getenv("STREAM_FLUSH_BYTES", "512"))
+# 完成事件是否附带完整回答（客户端已通过 chunk 事件拼出全文时可关闭以节省流量）
+STREAM_COMPLETE_INCLUDE_ANSWER = os.getenv("STREAM_COMPLETE_INCLUDE_ANSWER", "True").lower() == "true"
+
+
+class ClientDisconnected(Exception):
+    """客户端在回答生成过程中断开连接"""
+
+
+async def relay_chunks(
+    request: Request,
+    chunks: AsyncIterator[str],
+    poll_interval: float = STREAM_DISCONNECT_POLL_INTERVAL,
+    flush_interval: float = STREAM_FLUSH_INTERVAL,
+    flush_bytes: int = STREAM_FLUSH_BYTES
+) -> AsyncIterator[str]:
+    """
+    迭代上游片段并合并后输出，同时轮询客户端连接状态（request 只需提供 is_disconnected()）。
+    缓冲达到 flush_bytes 字节，或首个缓冲片段已等待 flush_interval 秒（上游停顿时同样生效）时输出一次；
+    等待上游（如推理模型长时间思考）期间客户端断开时，立即取消上游并抛出 ClientDisconnected。
+    """
+    iterator = chunks.__aiter__()
+    buffer: List[str] = []
+    buffered_bytes = 0
+    deadline = 0.0
+    next_chunk = None
+    next_poll = time.monotonic() + poll_interval
+    try:
+        while True:
+            next_chunk = asyncio.ensure_future(iterator.__anext__())
+            while not next_chunk.done():
+                timeout = next_poll
+                if buffer and flush_interval > 0:
+                    timeout = min(timeout, deadline)
+                await asyncio.wait({next_chunk}, timeout=max(0.0, timeout - time.monotonic()))
+                if next_chunk.done():
+                    break
+                now = time.monotonic()
+                if buffer and flush_interval > 0 and now >= deadline:
+                    yield "".join(buffer)
+                    buffer.clear()
+                    buffered_bytes = 0
+                    next_poll = now  # 发送后立即检查连接
+                if now >= next_poll:
+                    if await request.is_disconnected():
+                        raise ClientDisconnected()
+                    next_poll = now + poll_interval
+            try:
+                chunk = next_chunk.result()
+            except StopAsyncIteration:
+                break
+
+            if not buffer:
+                deadline = time.monotonic() + flush_interval
+            buffer.append(chunk)
+            buffered_bytes += len(chunk.encode("utf-8"))
+            if (
+                (flush_bytes > 0 and buffered_bytes >= flush_bytes)
+                or (flush_interval > 0 and time.monotonic() >= deadline)
+                or (flush_interval <= 0 and flush_bytes <= 0)
+            ):
+                yield "".join(buffer)
+                buffer.clear()
+                buffered_bytes = 0
+                if await request.is_disconnected():
+                    raise ClientDisconnected()
+                next_poll = time.monotonic() + poll_interval
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if next_chunk is not None and not next_chunk.done():
+            # 取消正在等待的上游读取，上游生成器随之结束
+            next_chunk.cancel()
+        elif hasattr(iterator, "aclose"):
+            await iterator.aclose()
+
+
+def encode_data(payload: dict) -> str:
+    """编码事件数据；安装了 orjson 时使用其编码器，否则使用紧凑分隔符的标准库编码"""
+    if orjson is not None:
+        return orjson.dumps(payload).decode("utf-8")
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+def encode_event(payload: dict) -> str:
+    """编码一条 SSE 事件"""
+    return f"data: {encode_data(payload)}\n\n"
+
+
+class StreamStats:
+    """流式回答统计：完成/中断数量，以及因提前取消而省下的 token 估算"""
+
+    def __init__(self):
+        self.active = 0
+        self.completed = 0
+        self.interrupted = 0
+        self.completed_tokens = 0
+        self.interrupted_tokens = 0  # 中断前已生成的 token
+        self.tokens_saved = 0  # 按已完成回答的平均长度估算
+
+    def record_completed(self, answer: str):
+        self.completed += 1
+        self.completed_tokens += count_tokens(answer)
+
+    def record_interrupted(self, partial_answer: str):
+        tokens = count_tokens(partial_answer)
+        self.interrupted += 1
+        self.interrupted_tokens += tokens
+        if self.completed:
+            self.tokens_saved += max(0, self.completed_tokens // self.completed - tokens)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "completed": self.completed,
+            "interrupted": self.interrupted,
+            "interrupted_tokens": self.interrupted_tokens,
+            "estimated_tokens_saved": self.tokens_saved
+        }
+
+
+stream_stats = StreamStats()
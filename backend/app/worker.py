@@ -0,0 +1,16 @@
+"""
+Worker 模块 - 生产模式下 gunicorn 使用的 uvicorn worker（由 start.py 加载）
+"""
+from uvicorn.workers import UvicornWorker
+
+from .config import UVICORN_LOOP, UVICORN_HTTP, GRACEFUL_TIMEOUT
+
+
+class AppWorker(UvicornWorker):
+    """按配置选择事件循环/HTTP 实现，并在退出时先排空进行中的请求"""
+
+    CONFIG_KWARGS = {
+        "loop": UVICORN_LOOP,
+        "http": UVICORN_HTTP,
+        "timeout_graceful_shutdown": GRACEFUL_TIMEOUT,
+    }
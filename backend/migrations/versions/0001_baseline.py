@@ -0,0 +1,58 @@
+"""基线：引入迁移之前由 create_all 创建的表结构
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "sessions",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("title", sa.String(200), nullable=False),
+        sa.Column("create_time", sa.DateTime()),
+        sa.Column("update_time", sa.DateTime()),
+        sa.Column("status", sa.Integer()),
+    )
+    op.create_index("ix_sessions_user_id", "sessions", ["user_id"])
+
+    op.create_table(
+        "questions",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("session_id", sa.Integer(), sa.ForeignKey("sessions.id"), nullable=True),
+        sa.Column("question", sa.Text(1000), nullable=False),
+        sa.Column("create_time", sa.DateTime()),
+        sa.Column("status", sa.Integer()),
+    )
+    op.create_index("ix_questions_user_id", "questions", ["user_id"])
+    op.create_index("ix_questions_session_id", "questions", ["session_id"])
+
+    op.create_table(
+        "answers",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("question_id", sa.Integer(), sa.ForeignKey("questions.id")),
+        sa.Column("answer", sa.Text(2000), nullable=False),
+        sa.Column("create_time", sa.DateTime()),
+    )
+    op.create_index("ix_answers_question_id", "answers", ["question_id"])
+
+
+def downgrade() -> None:
+    op.drop_table("answers")
+    op.drop_table("questions")
+    op.drop_table("sessions")
@@ -0,0 +1,56 @@
+"""会话问题计数、上下文摘要列与主键分段表
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:00
+
+旧库可能已由 create_all 建立了其中一部分，只补齐缺少的列和表
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if op.get_context().as_sql:
+        # 离线生成 SQL 时无法检查现有结构，按从基线升级处理
+        columns, tables = set(), set()
+    else:
+        inspector = sa.inspect(op.get_bind())
+        columns = {column["name"] for column in inspector.get_columns("sessions")}
+        tables = set(inspector.get_table_names())
+
+    if "question_count" not in columns:
+        op.add_column(
+            "sessions",
+            sa.Column("question_count", sa.Integer(), nullable=False, server_default="0")
+        )
+        # 按现有问题回填冗余计数
+        op.execute(
+            "UPDATE sessions SET question_count = "
+            "(SELECT COUNT(*) FROM questions WHERE questions.session_id = sessions.id)"
+        )
+    if "context_summary" not in columns:
+        op.add_column("sessions", sa.Column("context_summary", sa.Text(), nullable=True))
+
+    if "id_blocks" not in tables:
+        op.create_table(
+            "id_blocks",
+            sa.Column("name", sa.String(50), primary_key=True),
+            sa.Column("next_id", sa.BigInteger(), nullable=False),
+        )
+
+
+def downgrade() -> None:
+    op.drop_table("id_blocks")
+    with op.batch_alter_table("sessions") as batch_op:
+        batch_op.drop_column("context_summary")
+        batch_op.drop_column("question_count")
@@ -0,0 +1,57 @@
+"""热点查询的联合索引与回答的唯一约束
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:00
+
+先建新索引再删除被其前缀覆盖的单列索引（MySQL 外键列必须始终有可用索引）
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _drop_index_if_exists(name: str, table: str) -> None:
+    # 离线生成 SQL 时按从基线升级处理，旧索引一定存在
+    if op.get_context().as_sql or name in {index["name"] for index in sa.inspect(op.get_bind()).get_indexes(table)}:
+        op.drop_index(name, table_name=table)
+
+
+def upgrade() -> None:
+    op.create_index("ix_sessions_user_status_updated", "sessions", ["user_id", "status", "update_time"])
+    op.create_index("ix_questions_user_time", "questions", ["user_id", "create_time", "id"])
+    op.create_index("ix_questions_session_time", "questions", ["session_id", "create_time", "id"])
+    op.create_index("ix_questions_user_session_time", "questions", ["user_id", "session_id", "create_time", "id"])
+
+    # 同一问题存在多条回答时只保留最新的一条，再建立唯一约束
+    op.execute(
+        "DELETE FROM answers WHERE question_id IS NOT NULL AND id NOT IN "
+        "(SELECT id FROM (SELECT MAX(id) AS id FROM answers GROUP BY question_id) AS latest)"
+    )
+    op.create_index("uq_answers_question_id", "answers", ["question_id"], unique=True)
+
+    _drop_index_if_exists("ix_sessions_user_id", "sessions")
+    _drop_index_if_exists("ix_questions_user_id", "questions")
+    _drop_index_if_exists("ix_questions_session_id", "questions")
+    _drop_index_if_exists("ix_answers_question_id", "answers")
+
+
+def downgrade() -> None:
+    op.create_index("ix_answers_question_id", "answers", ["question_id"])
+    op.create_index("ix_questions_session_id", "questions", ["session_id"])
+    op.create_index("ix_questions_user_id", "questions", ["user_id"])
+    op.create_index("ix_sessions_user_id", "sessions", ["user_id"])
+
+    op.drop_index("uq_answers_question_id", table_name="answers")
+    op.drop_index("ix_questions_user_session_time", table_name="questions")
+    op.drop_index("ix_questions_session_time", table_name="questions")
+    op.drop_index("ix_questions_user_time", table_name="questions")
+    op.drop_index("ix_sessions_user_status_updated", table_name="sessions")
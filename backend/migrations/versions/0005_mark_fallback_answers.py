@@ -0,0 +1,40 @@
+"""标记已保存的服务不可用提示语
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 00:00:00
+
+此前 AI 服务不可用时的提示语以“已回答”状态保存，改为状态 3，避免被语义缓存当作真实回答复用
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+FALLBACK_ANSWERS = (
+    "抱歉，AI服务响应较慢，请稍后再试。我们正在努力改善服务质量。",
+    "抱歉，AI服务暂时不可用，请稍后再试。如问题持续，请联系技术支持。",
+)
+
+questions = sa.table("questions", sa.column("id", sa.Integer), sa.column("status", sa.Integer))
+answers = sa.table("answers", sa.column("question_id", sa.Integer), sa.column("answer", sa.Text))
+
+
+def upgrade() -> None:
+    fallback_questions = sa.select(answers.c.question_id).where(answers.c.answer.in_(FALLBACK_ANSWERS))
+    op.execute(
+        questions.update()
+        .where(questions.c.status == 1, questions.c.id.in_(fallback_questions))
+        .values(status=3)
+    )
+
+
+def downgrade() -> None:
+    op.execute(questions.update().where(questions.c.status == 3).values(status=1))
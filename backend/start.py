@@ -1,30 +1,171 @@
 #!/usr/bin/env python3
 """
 智能客服系统启动脚本
+
+ENVIRONMENT=production 时以 gunicorn 预加载应用后 fork 多个 uvicorn worker（默认 CPU 核数），
+其他环境保持单进程 uvicorn（DEBUG=True 时自动重载）；两种模式下数据库迁移都在启动服务之前执行一次
 """
 import uvicorn
 import os
-from dotenv import load_dotenv
+import glob
+import tempfile
+import importlib.util
 
 # 加载环境变量
-load_dotenv()
+from app.config import UVICORN_LOOP, UVICORN_HTTP, GRACEFUL_TIMEOUT, SHUTDOWN_DRAIN_TIMEOUT
+
+# 留给 lifespan 关闭阶段（等待后台生成任务、关闭连接池）的时间（秒），超过后主进程强制结束 worker
+SHUTDOWN_MARGIN = int(SHUTDOWN_DRAIN_TIMEOUT) + 5
+
+
+def resolve_loop(loop: str) -> str:
+    if loop == "auto":
+        return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    return loop
+
+
+def resolve_http(http: str) -> str:
+    if http == "auto":
+        return "httptools" if importlib.util.find_spec("httptools") else "h11"
+    return http
+
+
+def default_workers() -> int:
+    # 容器中按可用的 CPU 集合计算
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def worker_log_file(slot: int) -> str:
+    """每个 worker 写独立的日志文件，各自轮转互不干扰"""
+    root, ext = os.path.splitext(os.getenv("LOG_FILE", "logs/app.log"))
+    return f"{root}.{slot}{ext}"
+
+
+def prepare_workers(workers: int):
+    """在主进程导入应用之前调整多 worker 相关配置"""
+    if workers <= 1:
+        return
+    # 各 worker 把指标写入共享目录，由 /metrics 汇总；目录中残留的上次运行数据需清空
+    multiproc_dir = os.environ.setdefault(
+        "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "prometheus_multiproc")
+    )
+    os.makedirs(multiproc_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(multiproc_dir, "*.db")):
+        os.remove(path)
+    # 进程内失效无法通知其他 worker，关闭或删除的会话在其他 worker 上会继续被当作活跃会话
+    if os.getenv("SESSION_INVALIDATION_BACKEND", "memory") != "redis":
+        os.environ["SESSION_CACHE_ENABLED"] = "False"
+        print("⚠️  多 worker 部署未配置 SESSION_INVALIDATION_BACKEND=redis，已关闭会话归属缓存")
+    # 进程内的任务状态只有提交任务的 worker 可见，其他 worker 查询进度会返回 404
+    if os.getenv("PURGE_JOB_BACKEND", "memory") != "redis":
+        os.environ["PURGE_BACKGROUND_ENABLED"] = "False"
+        print("⚠️  多 worker 部署未配置 PURGE_JOB_BACKEND=redis，已关闭后台清理任务")
+    # 进程内回放缓冲只在生成回答的 worker 上：续传与停止生成请求落到其他 worker 时找不到流，
+    # 关闭续传后客户端断开即取消上游，不再等待宽限期
+    if os.getenv("STREAM_RESUME_ENABLED", "True").lower() == "true" and os.getenv("STREAM_REPLAY_BACKEND", "memory") != "redis":
+        os.environ["STREAM_RESUME_ENABLED"] = "False"
+        print("⚠️  多 worker 部署未配置 STREAM_REPLAY_BACKEND=redis，已关闭断线续传")
+    # 进程内计数时每个 worker 各自限流，实际上限是配置值的 workers 倍：改用本机共享的 SQLite 文件
+    if os.getenv("RATE_LIMIT_STORAGE_URI", "memory://").startswith("memory://"):
+        path = os.path.join(tempfile.gettempdir(), "chatbot_ratelimit.db")
+        os.environ["RATE_LIMIT_STORAGE_URI"] = f"sqlite:///{path}"
+        print(f"⚠️  多 worker 部署未配置共享的 RATE_LIMIT_STORAGE_URI，限流计数改存 {path}")
+    # 进程内回答缓存只是命中率按 worker 数摊薄，不影响正确性，只提示
+    if os.getenv("ANSWER_CACHE_ENABLED", "True").lower() == "true" and os.getenv("ANSWER_CACHE_BACKEND", "memory") != "redis":
+        print("⚠️  多 worker 部署未配置 ANSWER_CACHE_BACKEND=redis，各 worker 的回答缓存互不共享")
+
+
+def run_migrations():
+    """在启动服务之前执行一次数据库迁移，应用的 lifespan 不再执行"""
+    auto_migrate = os.getenv("DB_AUTO_MIGRATE", "True").lower() == "true"
+    os.environ["DB_AUTO_MIGRATE"] = "False"
+    if auto_migrate:
+        from app.migrate import upgrade_database
+        upgrade_database()
+        print("🗃️  数据库迁移完成")
+
+
+def run_production(host: str, port: int):
+    from gunicorn.app.base import BaseApplication
+
+    workers = int(os.getenv("WORKERS", "0")) or default_workers()
+
+    def pre_fork(server, worker):
+        # 分配未被存活 worker 占用的最小编号，worker 重启后沿用同一个日志文件
+        used = {getattr(w, "slot", None) for w in server.WORKERS.values()}
+        worker.slot = next(slot for slot in range(1, len(used) + 2) if slot not in used)
+
+    def post_fork(server, worker):
+        # 主进程的日志后台线程不会复制到子进程，重新安装
+        from app.log_config import setup_logging
+        if workers > 1:
+            setup_logging(worker_log_file(worker.slot))
+        else:
+            setup_logging()
+
+    def child_exit(server, worker):
+        if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(worker.pid)
+
+    # 多 worker 配置需在导入应用模块（含迁移）之前写入环境变量
+    prepare_workers(workers)
+    run_migrations()
+
+    class ProductionApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"{host}:{port}",
+                "workers": workers,
+                "worker_class": "app.worker.AppWorker",
+                "preload_app": True,
+                "keepalive": 5,
+                # 主进程在 worker 自身的排空和关闭都结束之后才强制终止
+                "graceful_timeout": GRACEFUL_TIMEOUT + SHUTDOWN_MARGIN,
+                "pre_fork": pre_fork,
+                "post_fork": post_fork,
+                "child_exit": child_exit,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from app.main import app
+            return app
+
+    print(f"👷 worker 数量: {workers}（预加载应用后 fork）")
+    ProductionApplication().run()
+
 
 if __name__ == "__main__":
     # 从环境变量获取配置，提供默认值
     host = os.getenv("HOST", "127.0.0.1")
     port = int(os.getenv("PORT", 8000))
     debug = os.getenv("DEBUG", "False").lower() == "true"
-    
+    production = os.getenv("ENVIRONMENT", "development") == "production" and not debug
+    loop = resolve_loop(UVICORN_LOOP)
+    http = resolve_http(UVICORN_HTTP)
+
     print(f"🚀 启动智能客服系统...")
     print(f"📍 服务地址: http://{host}:{port}")
     print(f"🔧 调试模式: {'开启' if debug else '关闭'}")
+    print(f"⚙️  事件循环: {loop} / HTTP 解析: {http}")
     print(f"📚 API文档: http://{host}:{port}/docs")
     print(f"🔄 健康检查: http://{host}:{port}/api/health")
-    
-    uvicorn.run(
-        "app.main:app",
-        host=host,
-        port=port,
-        reload=debug,
-        log_level="info" if not debug else "debug"
-    )
\ No newline at end of file
+
+    if production:
+        run_production(host, port)
+    else:
+        run_migrations()
+        uvicorn.run(
+            "app.main:app",
+            host=host,
+            port=port,
+            reload=debug,
+            loop=loop,
+            http=http,
+            timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+            log_level="info" if not debug else "debug"
+        )
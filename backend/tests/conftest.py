@@ -0,0 +1,162 @@
+"""
+测试配置 - 在导入应用之前写入测试环境变量（临时 SQLite 数据库、独立日志文件、关闭限流），并提供公共夹具
+"""
+import os
+import sys
+import json
+import asyncio
+import tempfile
+from types import SimpleNamespace
+from typing import List, Optional
+from urllib.parse import urlencode
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DIR = tempfile.mkdtemp(prefix="chatbot-tests-")
+
+sys.path.insert(0, BACKEND_DIR)
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}",
+    "LOG_FILE": os.path.join(TEST_DIR, "app.log"),
+    "LOG_CONSOLE": "False",
+    "ALLOWED_HOSTS": "testserver,localhost",
+    "RATE_LIMIT_PER_MINUTE": "100000",
+    "USER_RATE_LIMIT_PER_MINUTE": "0",
+    "SEMANTIC_CACHE_ENABLED": "False",
+})
+
+
+# 基准测试默认跳过，RUN_BENCHMARKS=True 时运行（加 -s 查看结果）
+RUN_BENCHMARKS = os.getenv("RUN_BENCHMARKS", "False").lower() == "true"
+benchmark = pytest.mark.skipif(not RUN_BENCHMARKS, reason="基准测试默认跳过，设置 RUN_BENCHMARKS=True 运行")
+
+
+def percentile(values: List[float], p: float) -> float:
+    """最近秩百分位数"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+@pytest.fixture(scope="session")
+def database():
+    """把临时数据库升级到最新迁移版本"""
+    from app.migrate import upgrade_database
+    upgrade_database()
+
+
+@pytest.fixture
+def run(database):
+    """在新的事件循环中运行协程；连接绑定创建它的事件循环，结束前释放连接池"""
+    from app.database import engine
+    from app.persistence import persistence
+
+    def runner(coro):
+        async def main():
+            # 主键分配锁在首次竞争时绑定事件循环，在新的事件循环中重新创建
+            for allocator in (persistence.session_ids, persistence.question_ids):
+                allocator._lock = None
+            try:
+                # 释放后重建的连接池上，并发的首次连接初始化会互相等待，先建立一个连接
+                async with engine.connect():
+                    pass
+                return await coro
+            finally:
+                await engine.dispose()
+        return asyncio.run(main())
+    return runner
+
+
+class FakeLLM:
+    """替代上游模型的假 LLM：固定回答，记录收到的提示词与被取消的流式调用次数"""
+
+    def __init__(self, answer: str = "测试回答", delay: float = 0, chunks: Optional[List[str]] = None):
+        self.answer = answer
+        self.delay = delay  # 调用返回、流式输出每个片段前的等待（秒）
+        self.chunks = chunks  # 流式输出的片段，默认把回答分成两段
+        self.prompts = []
+        self.cancelled = 0
+
+    async def ainvoke(self, messages, **kwargs):
+        self.prompts.append(messages[0].content)
+        await asyncio.sleep(self.delay)
+        return SimpleNamespace(content=self.answer)
+
+    async def astream(self, messages, **kwargs):
+        self.prompts.append(messages[0].content)
+        chunks = self.chunks or [self.answer[:2], self.answer[2:]]
+        try:
+            for chunk in chunks:
+                await asyncio.sleep(self.delay)
+                yield SimpleNamespace(content=chunk)
+        except (asyncio.CancelledError, GeneratorExit):
+            self.cancelled += 1
+            raise
+
+
+async def open_stream(app, path: str, params: dict, events: Optional[list] = None,
+                      disconnect_after: Optional[int] = None) -> list:
+    """
+    直接以 ASGI 调用流式接口，返回收到的 SSE 事件（data 部分）；
+    events 不为空时边接收边追加，disconnect_after 指定收到多少个事件后断开连接
+    """
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": urlencode(params).encode(), "headers": [(b"host", b"testserver")],
+        "client": ("127.0.0.1", 12345), "server": ("testserver", 80),
+    }
+    received = [] if events is None else events
+    buffer = ""
+    requested = False
+    finished = asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # 客户端保持连接直到响应结束或收到指定数量的事件
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal buffer
+        if message["type"] != "http.response.body":
+            return
+        buffer += message.get("body", b"").decode()
+        *messages, buffer = buffer.split("\n\n")
+        for text in messages:
+            received.extend(
+                json.loads(line[len("data: "):]) for line in text.splitlines() if line.startswith("data: ")
+            )
+        if not message.get("more_body") or (disconnect_after is not None and len(received) >= disconnect_after):
+            finished.set()
+
+    await app(scope, receive, send)
+    return received
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    from app import llm, main
+    fake = FakeLLM()
+    monkeypatch.setattr(llm, "get_llm", lambda: fake)
+    monkeypatch.setattr(main, "get_llm", lambda: fake)
+    return fake
+
+
+@pytest.fixture
+def worker_env(monkeypatch, tmp_path):
+    """start.prepare_workers 会改写环境变量，在副本上运行"""
+    monkeypatch.setattr(os, "environ", dict(os.environ))
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    return monkeypatch
+
+
+@pytest.fixture
+def client(database, fake_llm):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    with TestClient(app) as test_client:
+        yield test_client
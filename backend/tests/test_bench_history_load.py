@@ -0,0 +1,144 @@
+"""
+负载基准测试 - 持续的历史记录查询与并发流式回答同时进行时，流式客户端的片段间隔 p99 保持平稳
+
+数据库访问为异步驱动：历史查询等待数据库往返时不阻塞事件循环，流式回答的片段照常送达。
+每条语句在 aiosqlite 的连接线程中额外等待 BENCH_DB_LATENCY_MS，模拟网络数据库的往返延迟。
+默认跳过，RUN_BENCHMARKS=True 时运行。
+"""
+import os
+import time
+import sqlite3
+import asyncio
+
+import aiosqlite
+import httpx
+
+from app import main
+from app.database import DATABASE_URL, SessionLocal
+from app.persistence import persistence
+from conftest import benchmark, open_stream, percentile
+
+pytestmark = benchmark
+
+STREAMS = 20
+HAMMERS = 4
+HISTORY_RPS = float(os.getenv("BENCH_HISTORY_RPS", "20"))  # 历史查询的目标速率，总体请求间隔固定
+DB_LATENCY_MS = float(os.getenv("BENCH_DB_LATENCY_MS", "10"))  # 模拟的数据库往返延迟
+P99_TOLERANCE_MS = float(os.getenv("BENCH_P99_TOLERANCE_MS", "50"))  # 负载下 p99 允许超出空闲时 p99 的毫秒数
+HISTORY_ROUNDS = 500
+HISTORY_PAGE = 50
+STREAM_SPACING = 0.02  # 秒
+CHUNKS = [f"片段{i}" for i in range(50)]
+USER_ID = 8000
+
+
+class TimedEvents(list):
+    """记录每个事件到达时间的事件列表"""
+
+    def __init__(self):
+        super().__init__()
+        self.times = []
+
+    def extend(self, events):
+        events = list(events)
+        self.times.extend([time.perf_counter()] * len(events))
+        super().extend(events)
+
+
+async def seed_history(user_id: int, rounds: int):
+    async with SessionLocal() as db:
+        chat_session = await persistence.create_session(db, user_id, "负载测试")
+        questions = []
+        for i in range(rounds):
+            # 逐条提交：预留主键段使用独立事务，不能与未提交的写事务重叠
+            questions.append(await persistence.create_question(db, user_id, chat_session.id, f"历史问题 {i}"))
+            await db.commit()
+    for question in questions:
+        await persistence.save_answer(question.id, chat_session.id, question.question, "历史回答" * 20)
+    await persistence.flush()
+
+
+async def open_client(i: int, round_id: int, events: TimedEvents):
+    # 客户端错开到达：SQLite 回退库上同一时刻开始的写事务升级时会直接返回 database is locked
+    await asyncio.sleep(i * STREAM_SPACING)
+    await open_stream(main.app, "/api/questions/stream",
+                      {"user_id": USER_ID + 1 + i, "question": f"负载问题 {round_id}-{i}"}, events=events)
+
+
+async def stream_gaps(round_id: int) -> list:
+    """并发打开流式回答，返回所有客户端相邻回答片段的到达间隔（秒）；完成事件在回答保存后发送，不计入"""
+    results = [TimedEvents() for _ in range(STREAMS)]
+    await asyncio.gather(*(open_client(i, round_id, events) for i, events in enumerate(results)))
+    assert all(events and events[-1]["type"] == "complete" for events in results)
+    gaps = []
+    for events in results:
+        times = [at for event, at in zip(events, events.times) if event["type"] == "chunk"]
+        gaps.extend(later - earlier for earlier, later in zip(times, times[1:]))
+    return gaps
+
+
+async def hammer_history(client: httpx.AsyncClient, stop: asyncio.Event) -> int:
+    """按固定间隔分页请求历史记录（每个协程 HISTORY_RPS / HAMMERS 次每秒），依次翻到最后一页后从头开始"""
+    interval = HAMMERS / HISTORY_RPS
+    requests = 0
+    next_at = time.perf_counter()
+    cursor = None
+    while not stop.is_set():
+        params = {"limit": HISTORY_PAGE}
+        if cursor:
+            params["before"] = cursor
+        response = await client.get(f"/api/history/{USER_ID}", params=params)
+        assert response.status_code == 200
+        cursor = response.headers.get("X-Next-Cursor")
+        requests += 1
+        next_at += interval
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+    return requests
+
+
+def add_db_latency(monkeypatch, seconds: float):
+    """每条语句在连接线程中先等待 seconds 秒再执行"""
+    execute = aiosqlite.Connection._execute
+
+    async def delayed_execute(self, fn, *args, **kwargs):
+        def delayed(*inner_args, **inner_kwargs):
+            time.sleep(seconds)
+            return fn(*inner_args, **inner_kwargs)
+        return await execute(self, delayed, *args, **kwargs)
+
+    monkeypatch.setattr(aiosqlite.Connection, "_execute", delayed_execute)
+
+
+def set_journal_mode(mode: str):
+    with sqlite3.connect(DATABASE_URL[len("sqlite:///"):]) as conn:
+        conn.execute(f"PRAGMA journal_mode={mode}")
+
+
+def test_stream_latency_flat_under_history_load(run, fake_llm, monkeypatch):
+    # SQLite 回退库默认的回滚日志模式下持续的读请求会使写入超时，测试库改用 WAL 模式（MySQL 无此限制）
+    set_journal_mode("WAL")
+    fake_llm.chunks = CHUNKS
+    fake_llm.delay = 0.01
+
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app):
+            await seed_history(USER_ID, HISTORY_ROUNDS)
+            add_db_latency(monkeypatch, DB_LATENCY_MS / 1000)
+            idle = await stream_gaps(0)
+            stop = asyncio.Event()
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+                hammers = [asyncio.create_task(hammer_history(client, stop)) for _ in range(HAMMERS)]
+                started = time.perf_counter()
+                loaded = await stream_gaps(1)
+                elapsed = time.perf_counter() - started
+                stop.set()
+                history_requests = sum(await asyncio.gather(*hammers))
+        return idle, loaded, history_requests / elapsed
+
+    idle, loaded, history_rps = run(scenario())
+    print(f"\n历史查询 {history_rps:.0f} req/s（共 {HISTORY_ROUNDS} 条，每页 {HISTORY_PAGE} 条，数据库往返 {DB_LATENCY_MS:.0f}ms）")
+    for name, gaps in (("空闲", idle), ("负载", loaded)):
+        print(f"{name}: 片段间隔 p50 {percentile(gaps, 50) * 1000:.1f}ms  p99 {percentile(gaps, 99) * 1000:.1f}ms")
+    assert history_rps > 0
+    assert percentile(loaded, 99) <= percentile(idle, 99) + P99_TOLERANCE_MS / 1000
@@ -0,0 +1,157 @@
+"""
+连接基准测试 - 共享 HTTP 连接池前后，每次 LLM 调用新建的上游连接数与耗时
+
+本地启动一个 OpenAI 兼容的假服务（流式 SSE 与非流式 JSON），按客户端地址统计 TCP 连接数。
+改动前每次调用新建 ChatOpenAI 及其 HTTP 客户端，每次调用都要重新建立连接；
+改动后所有调用复用 app.llm 的共享客户端，连接在调用之间保持。
+默认跳过，RUN_BENCHMARKS=True 时运行。
+"""
+import os
+import json
+import time
+import socket
+import asyncio
+import threading
+
+import pytest
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from app import llm
+from conftest import benchmark
+
+pytestmark = benchmark
+
+CALLS = int(os.getenv("BENCH_LLM_CALLS", "100"))
+CONCURRENCY = int(os.getenv("BENCH_LLM_CONCURRENCY", "10"))
+WORDS = ["你好", "，", "这是", "假的", "回答"]
+
+
+class FakeOpenAIServer:
+    """OpenAI 兼容的假服务，记录每个请求来自的客户端地址（每个地址对应一条 TCP 连接）"""
+
+    def __init__(self):
+        self.clients = set()
+        self.requests = 0
+        app = Starlette(routes=[Route("/v1/chat/completions", self.completions, methods=["POST"])])
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    async def completions(self, request: Request):
+        self.clients.add(tuple(request.scope["client"]))
+        self.requests += 1
+        body = await request.json()
+        if not body.get("stream"):
+            return JSONResponse({
+                "id": "fake", "object": "chat.completion", "created": 0, "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(WORDS)},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": len(WORDS), "total_tokens": len(WORDS) + 1}
+            })
+
+        async def events():
+            for word in WORDS:
+                chunk = {
+                    "id": "fake", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                    "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    def start(self):
+        self.thread.start()
+        deadline = time.time() + 10
+        while not self.server.started:
+            assert time.time() < deadline, "假服务启动超时"
+            time.sleep(0.01)
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+    def reset(self):
+        self.clients.clear()
+        self.requests = 0
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    server = FakeOpenAIServer()
+    server.start()
+    monkeypatch.setenv("DEEPSEEK_API_KEY", "sk-fake")
+    monkeypatch.setenv("DEEPSEEK_API_BASE", server.base_url)
+    yield server
+    server.stop()
+
+
+def per_request_llm():
+    """改动前的做法：每次调用新建 ChatOpenAI，随之新建 HTTP 客户端与连接"""
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        model=llm.LLM_MODEL,
+        openai_api_key=os.getenv("DEEPSEEK_API_KEY"),
+        openai_api_base=os.getenv("DEEPSEEK_API_BASE"),
+        timeout=60,
+        max_retries=0
+    )
+
+
+async def call(get_client, streaming: bool) -> str:
+    client = get_client()
+    messages = llm.build_messages("你好")
+    if streaming:
+        return "".join([chunk.content async for chunk in client.astream(messages)])
+    return (await client.ainvoke(messages)).content
+
+
+async def run_calls(get_client, streaming: bool) -> float:
+    """以固定并发完成 CALLS 次调用，返回每次调用的平均耗时（毫秒）"""
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def one():
+        async with semaphore:
+            assert await call(get_client, streaming) == "".join(WORDS)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(CALLS)])
+    return (time.perf_counter() - started) * 1000 / CALLS
+
+
+@pytest.mark.parametrize("streaming", [True, False], ids=["stream", "invoke"])
+def test_shared_client_reuses_connections(fake_openai, streaming):
+    async def scenario():
+        await asyncio.to_thread(llm.load_llm_modules)
+        # 预热：导入与首次建连不计入结果
+        await call(per_request_llm, streaming)
+        await call(llm.get_llm, streaming)
+
+        fake_openai.reset()
+        before_ms = await run_calls(per_request_llm, streaming)
+        before_connections = len(fake_openai.clients)
+
+        fake_openai.reset()
+        after_ms = await run_calls(llm.get_llm, streaming)
+        after_connections = len(fake_openai.clients)
+        await llm.close_llm()
+        return before_ms, before_connections, after_ms, after_connections
+
+    before_ms, before_connections, after_ms, after_connections = asyncio.run(scenario())
+    print(
+        f"\n{'流式' if streaming else '非流式'} {CALLS} 次调用（并发 {CONCURRENCY}）："
+        f"每次新建客户端 {before_connections} 条连接 {before_ms:.2f} ms/次，"
+        f"共享客户端 {after_connections} 条连接 {after_ms:.2f} ms/次"
+    )
+    assert before_connections == CALLS
+    # 共享连接池最多为每个并发调用各保持一条连接
+    assert after_connections <= CONCURRENCY
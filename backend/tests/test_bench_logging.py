@@ -0,0 +1,150 @@
+"""
+日志基准测试 - 按固定速率请求 /api/health 时事件循环的延迟，以及每次访问日志调用在调用方的耗时
+
+改动前为 basicConfig 的文件 + 控制台处理器，在事件循环中格式化并写盘，访问日志每个请求两行
+（请求开始行当时为 INFO，这里把访问日志 logger 调到 DEBUG 还原）；改动后为 setup_logging 的队列处理器。
+两种配置都写日志文件和“控制台”，控制台输出重定向到临时文件，避免 -s 运行时刷屏。
+每 1 ms 唤醒一次的探针记录事件循环延迟。默认跳过，RUN_BENCHMARKS=True 时运行。
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+
+import pytest
+
+from app import log_config, main
+from conftest import benchmark, percentile
+
+pytestmark = benchmark
+
+RPS = float(os.getenv("BENCH_LOG_RPS", "1000"))
+DURATION = float(os.getenv("BENCH_LOG_DURATION", "5"))  # 秒
+CALLS = int(os.getenv("BENCH_LOG_CALLS", "20000"))  # 测量调用方耗时的日志调用次数
+STALL_MS = 5
+access_logger = logging.getLogger("app.middleware")
+
+
+@pytest.fixture
+def logging_modes(monkeypatch, tmp_path):
+    """返回按名称切换日志配置的函数，结束时恢复根 logger 原有的处理器"""
+    root = logging.getLogger()
+    saved_handlers, saved_level = root.handlers[:], root.level
+    saved_access_level = access_logger.level
+    console = open(tmp_path / "console.log", "w", encoding="utf-8")
+    monkeypatch.setattr(sys, "stderr", console)
+    monkeypatch.setattr(log_config, "LOG_CONSOLE", True)
+    listeners = []
+
+    def use(mode: str):
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        if mode == "basicConfig":
+            handlers = [logging.FileHandler(tmp_path / "old.log", encoding="utf-8"), logging.StreamHandler()]
+            for handler in handlers:
+                handler.setFormatter(logging.Formatter(log_config.TEXT_FORMAT))
+                root.addHandler(handler)
+            root.setLevel(logging.INFO)
+            access_logger.setLevel(logging.DEBUG)
+        else:
+            listeners.append(log_config.setup_logging(str(tmp_path / "new.log")))
+            access_logger.setLevel(logging.NOTSET)
+
+    yield use
+
+    for listener in listeners:
+        log_config.stop_logging(listener)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    for handler in saved_handlers:
+        root.addHandler(handler)
+    root.setLevel(saved_level)
+    access_logger.setLevel(saved_access_level)
+    console.close()
+
+
+async def get_health():
+    """直接以 ASGI 调用 /api/health，省去 HTTP 客户端的开销"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/api/health", "raw_path": b"/api/health", "root_path": "",
+        "query_string": b"", "headers": [(b"host", b"testserver")],
+        "client": ("127.0.0.1", 12345), "server": ("testserver", 80),
+    }
+    statuses = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    await main.app(scope, receive, send)
+    assert statuses == [200]
+
+
+async def measure_lag() -> list:
+    """按 RPS 匀速发出请求 DURATION 秒，返回 1 ms 探针每次唤醒的延迟（毫秒）"""
+    lags = []
+    pending = set()
+    stop = asyncio.Event()
+
+    async def probe():
+        while not stop.is_set():
+            expected = time.perf_counter() + 0.001
+            await asyncio.sleep(0.001)
+            lags.append((time.perf_counter() - expected) * 1000)
+
+    probe_task = asyncio.create_task(probe())
+    started = time.perf_counter()
+    sent = 0
+    while time.perf_counter() - started < DURATION:
+        # 按绝对时间补发落后的请求，整体速率保持 RPS
+        due = int((time.perf_counter() - started) * RPS)
+        for _ in range(due - sent):
+            task = asyncio.create_task(get_health())
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        sent = max(sent, due)
+        await asyncio.sleep(0.001)
+    await asyncio.gather(*pending)
+    stop.set()
+    await probe_task
+    return lags
+
+
+def caller_cost_us() -> float:
+    """访问日志调用在调用方的平均耗时（微秒）"""
+    started = time.perf_counter()
+    for _ in range(CALLS):
+        access_logger.info(
+            "请求完成 - %s %s - 状态码: %s - 处理时间: %.3fs - IP: %s", "GET", "/api/health", 200, 0.001, "127.0.0.1",
+            extra={"method": "GET", "path": "/api/health", "status": 200, "client_ip": "127.0.0.1", "duration_ms": 1.0}
+        )
+    return (time.perf_counter() - started) * 1e6 / CALLS
+
+
+def test_logging_event_loop_stalls(run, logging_modes):
+    results = {}
+
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app):
+            for mode in ("basicConfig", "队列"):
+                logging_modes(mode)
+                await get_health()  # 预热
+                lags = await measure_lag()
+                results[mode] = (lags, caller_cost_us())
+
+    run(scenario())
+    print(f"\n/api/health 匀速 {RPS:g} req/s 持续 {DURATION:g} s：")
+    stalls = {}
+    for mode, (lags, cost) in results.items():
+        stalls[mode] = sum(lag for lag in lags if lag > STALL_MS)
+        print(
+            f"  {mode}: 延迟 p99 {percentile(lags, 99):.1f} ms，超过 {STALL_MS} ms 的停顿合计 {stalls[mode]:.0f} ms，"
+            f"每次日志调用 {cost:.1f} µs"
+        )
+    assert stalls["队列"] < stalls["basicConfig"]
@@ -0,0 +1,148 @@
+"""
+中间件基准测试 - 请求日志、安全头、请求大小三个中间件改为纯 ASGI 实现前后，整个中间件栈的每秒请求数
+
+改动前的三个中间件继承 BaseHTTPMiddleware，下面按原实现保留以便对比；其余中间件两种情况下相同。
+以 httpx 的 ASGITransport 直接调用应用，BENCH_MIDDLEWARE_REQUESTS 个请求、并发 BENCH_MIDDLEWARE_CONCURRENCY。
+默认跳过，RUN_BENCHMARKS=True 时运行。
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Callable
+
+import httpx
+import pytest
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp
+
+from app import main, middleware
+from conftest import benchmark
+
+pytestmark = benchmark
+
+REQUESTS = int(os.getenv("BENCH_MIDDLEWARE_REQUESTS", "2000"))
+CONCURRENCY = int(os.getenv("BENCH_MIDDLEWARE_CONCURRENCY", "50"))
+
+logger = logging.getLogger("app.middleware")
+
+
+class OldRequestLoggingMiddleware(BaseHTTPMiddleware):
+    """改动前的请求日志中间件"""
+
+    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+        start_time = time.time()
+        client_ip = request.client.host if request.client else "unknown"
+        user_agent = request.headers.get("user-agent", "unknown")
+        method = request.method
+        url = str(request.url)
+        logger.info("请求开始 - %s %s - IP: %s - User-Agent: %s", method, url, client_ip, user_agent[:100])
+        try:
+            response = await call_next(request)
+            process_time = time.time() - start_time
+            logger.info(
+                "请求完成 - %s %s - 状态码: %s - 处理时间: %.3fs - IP: %s",
+                method, url, response.status_code, process_time, client_ip
+            )
+            response.headers["X-Process-Time"] = str(process_time)
+            return response
+        except Exception as e:
+            process_time = time.time() - start_time
+            logger.error("请求异常 - %s %s - 错误: %s - 处理时间: %.3fs - IP: %s", method, url, e, process_time, client_ip)
+            raise
+
+
+class OldSecurityHeadersMiddleware(BaseHTTPMiddleware):
+    """改动前的安全头中间件"""
+
+    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+        response = await call_next(request)
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        response.headers["X-Frame-Options"] = "DENY"
+        response.headers["X-XSS-Protection"] = "1; mode=block"
+        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
+        response.headers["Content-Security-Policy"] = (
+            "default-src 'self'; "
+            "script-src 'self' 'unsafe-inline'; "
+            "style-src 'self' 'unsafe-inline'; "
+            "img-src 'self' data: https:; "
+            "font-src 'self' https:; "
+            "connect-src 'self' https:; "
+            "frame-ancestors 'none';"
+        )
+        return response
+
+
+class OldRequestSizeMiddleware(BaseHTTPMiddleware):
+    """改动前的请求大小限制中间件"""
+
+    def __init__(self, app: ASGIApp, max_size: int = 10 * 1024 * 1024):
+        super().__init__(app)
+        self.max_size = max_size
+
+    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+        content_length = request.headers.get("content-length")
+        if content_length and int(content_length) > self.max_size:
+            return JSONResponse(
+                status_code=413,
+                content={
+                    "error": "REQUEST_TOO_LARGE",
+                    "message": f"请求体过大，最大允许 {self.max_size // (1024*1024)} MB",
+                    "timestamp": time.time()
+                }
+            )
+        return await call_next(request)
+
+
+OLD_MIDDLEWARES = {
+    middleware.RequestLoggingMiddleware: OldRequestLoggingMiddleware,
+    middleware.SecurityHeadersMiddleware: OldSecurityHeadersMiddleware,
+    middleware.RequestSizeMiddleware: OldRequestSizeMiddleware,
+}
+
+
+def use_middlewares(stack: list):
+    """替换应用的中间件列表，下次调用时重建中间件栈"""
+    main.app.user_middleware = stack
+    main.app.middleware_stack = None
+
+
+async def requests_per_second(client: httpx.AsyncClient, path: str) -> float:
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def one():
+        async with semaphore:
+            response = await client.get(path)
+            assert response.status_code == 200
+            assert response.headers["x-frame-options"] == "DENY"
+
+    await one()  # 预热：构建中间件栈
+    started = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(REQUESTS)])
+    return REQUESTS / (time.perf_counter() - started)
+
+
+@pytest.mark.parametrize("path", ["/api/health", "/docs"])
+def test_middleware_throughput(run, path):
+    current = list(main.app.user_middleware)
+    old = [Middleware(OLD_MIDDLEWARES.get(m.cls, m.cls), **m.options) for m in current]
+    assert sum(m.cls in OLD_MIDDLEWARES.values() for m in old) == len(OLD_MIDDLEWARES)
+
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app):
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://testserver") as client:
+                use_middlewares(old)
+                before = await requests_per_second(client, path)
+                use_middlewares(current)
+                after = await requests_per_second(client, path)
+        return before, after
+
+    try:
+        before, after = run(scenario())
+    finally:
+        use_middlewares(current)
+    print(f"\n{path} {REQUESTS} 个请求（并发 {CONCURRENCY}）：BaseHTTPMiddleware {before:.0f} req/s，纯 ASGI {after:.0f} req/s")
+    assert after > before
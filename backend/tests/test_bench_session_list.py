@@ -0,0 +1,132 @@
+"""
+会话列表基准测试 - 10/100/1000 个会话时，逐会话计数（N+1）、GROUP BY 聚合与冗余计数列三种做法的语句数与耗时
+
+逐会话计数为改动前 get_sessions 的做法：先查会话，再为每个会话执行一次 COUNT。
+可用 BENCH_DB_LATENCY_MS 为每条语句增加模拟的数据库往返延迟，N+1 的代价随之按会话数放大。
+默认跳过，RUN_BENCHMARKS=True 时运行。
+"""
+import os
+import time
+import statistics
+
+import aiosqlite
+import pytest
+from sqlalchemy import event, func, insert, select
+
+from app import queries
+from app.database import SessionLocal, engine
+from app.models import Question, Session
+from app.persistence import persistence
+from conftest import benchmark
+
+pytestmark = benchmark
+
+QUESTIONS_PER_SESSION = int(os.getenv("BENCH_QUESTIONS_PER_SESSION", "5"))
+REPEAT = int(os.getenv("BENCH_REPEAT", "20"))
+DB_LATENCY_MS = float(os.getenv("BENCH_DB_LATENCY_MS", "0"))  # 模拟的数据库往返延迟
+USER_BASE = 9000
+
+
+async def seed_sessions(user_id: int, sessions: int):
+    """为用户写入 sessions 个活跃会话，每个会话 QUESTIONS_PER_SESSION 个问题，冗余计数与实际一致"""
+    session_rows, question_rows = [], []
+    for i in range(sessions):
+        session_id = await persistence.session_ids.next_id()
+        session_rows.append({
+            "id": session_id, "user_id": user_id, "title": f"会话 {i}",
+            "status": 1, "question_count": QUESTIONS_PER_SESSION
+        })
+        for j in range(QUESTIONS_PER_SESSION):
+            question_rows.append({
+                "id": await persistence.question_ids.next_id(), "user_id": user_id,
+                "session_id": session_id, "question": f"问题 {j}", "status": 1
+            })
+    # 预留主键使用独立事务，全部预留后再在一个事务中写入
+    async with SessionLocal() as db:
+        await db.execute(insert(Session), session_rows)
+        await db.execute(insert(Question), question_rows)
+        await db.commit()
+
+
+async def n_plus_one(db, user_id: int):
+    """改动前的做法：查出会话后逐个执行 COUNT"""
+    sessions = (await db.execute(
+        select(Session).where(
+            Session.user_id == user_id,
+            Session.status == 1
+        ).order_by(Session.update_time.desc())
+    )).scalars().all()
+    result = []
+    for session in sessions:
+        question_count = (await db.execute(
+            select(func.count(Question.id)).where(Question.session_id == session.id)
+        )).scalar_one()
+        result.append((session, question_count))
+    return result
+
+
+async def aggregated(db, user_id: int):
+    queries.USE_DENORMALIZED_QUESTION_COUNT = False
+    return await queries.get_user_sessions(db, user_id)
+
+
+async def denormalized(db, user_id: int):
+    queries.USE_DENORMALIZED_QUESTION_COUNT = True
+    return await queries.get_user_sessions(db, user_id)
+
+
+STRATEGIES = {"N+1": n_plus_one, "聚合": aggregated, "冗余列": denormalized}
+
+
+@pytest.fixture
+def db_latency(monkeypatch):
+    """在 aiosqlite 的连接线程中为每条语句增加固定延迟"""
+    if DB_LATENCY_MS > 0:
+        execute = aiosqlite.Connection._execute
+
+        def slow_execute(self, fn, *args, **kwargs):
+            def delayed():
+                time.sleep(DB_LATENCY_MS / 1000)
+                return fn(*args, **kwargs)
+            return execute(self, delayed)
+        monkeypatch.setattr(aiosqlite.Connection, "_execute", slow_execute)
+
+
+@pytest.mark.parametrize("sessions", [10, 100, 1000])
+def test_session_list_strategies(run, monkeypatch, db_latency, sessions):
+    monkeypatch.setattr(queries, "USE_DENORMALIZED_QUESTION_COUNT", queries.USE_DENORMALIZED_QUESTION_COUNT)
+    user_id = USER_BASE + sessions
+    statements = []
+
+    def count_statement(*args):
+        statements.append(1)
+
+    async def scenario():
+        await seed_sessions(user_id, sessions)
+        results = {}
+        async with SessionLocal() as db:
+            for name, strategy in STRATEGIES.items():
+                expected = await strategy(db, user_id)  # 预热
+                assert len(expected) == sessions
+                assert all(count == QUESTIONS_PER_SESSION for _, count in expected)
+                timings = []
+                statements.clear()
+                for _ in range(REPEAT):
+                    started = time.perf_counter()
+                    await strategy(db, user_id)
+                    timings.append((time.perf_counter() - started) * 1000)
+                results[name] = (len(statements) // REPEAT, statistics.median(timings))
+        return results
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count_statement)
+    try:
+        results = run(scenario())
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", count_statement)
+
+    print(f"\n{sessions} 个会话（每个 {QUESTIONS_PER_SESSION} 个问题，模拟延迟 {DB_LATENCY_MS:g} ms）：")
+    for name, (count, median_ms) in results.items():
+        print(f"  {name}: {count} 条语句，中位数 {median_ms:.2f} ms")
+    assert results["N+1"][0] == sessions + 1
+    assert results["聚合"][0] == 1
+    assert results["冗余列"][0] == 1
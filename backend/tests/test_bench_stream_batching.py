@@ -0,0 +1,87 @@
+"""
+流式合并基准测试 - 2000 个上游片段逐片段发送与合并发送时，线路字节数、SSE 事件数与 CPU 时间
+
+逐片段发送为改动前的行为（STREAM_FLUSH_BYTES=0、STREAM_FLUSH_INTERVAL=0）；
+合并发送使用默认的合并窗口，另测完成事件不附带全文（STREAM_COMPLETE_INCLUDE_ANSWER=False）。
+上游分两种节奏：每个片段间隔 BENCH_TOKEN_DELAY_MS，以及无间隔的突发输出。
+默认跳过，RUN_BENCHMARKS=True 时运行。
+"""
+import os
+import time
+import itertools
+from functools import partial
+
+import pytest
+
+from app import main, streaming
+from conftest import benchmark, open_stream
+
+pytestmark = benchmark
+
+TOKENS = int(os.getenv("BENCH_STREAM_TOKENS", "2000"))
+TOKEN_DELAY_MS = float(os.getenv("BENCH_TOKEN_DELAY_MS", "2"))
+# 中英文混合的片段，近似推理模型的输出粒度
+WORDS = ["你好", "，", " the", "流式", "回答", " token", "。", "测试", " stream", "\n"]
+CHUNKS = list(itertools.islice(itertools.cycle(WORDS), TOKENS))
+MODES = {
+    "逐片段": {"flush_interval": 0, "flush_bytes": 0, "include_answer": True},
+    "合并": {"flush_interval": streaming.STREAM_FLUSH_INTERVAL, "flush_bytes": streaming.STREAM_FLUSH_BYTES,
+             "include_answer": True},
+    "合并且不附全文": {"flush_interval": streaming.STREAM_FLUSH_INTERVAL, "flush_bytes": streaming.STREAM_FLUSH_BYTES,
+                    "include_answer": False},
+}
+_questions = itertools.count()
+
+
+class WireCounter:
+    """包装 ASGI 应用，统计响应体的字节数"""
+
+    def __init__(self, app):
+        self.app = app
+        self.bytes = 0
+
+    async def __call__(self, scope, receive, send):
+        async def counting_send(message):
+            if message["type"] == "http.response.body":
+                self.bytes += len(message.get("body", b""))
+            await send(message)
+        await self.app(scope, receive, counting_send)
+
+
+@pytest.mark.parametrize("delay_ms", [TOKEN_DELAY_MS, 0], ids=["paced", "burst"])
+def test_stream_batching(run, fake_llm, monkeypatch, delay_ms):
+    fake_llm.chunks = CHUNKS
+    fake_llm.delay = delay_ms / 1000
+    results = {}
+
+    async def stream(mode: dict):
+        monkeypatch.setattr(main, "relay_chunks", partial(
+            streaming.relay_chunks, flush_interval=mode["flush_interval"], flush_bytes=mode["flush_bytes"]
+        ))
+        monkeypatch.setattr(main, "STREAM_COMPLETE_INCLUDE_ANSWER", mode["include_answer"])
+        wire = WireCounter(main.app)
+        # 每次使用不同的问题，避免命中回答缓存
+        params = {"user_id": 9500, "question": f"合并基准问题 {next(_questions)}"}
+        cpu_started = time.process_time()
+        events = await open_stream(wire, "/api/questions/stream", params)
+        cpu_ms = (time.process_time() - cpu_started) * 1000
+        assert events[-1]["type"] == "complete"
+        text = "".join(event["data"]["chunk"] for event in events if event["type"] == "chunk")
+        assert text == "".join(CHUNKS)
+        return wire.bytes, len(events), cpu_ms
+
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app):
+            await stream(MODES["合并"])  # 预热
+            for name, mode in MODES.items():
+                results[name] = await stream(mode)
+
+    run(scenario())
+    print(f"\n{TOKENS} 个片段，上游间隔 {delay_ms:g} ms：")
+    for name, (wire_bytes, events, cpu_ms) in results.items():
+        print(f"  {name}: {wire_bytes / 1024:.1f} KB，{events} 个事件，CPU {cpu_ms:.0f} ms")
+
+    assert results["逐片段"][1] == TOKENS + 2  # 问题事件 + 每个片段一个事件 + 完成事件
+    assert results["合并"][1] < results["逐片段"][1] / 10
+    assert results["合并"][0] < results["逐片段"][0] / 2
+    assert results["合并且不附全文"][0] < results["合并"][0]
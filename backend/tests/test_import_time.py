@@ -0,0 +1,42 @@
+"""
+启动耗时回归测试 - 以 python -X importtime 测量导入 app.main 的累计耗时
+
+阈值由 IMPORT_TIME_BUDGET_MS 配置（毫秒），较慢的 CI 机器可调大
+"""
+import os
+import sys
+import subprocess
+
+from conftest import BACKEND_DIR
+
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "2500"))
+# 应在首次使用或迁移时才导入的重量级模块
+DEFERRED_MODULES = {"openai", "langchain", "langchain_openai", "alembic"}
+
+
+def import_times(module: str) -> dict:
+    """返回 {模块名: 累计导入耗时（微秒）}"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, env=os.environ, capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_app_import_within_budget():
+    times = import_times("app.main")
+    elapsed_ms = times["app.main"] / 1000
+    assert elapsed_ms <= IMPORT_TIME_BUDGET_MS, (
+        f"导入 app.main 耗时 {elapsed_ms:.0f}ms，超过阈值 {IMPORT_TIME_BUDGET_MS:.0f}ms"
+    )
+
+
+def test_heavy_modules_are_deferred():
+    assert not DEFERRED_MODULES & set(import_times("app.main"))
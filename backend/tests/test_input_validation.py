@@ -0,0 +1,75 @@
+"""
+输入校验测试 - 线性时间实现与原正则集合的等价性模糊测试，以及最坏输入的耗时上限
+
+随机输入条数由 VALIDATION_FUZZ_CASES 配置，单次校验的耗时上限由 VALIDATION_TIME_BUDGET_MS 配置（毫秒）
+"""
+import os
+import re
+import time
+import random
+
+import pytest
+
+from app.security import contains_dangerous_content, sanitize_output
+
+VALIDATION_FUZZ_CASES = int(os.getenv("VALIDATION_FUZZ_CASES", "50000"))
+VALIDATION_TIME_BUDGET_MS = float(os.getenv("VALIDATION_TIME_BUDGET_MS", "0.3"))
+
+# 改写前 validate_user_input 逐条匹配的正则
+LEGACY_PATTERNS = [
+    r'<script[^>]*>.*?</script>',
+    r'javascript:',
+    r'on\w+\s*=',
+    r'<iframe[^>]*>.*?</iframe>',
+    r'<object[^>]*>.*?</object>',
+    r'<embed[^>]*>.*?</embed>',
+]
+LEGACY_ESCAPES = {"&": "&amp;", '"': "&quot;", "'": "&#x27;", ">": "&gt;", "<": "&lt;"}
+
+# 由标签、事件属性、大小写折叠字符等片段随机拼接输入（ſ、K、İ 在 IGNORECASE 下与 ASCII 字母互相匹配）
+FRAGMENTS = [
+    "<script", "<SCRIPT", ">", "</script>", "</ScRiPt>", "<iframe", "</iframe>", "<object", "</object>",
+    "<embed", "</embed>", "on", "ON", "o", "n", "x", "=", "  ", " ", "\n", "javascript:", "JavaScript:",
+    "java", "script:", "<", "/", "a", "中", "ſ", "K", "İ", "_", "9", "&", "'", '"', "oN1", "click",
+]
+
+
+def legacy_contains_dangerous_content(text: str) -> bool:
+    return any(re.search(pattern, text, re.IGNORECASE | re.DOTALL) for pattern in LEGACY_PATTERNS)
+
+
+def legacy_sanitize_output(text: str) -> str:
+    for char, escape in LEGACY_ESCAPES.items():
+        text = text.replace(char, escape)
+    return text
+
+
+def test_matches_legacy_patterns():
+    rng = random.Random(23)
+    dangerous = 0
+    for _ in range(VALIDATION_FUZZ_CASES):
+        text = "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 25)))
+        expected = legacy_contains_dangerous_content(text)
+        assert contains_dangerous_content(text) == expected, repr(text)
+        assert sanitize_output(text) == legacy_sanitize_output(text), repr(text)
+        dangerous += expected
+    # 样本需同时覆盖两种结果
+    assert 0 < dangerous < VALIDATION_FUZZ_CASES
+
+
+@pytest.mark.parametrize("text", [
+    "onclick=alert(1)", "<SCRIPT src=x>a\n</script>", "<iframe>中</IFRAME>", "JAVASCRIPT:void(0)",
+    "<embed x></embed>", "<object>", "on =", "正常的客服问题，请问如何重置密码？", "error=401",
+])
+def test_known_inputs(text):
+    assert contains_dangerous_content(text) == legacy_contains_dangerous_content(text)
+
+
+@pytest.mark.parametrize("text", ["on" * 500, "<script>" * 125], ids=["on*500", "<script>*125"])
+def test_worst_case_time(text):
+    best = float("inf")
+    for _ in range(20):
+        started = time.perf_counter()
+        contains_dangerous_content(text)
+        best = min(best, time.perf_counter() - started)
+    assert best * 1000 <= VALIDATION_TIME_BUDGET_MS, f"{best * 1000:.3f}ms"
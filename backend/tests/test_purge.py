@@ -0,0 +1,54 @@
+"""
+数据清理测试 - 删除会话中途失败时，已提交的批次仍然生效，会话的历史版本随之递增
+"""
+import pytest
+from sqlalchemy import select, func
+
+from app import purge
+from app.database import SessionLocal
+from app.models import Question, Session
+from app.persistence import persistence
+
+USER_ID = 9900
+QUESTIONS = 3
+
+
+def test_failed_session_purge_bumps_history_version(run, monkeypatch):
+    delete_question_batch = purge.delete_question_batch
+    batches = 0
+
+    async def failing_batch(db, condition, batch_size=purge.PURGE_BATCH_SIZE):
+        # 第一批只删除一个问题并按满批返回，使清理继续；第二批失败
+        nonlocal batches
+        batches += 1
+        if batches > 1:
+            raise RuntimeError("数据库连接中断")
+        _, deleted_answers = await delete_question_batch(db, condition, 1)
+        return batch_size, deleted_answers
+
+    monkeypatch.setattr(purge, "delete_question_batch", failing_batch)
+
+    async def scenario():
+        async with SessionLocal() as db:
+            chat_session = await persistence.create_session(db, USER_ID, "清理测试")
+            for i in range(QUESTIONS):
+                await persistence.create_question(db, USER_ID, chat_session.id, f"问题 {i}")
+                await db.commit()
+            session_id = chat_session.id
+
+        async with SessionLocal() as db:
+            with pytest.raises(RuntimeError):
+                await purge.purge_session(db, session_id)
+
+        async with SessionLocal() as db:
+            version = (await db.execute(
+                select(Session.history_version).where(Session.id == session_id)
+            )).scalar_one()
+            remaining = (await db.execute(
+                select(func.count()).select_from(Question).where(Question.session_id == session_id)
+            )).scalar_one()
+        return version, remaining
+
+    version, remaining = run(scenario())
+    assert remaining == QUESTIONS - 1
+    assert version == 1
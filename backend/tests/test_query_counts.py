@@ -0,0 +1,85 @@
+"""
+SQL 语句数测试 - 历史记录与对话上下文的查询次数不随问答条数增长（无逐行回查）
+
+语句数取自 MetricsMiddleware 按路由记录的 db_queries_per_request（由 before_cursor_execute 计数）
+"""
+import itertools
+
+import pytest
+from prometheus_client import REGISTRY
+
+from app.context import context_store
+from app.metrics import METRICS_ENABLED
+
+pytestmark = pytest.mark.skipif(not METRICS_ENABLED, reason="需要 METRICS_ENABLED=True")
+
+_user_ids = itertools.count(7000)
+
+
+def queries_of(route: str, send) -> int:
+    """执行 send()，返回该请求在路由 route 上执行的 SQL 语句数"""
+    def total():
+        return REGISTRY.get_sample_value("db_queries_per_request_sum", {"route": route}) or 0
+    before = total()
+    response = send()
+    assert response.status_code == 200, response.text
+    return int(total() - before)
+
+
+def create_session(client, rounds: int):
+    """新建会话并写入 rounds 轮问答，返回 (用户ID, 会话ID)"""
+    user_id = next(_user_ids)
+    session_id = None
+    for i in range(rounds):
+        answer = client.post("/api/questions", json={
+            "user_id": user_id, "question": f"第 {i} 个问题", "session_id": session_id
+        }).json()
+        session_id = answer["session_id"]
+    return user_id, session_id
+
+
+@pytest.mark.parametrize("rounds", [1, 20])
+def test_history_query_count(client, rounds):
+    user_id, _ = create_session(client, rounds)
+    count = queries_of("/api/history/{user_id}", lambda: client.get(f"/api/history/{user_id}"))
+    assert count == 1
+
+
+@pytest.mark.parametrize("rounds", [1, 20])
+def test_session_history_query_count(client, rounds):
+    user_id, session_id = create_session(client, rounds)
+    count = queries_of(
+        "/api/sessions/{session_id}/history",
+        lambda: client.get(f"/api/sessions/{session_id}/history", params={"user_id": user_id})
+    )
+    # 会话归属校验 + 带回答的问题列表
+    assert count <= 2
+
+
+def context_queries(client, rounds: int, send) -> int:
+    """在已有 rounds 轮问答的会话上发送下一轮，上下文窗口不在内存中时需从数据库重建"""
+    user_id, session_id = create_session(client, rounds)
+    context_store.invalidate(session_id)
+    misses = context_store.misses
+    count = send(user_id, session_id)
+    assert context_store.misses == misses + 1
+    return count
+
+
+def ask(client, user_id, session_id):
+    return queries_of("/api/questions", lambda: client.post("/api/questions", json={
+        "user_id": user_id, "question": "新的问题", "session_id": session_id
+    }))
+
+
+def ask_stream(client, user_id, session_id):
+    return queries_of("/api/questions/stream", lambda: client.get("/api/questions/stream", params={
+        "user_id": user_id, "question": "新的问题", "session_id": session_id
+    }))
+
+
+@pytest.mark.parametrize("send", [ask, ask_stream], ids=["create_question", "create_question_stream"])
+def test_context_rebuild_query_count_is_constant(client, send):
+    few = context_queries(client, 1, lambda user_id, session_id: send(client, user_id, session_id))
+    many = context_queries(client, 20, lambda user_id, session_id: send(client, user_id, session_id))
+    assert few == many
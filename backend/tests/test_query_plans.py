@@ -0,0 +1,85 @@
+"""
+热点查询的执行计划测试 - 捕获查询函数实际执行的 SQL，在 SQLite 上用 EXPLAIN QUERY PLAN 断言命中的索引
+"""
+import sqlite3
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+from app.database import engine, SessionLocal, DATABASE_URL
+from app import queries
+from app.queries import (
+    get_user_questions, get_session_questions, get_recent_rounds, get_user_sessions, stream_user_history
+)
+
+
+def query_plans(run, query) -> list:
+    """执行 query(db)，返回其中每条 SELECT 语句的执行计划（detail 列表）"""
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    async def execute():
+        async with SessionLocal() as db:
+            await query(db)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        run(execute())
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", capture)
+    assert statements
+    with sqlite3.connect(DATABASE_URL[len("sqlite:///"):]) as conn:
+        return [
+            [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+            for statement, parameters in statements
+        ]
+
+
+def assert_uses(plan: list, *indexes: str):
+    text = "\n".join(plan)
+    for index in indexes:
+        assert f"USING INDEX {index}" in text or f"USING COVERING INDEX {index}" in text, text
+    # 排序由索引顺序满足，不在临时 B 树中排序
+    assert "USE TEMP B-TREE FOR ORDER BY" not in text, text
+
+
+def test_user_history_plan(run):
+    plan, = query_plans(run, lambda db: get_user_questions(db, 1, limit=20))
+    assert_uses(plan, "ix_questions_user_time", "uq_answers_question_id")
+
+
+def test_user_history_page_plan(run):
+    plan, = query_plans(run, lambda db: get_user_questions(db, 1, limit=20, before=(datetime.now(), 100)))
+    assert_uses(plan, "ix_questions_user_time", "uq_answers_question_id")
+
+
+def test_user_history_export_plan(run):
+    async def export(db):
+        async for _ in stream_user_history(db, 1):
+            pass
+    plan, = query_plans(run, export)
+    assert_uses(plan, "ix_questions_user_time", "uq_answers_question_id")
+
+
+def test_session_history_plan(run):
+    plan, = query_plans(run, lambda db: get_session_questions(db, 1, limit=20))
+    assert_uses(plan, "ix_questions_session_time", "uq_answers_question_id")
+
+
+def test_recent_rounds_plan(run):
+    plan, = query_plans(run, lambda db: get_recent_rounds(db, 1, 1))
+    assert_uses(plan, "ix_questions_user_session_time", "uq_answers_question_id")
+
+
+@pytest.mark.parametrize("denormalized", [False, True])
+def test_session_list_plan(run, monkeypatch, denormalized):
+    monkeypatch.setattr(queries, "USE_DENORMALIZED_QUESTION_COUNT", denormalized)
+    plan, = query_plans(run, lambda db: get_user_sessions(db, 1))
+    assert_uses(plan, "ix_sessions_user_status_updated")
+    if not denormalized:
+        # 按会话计数由 (user_id, session_id) 前缀的覆盖索引完成，不回表
+        assert "USING COVERING INDEX ix_questions_user_session_time" in "\n".join(plan)
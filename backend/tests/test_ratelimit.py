@@ -0,0 +1,85 @@
+"""
+限流存储测试 - Redis 令牌桶（Lua 脚本）与 slowapi 计数存储在多个 worker（共享同一存储的多个实例）之间的共享
+"""
+import asyncio
+
+import fakeredis
+import fakeredis.aioredis
+from limits import parse
+from limits.storage import RedisStorage
+from limits.strategies import FixedWindowRateLimiter
+
+from app.ratelimit import RedisBucketStore, SQLiteStorage, SQLiteBucketStore, TokenBucket
+
+USER_ID = 7
+
+
+def redis_bucket(server) -> RedisBucketStore:
+    return RedisBucketStore(client=fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+
+
+def test_redis_bucket_shared_between_workers():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        stores = [redis_bucket(server), redis_bucket(server)]
+        buckets = [TokenBucket(store, "user_requests", per_minute=60, burst=5) for store in stores]
+        waits = [await buckets[i % 2].acquire(USER_ID) for i in range(6)]
+        for store in stores:
+            await store.close()
+        return waits
+
+    waits = asyncio.run(scenario())
+    # 两个 worker 合计只放行桶容量个请求，第 6 个需要等待约 1 个令牌的补充时间（每秒 1 个）
+    assert waits[:5] == [0.0] * 5
+    assert 0 < waits[5] <= 1.0
+
+
+def test_redis_bucket_charge_overdraws_budget():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        budget = TokenBucket(redis_bucket(server), "llm_tokens", per_minute=600, burst=100)
+        before = await budget.check_balance(USER_ID)
+        await budget.charge(USER_ID, 150)
+        after = await TokenBucket(redis_bucket(server), "llm_tokens", per_minute=600, burst=100).check_balance(USER_ID)
+        return before, after, budget.errors
+
+    before, after, errors = asyncio.run(scenario())
+    assert before == 0.0
+    # 透支 50 个 token 后需等待补回 51 个（每秒 10 个）
+    assert 5.0 < after <= 5.1
+    assert errors == 0
+
+
+def test_redis_bucket_matches_sqlite_bucket(tmp_path):
+    async def drain(store):
+        bucket = TokenBucket(store, "user_requests", per_minute=60, burst=3)
+        return [await bucket.acquire(USER_ID) > 0 for _ in range(5)]
+
+    redis_result = asyncio.run(drain(redis_bucket(fakeredis.FakeServer())))
+    sqlite_result = asyncio.run(drain(SQLiteBucketStore(str(tmp_path / "buckets.db"))))
+    assert redis_result == sqlite_result == [False, False, False, True, True]
+
+
+def shared_limit_hits(storages, limit: str, attempts: int):
+    """轮流在各 worker 的存储上计数，返回被放行的次数"""
+    item = parse(limit)
+    limiters = [FixedWindowRateLimiter(storage) for storage in storages]
+    return sum(limiters[i % len(limiters)].hit(item, "127.0.0.1") for i in range(attempts))
+
+
+def test_slowapi_redis_storage_shared_between_workers():
+    server = fakeredis.FakeServer()
+    storages = [
+        RedisStorage(
+            "redis://localhost:6379/1",
+            connection_pool=fakeredis.FakeRedis(server=server).connection_pool
+        )
+        for _ in range(2)
+    ]
+    assert shared_limit_hits(storages, "5/minute", 12) == 5
+
+
+def test_slowapi_sqlite_storage_shared_between_workers(tmp_path):
+    uri = f"sqlite:///{tmp_path / 'ratelimit.db'}"
+    storages = [SQLiteStorage(uri), SQLiteStorage(uri)]
+    assert shared_limit_hits(storages, "5/minute", 12) == 5
@@ -0,0 +1,91 @@
+"""
+可恢复流测试 - 两个 worker（两个共享同一 Redis 的存储实例）之间的续传与停止生成，以及多 worker 的配置降级
+"""
+import os
+import asyncio
+
+import fakeredis
+import fakeredis.aioredis
+
+import start
+from app.resumable import RedisReplayStore, ResumableStreams, parse_event_id
+
+STREAM_ID = 42
+USER_ID = 7
+
+
+class ConnectedRequest:
+    """始终保持连接的请求"""
+
+    async def is_disconnected(self) -> bool:
+        return False
+
+
+def two_workers():
+    server = fakeredis.FakeServer()
+    return [
+        ResumableStreams(RedisReplayStore(
+            client=fakeredis.aioredis.FakeRedis(server=server, decode_responses=True), poll_interval=0.01
+        ))
+        for _ in range(2)
+    ]
+
+
+def test_resume_on_other_worker():
+    async def scenario():
+        owner, other = two_workers()
+        writer = await owner.start(STREAM_ID, USER_ID)
+        for i in range(3):
+            await writer.emit({"type": "chunk", "data": {"chunk": str(i)}})
+        await writer.close()
+        assert await other.owner(STREAM_ID) == USER_ID
+        return [event async for event in other.subscribe(ConnectedRequest(), STREAM_ID, after_seq=1)]
+
+    events = asyncio.run(scenario())
+    assert [parse_event_id(event.split("\n")[0][len("id: "):]) for event in events] == [(STREAM_ID, 2), (STREAM_ID, 3)]
+
+
+def test_cancel_reaches_generating_worker():
+    async def scenario():
+        owner, other = two_workers()
+        await owner.start(STREAM_ID, USER_ID)
+        # 生成任务所在 worker 的连接检查：有订阅者时不视为断开
+        watch = owner.watch(STREAM_ID)
+        await owner.store.attach(STREAM_ID)
+        assert not await watch.is_disconnected()
+
+        await other.cancel(STREAM_ID, 5)
+        watch._next_check = 0.0
+        return await watch.is_disconnected(), await owner.delivered_seq(STREAM_ID)
+
+    disconnected, seen_seq = asyncio.run(scenario())
+    # 仍有订阅者、未到宽限期，但已被其他 worker 停止
+    assert disconnected
+    assert seen_seq == 5
+
+
+def test_cancel_on_generating_worker_cancels_task():
+    async def scenario():
+        owner, _ = two_workers()
+        await owner.start(STREAM_ID, USER_ID)
+        task = asyncio.ensure_future(asyncio.sleep(60))
+        owner.track(STREAM_ID, task)
+        await owner.cancel(STREAM_ID, 3)
+        await asyncio.gather(task, return_exceptions=True)
+        return task.cancelled()
+
+    assert asyncio.run(scenario())
+
+
+def test_multi_worker_memory_replay_disables_resume(worker_env):
+    worker_env.setenv("STREAM_RESUME_ENABLED", "True")
+    worker_env.setenv("STREAM_REPLAY_BACKEND", "memory")
+    start.prepare_workers(4)
+    assert os.environ["STREAM_RESUME_ENABLED"] == "False"
+
+
+def test_multi_worker_redis_replay_keeps_resume(worker_env):
+    worker_env.setenv("STREAM_RESUME_ENABLED", "True")
+    worker_env.setenv("STREAM_REPLAY_BACKEND", "redis")
+    start.prepare_workers(4)
+    assert os.environ["STREAM_RESUME_ENABLED"] == "True"
@@ -0,0 +1,95 @@
+"""
+语义缓存索引落盘测试 - 多个 worker 共用索引文件时合并写入，等待文件锁与读写文件不阻塞事件循环
+"""
+import asyncio
+import threading
+
+from app import semantic_cache as semantic_cache_module
+from app.semantic_cache import FileLock, SemanticCache
+
+QUESTIONS = ["如何修改密码", "怎么申请退款", "订单什么时候发货", "发票如何开具"]
+
+
+def make_cache(path) -> SemanticCache:
+    return SemanticCache(enabled=True, path=str(path), dim=256)
+
+
+def test_workers_merge_entries_on_save(tmp_path):
+    path = tmp_path / "index"
+
+    async def scenario():
+        first, second = make_cache(path), make_cache(path)
+        first.add(1, QUESTIONS[0])
+        first.add(2, QUESTIONS[1])
+        second.add(3, QUESTIONS[2])
+        await first.save()
+        await second.save()
+        # 第二个 worker 落盘时合并了第一个 worker 的条目
+        assert len(second.index) == 3
+        second.add(4, QUESTIONS[3])
+        await second.close()
+        await first.save()
+        reloaded = make_cache(path)
+        assert reloaded.index.load(reloaded.path)
+        return first, reloaded
+
+    first, reloaded = asyncio.run(scenario())
+    assert sorted(reloaded.index.snapshot()[1].tolist()) == [1, 2, 3, 4]
+    assert len(first.index) == 4
+    assert first._unsaved == 0
+
+
+def test_save_waits_for_lock_off_the_event_loop(tmp_path):
+    path = tmp_path / "index"
+    lock = FileLock(str(path))
+    lock.acquire()
+
+    async def scenario():
+        cache = make_cache(path)
+        cache.add(1, QUESTIONS[0])
+        save = asyncio.create_task(cache.save())
+        # 其他 worker 持有文件锁期间事件循环照常运行
+        ticks = 0
+        for _ in range(10):
+            await asyncio.sleep(0.01)
+            ticks += 1
+        assert not save.done()
+        await asyncio.to_thread(lock.release)
+        await save
+        return ticks, cache
+
+    try:
+        ticks, cache = asyncio.run(scenario())
+    finally:
+        lock.release()
+    assert ticks == 10
+    assert cache._unsaved == 0
+
+
+def test_add_coalesces_background_saves(tmp_path, monkeypatch):
+    monkeypatch.setattr(semantic_cache_module, "SEMANTIC_CACHE_SAVE_EVERY", 1)
+    path = tmp_path / "index"
+    saves = 0
+    merge_write = SemanticCache._merge_write
+
+    def counting_merge_write(self, snapshot):
+        nonlocal saves
+        saves += 1
+        return merge_write(self, snapshot)
+
+    monkeypatch.setattr(SemanticCache, "_merge_write", counting_merge_write)
+
+    async def scenario():
+        cache = make_cache(path)
+        for i, question in enumerate(QUESTIONS * 5):
+            cache.add(i + 1, question)
+        await cache.close()
+        return cache
+
+    cache = asyncio.run(scenario())
+    reloaded = make_cache(path)
+    assert reloaded.index.load(reloaded.path)
+    assert len(reloaded.index) == len(QUESTIONS) * 5
+    # 落盘任务运行前追加的条目合并到同一次落盘中
+    assert saves == 1
+    assert cache._unsaved == 0
@@ -0,0 +1,101 @@
+"""
+请求合并测试 - 500 个相同的并发请求只触发一次上游调用，以及上游取消期间到达的新请求
+"""
+import asyncio
+
+from app.singleflight import SingleFlight, prompt_key
+
+CONCURRENT = 500
+CHUNKS = ["相同", "问题", "的", "回答"]
+
+
+class CountingLLM:
+    """计数的假 LLM：记录上游调用次数"""
+
+    def __init__(self, delay: float = 0.01):
+        self.delay = delay
+        self.calls = 0
+
+    async def stream(self):
+        self.calls += 1
+        for chunk in CHUNKS:
+            await asyncio.sleep(self.delay)
+            yield chunk
+
+    async def invoke(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay * len(CHUNKS))
+        return "".join(CHUNKS)
+
+
+async def collect(chunks) -> str:
+    return "".join([chunk async for chunk in chunks])
+
+
+def test_concurrent_streams_share_one_upstream_call():
+    llm = CountingLLM()
+    flight = SingleFlight()
+    key = prompt_key("相同的提示词")
+
+    async def scenario():
+        return await asyncio.gather(*(
+            collect(flight.stream(key, llm.stream)) for _ in range(CONCURRENT)
+        ))
+
+    answers = asyncio.run(scenario())
+    assert llm.calls == 1
+    assert answers == ["".join(CHUNKS)] * CONCURRENT
+    assert (flight.leaders, flight.followers) == (1, CONCURRENT - 1)
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    llm = CountingLLM()
+    flight = SingleFlight()
+    key = prompt_key("相同的提示词")
+
+    async def scenario():
+        return await asyncio.gather(*(
+            flight.call(key, llm.invoke) for _ in range(CONCURRENT)
+        ))
+
+    answers = asyncio.run(scenario())
+    assert llm.calls == 1
+    assert answers == ["".join(CHUNKS)] * CONCURRENT
+    assert (flight.leaders, flight.followers) == (1, CONCURRENT - 1)
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_joiner_after_last_subscriber_left_starts_new_upstream():
+    """最后一个订阅者离开后、上游取消生效前加入的请求不应收到 CancelledError"""
+    llm = CountingLLM()
+    flight = SingleFlight()
+    key = prompt_key("相同的提示词")
+
+    async def scenario():
+        first = flight.stream(key, llm.stream)
+        assert await first.__anext__() == CHUNKS[0]
+        # 最后一个订阅者离开：上游任务已请求取消，但仍登记在合并表中
+        await first.aclose()
+        return await collect(flight.stream(key, llm.stream))
+
+    assert asyncio.run(scenario()) == "".join(CHUNKS)
+    assert llm.calls == 2
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_waiter_cancellation_keeps_shared_stream_running():
+    """部分订阅者离开时上游继续，其余订阅者收到完整回答"""
+    llm = CountingLLM()
+    flight = SingleFlight()
+    key = prompt_key("相同的提示词")
+
+    async def scenario():
+        leaving = asyncio.ensure_future(collect(flight.stream(key, llm.stream)))
+        staying = [collect(flight.stream(key, llm.stream)) for _ in range(CONCURRENT - 1)]
+        await asyncio.sleep(llm.delay * 1.5)
+        leaving.cancel()
+        return await asyncio.gather(*staying)
+
+    assert asyncio.run(scenario()) == ["".join(CHUNKS)] * (CONCURRENT - 1)
+    assert llm.calls == 1
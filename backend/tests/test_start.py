@@ -0,0 +1,41 @@
+"""
+启动脚本测试 - 多 worker 部署时进程内后端的降级与提示，以及与 worker 共用的服务进程配置
+"""
+import os
+
+import start
+from app import config, worker
+
+
+def test_multi_worker_memory_rate_limit_uses_shared_sqlite(worker_env):
+    worker_env.setenv("RATE_LIMIT_STORAGE_URI", "memory://")
+    start.prepare_workers(4)
+    uri = os.environ["RATE_LIMIT_STORAGE_URI"]
+    assert uri.startswith("sqlite:///")
+    from app.ratelimit import sqlite_path
+    assert os.path.isabs(sqlite_path(uri))
+
+
+def test_multi_worker_keeps_configured_rate_limit_storage(worker_env):
+    worker_env.setenv("RATE_LIMIT_STORAGE_URI", "redis://localhost:6379/1")
+    start.prepare_workers(4)
+    assert os.environ["RATE_LIMIT_STORAGE_URI"] == "redis://localhost:6379/1"
+
+
+def test_single_worker_keeps_memory_backends(worker_env):
+    worker_env.setenv("RATE_LIMIT_STORAGE_URI", "memory://")
+    start.prepare_workers(1)
+    assert os.environ["RATE_LIMIT_STORAGE_URI"] == "memory://"
+
+
+def test_multi_worker_warns_about_memory_answer_cache(worker_env, capsys):
+    worker_env.setenv("ANSWER_CACHE_ENABLED", "True")
+    worker_env.setenv("ANSWER_CACHE_BACKEND", "memory")
+    start.prepare_workers(4)
+    assert "ANSWER_CACHE_BACKEND" in capsys.readouterr().out
+
+
+def test_worker_shares_server_settings_with_start():
+    assert start.UVICORN_LOOP is config.UVICORN_LOOP is worker.UVICORN_LOOP
+    assert start.UVICORN_HTTP is config.UVICORN_HTTP is worker.UVICORN_HTTP
+    assert start.GRACEFUL_TIMEOUT == worker.GRACEFUL_TIMEOUT == config.GRACEFUL_TIMEOUT
@@ -0,0 +1,89 @@
+"""
+流式回答中断测试 - 客户端断开与用户停止生成时取消上游调用，并保存已生成的部分回答
+"""
+import asyncio
+
+import httpx
+from sqlalchemy import select
+
+from app import main
+from app.database import SessionLocal
+from app.models import Question, Answer
+from app.resumable import SubscriberWatch
+from conftest import open_stream
+
+CHUNKS = [f"第{i}段" for i in range(40)]
+FULL_ANSWER = "".join(CHUNKS)
+USER_ID = 7000
+
+
+def slow_llm(fake_llm):
+    fake_llm.chunks = CHUNKS
+    fake_llm.delay = 0.05
+    return fake_llm
+
+
+async def load_result(question_id: int):
+    async with SessionLocal() as db:
+        question = (await db.execute(select(Question).where(Question.id == question_id))).scalar_one()
+        answer = (await db.execute(
+            select(Answer.answer).where(Answer.question_id == question_id)
+        )).scalar_one()
+    return question.status, answer
+
+
+def assert_partial(status: int, answer: str):
+    assert status == main.QUESTION_INTERRUPTED
+    assert answer and len(answer) < len(FULL_ANSWER)
+    assert FULL_ANSWER.startswith(answer)
+
+
+def test_disconnect_cancels_upstream_and_saves_partial(run, fake_llm, monkeypatch):
+    llm = slow_llm(fake_llm)
+    # 不等待续传，并缩短检查间隔：所有客户端断开后下一次检查即取消上游
+    streams = main.resumable_streams
+    monkeypatch.setattr(streams, "watch", lambda stream_id: SubscriberWatch(streams.store, stream_id, 0.0, 0.05))
+
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app):
+            events = await open_stream(
+                main.app, "/api/questions/stream", {"user_id": USER_ID, "question": "断开连接的问题"},
+                disconnect_after=3
+            )
+        # 应用关闭时等待生成任务发现断开、保存部分回答后结束
+        return events, await load_result(events[0]["data"]["id"])
+
+    events, (status, answer) = run(scenario())
+    assert all(event["type"] != "complete" for event in events)
+    assert llm.cancelled == 1
+    assert_partial(status, answer)
+
+
+def test_delete_cancels_upstream_and_saves_delivered_part(run, fake_llm):
+    llm = slow_llm(fake_llm)
+
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app):
+            events = []
+            stream = asyncio.create_task(open_stream(
+                main.app, "/api/questions/stream", {"user_id": USER_ID + 1, "question": "停止生成的问题"},
+                events=events
+            ))
+            while len(events) < 3:
+                await asyncio.sleep(0.01)
+            question_id = events[0]["data"]["id"]
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+                response = await client.delete(
+                    f"/api/questions/{question_id}/stream", params={"user_id": USER_ID + 1, "seq": 3}
+                )
+            await asyncio.wait_for(stream, timeout=5)
+        return response, events, await load_result(question_id)
+
+    response, events, (status, answer) = run(scenario())
+    assert response.status_code == 200
+    assert all(event["type"] != "complete" for event in events)
+    assert llm.cancelled == 1
+    assert_partial(status, answer)
+    # 只保存客户端已收到的片段（序号 1 为问题事件）
+    assert answer == "".join(event["data"]["chunk"] for event in events[1:3])
@@ -0,0 +1,82 @@
+"""
+流式接口的连接占用测试 - 连接只在准备和保存阶段持有，200 路并发流在 10 个连接的池上全部完成
+"""
+import asyncio
+
+from sqlalchemy import event, select, func
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app import main
+from app.database import ASYNC_DATABASE_URL, SessionLocal, TimedQueuePool
+from app.models import Answer
+from conftest import open_stream
+
+STREAMS = 200
+POOL_SIZE = 10
+
+
+class PoolUsage:
+    """统计连接池同时借出的连接数"""
+
+    def __init__(self, pool):
+        self.checked_out = 0
+        self.peak = 0
+        event.listen(pool, "checkout", self._checkout)
+        event.listen(pool, "checkin", self._checkin)
+
+    def _checkout(self, *args):
+        self.checked_out += 1
+        self.peak = max(self.peak, self.checked_out)
+
+    def _checkin(self, *args):
+        self.checked_out -= 1
+
+
+def test_concurrent_streams_share_small_pool(run, monkeypatch):
+    capped = create_async_engine(
+        ASYNC_DATABASE_URL, poolclass=TimedQueuePool, pool_size=POOL_SIZE, max_overflow=0,
+        pool_timeout=10, connect_args={"check_same_thread": False}
+    )
+    usage = PoolUsage(capped.sync_engine.pool)
+    SessionLocal.configure(bind=capped)
+    in_flight = 0
+    peak_in_flight = 0
+
+    async def fake_stream_answer(prompt: str):
+        nonlocal in_flight, peak_in_flight
+        in_flight += 1
+        peak_in_flight = max(peak_in_flight, in_flight)
+        try:
+            for word in ("流式", "回答", "片段"):
+                await asyncio.sleep(0.2)
+                yield word
+        finally:
+            in_flight -= 1
+
+    monkeypatch.setattr(main, "stream_answer", fake_stream_answer)
+
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app):
+            results = await asyncio.gather(*(
+                open_stream(main.app, "/api/questions/stream", {"user_id": 5000 + i, "question": f"并发问题 {i}"})
+                for i in range(STREAMS)
+            ))
+            # 完成事件在回答保存之后发送，批量写入模式下等待队列落库
+            await main.persistence.flush()
+            async with SessionLocal() as db:
+                saved = (await db.execute(select(func.count()).select_from(Answer).where(
+                    Answer.answer == "流式回答片段"
+                ))).scalar_one()
+        return results, saved
+
+    try:
+        results, saved = run(scenario())
+    finally:
+        SessionLocal.configure(bind=main.engine)
+        asyncio.run(capped.dispose())
+
+    assert all(events[-1]["type"] == "complete" for events in results)
+    assert saved >= STREAMS
+    # 生成阶段不持有连接：同时进行的流远多于连接数；准备和保存阶段把池用满，但借出的连接从未超过池大小
+    assert peak_in_flight > POOL_SIZE * 5
+    assert usage.peak == POOL_SIZE
@@ -0,0 +1,64 @@
+"""
+LLM token 预算计费测试 - 相同提示词的并发请求合并为一次上游调用时，只由发起调用的请求扣减一次预算
+"""
+import asyncio
+
+import httpx
+
+from app import main
+from conftest import open_stream
+
+CONCURRENT = 20
+USER_ID = 6000
+
+
+def record_charges(monkeypatch) -> list:
+    charges = []
+
+    async def charge(key, cost):
+        charges.append((key, cost))
+
+    monkeypatch.setattr(main.llm_token_budget, "charge", charge)
+    return charges
+
+
+def test_stream_followers_are_not_charged(run, fake_llm, monkeypatch):
+    fake_llm.delay = 0.2
+    charges = record_charges(monkeypatch)
+    followers = main.single_flight.followers
+
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app):
+            results = await asyncio.gather(*(
+                open_stream(main.app, "/api/questions/stream", {"user_id": USER_ID + i, "question": "流式计费问题"})
+                for i in range(CONCURRENT)
+            ))
+        return results
+
+    results = run(scenario())
+    assert all(events[-1]["type"] == "complete" for events in results)
+    assert main.single_flight.followers > followers
+    # 每次上游调用扣减一次，共享结果的请求不计费
+    assert len(fake_llm.prompts) < CONCURRENT
+    assert len(charges) == len(fake_llm.prompts)
+
+
+def test_call_followers_are_not_charged(run, fake_llm, monkeypatch):
+    fake_llm.delay = 0.2
+    charges = record_charges(monkeypatch)
+    followers = main.single_flight.followers
+
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+                return await asyncio.gather(*(
+                    client.post("/api/questions", json={"user_id": USER_ID + i, "question": "非流式计费问题"})
+                    for i in range(CONCURRENT)
+                ))
+
+    responses = run(scenario())
+    assert all(response.status_code == 200 for response in responses)
+    assert main.single_flight.followers > followers
+    assert len(fake_llm.prompts) < CONCURRENT
+    assert len(charges) == len(fake_llm.prompts)
@@ -3,52 +3,6 @@
 -- 创建数据库（如果不存在）
 CREATE DATABASE IF NOT EXISTS chatbot CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
 
--- 使用数据库
-USE chatbot;
-
--- 创建用户表
-CREATE TABLE IF NOT EXISTS users (
-    id INT AUTO_INCREMENT PRIMARY KEY,
-    username VARCHAR(50) UNIQUE NOT NULL,
-    email VARCHAR(100) UNIQUE,
-    password_hash VARCHAR(255),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
-);
-
--- 创建会话表
-CREATE TABLE IF NOT EXISTS sessions (
-    id INT AUTO_INCREMENT PRIMARY KEY,
-    user_id INT NOT NULL,
-    title VARCHAR(200),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-);
-
--- 创建消息表
-CREATE TABLE IF NOT EXISTS messages (
-    id INT AUTO_INCREMENT PRIMARY KEY,
-    session_id INT NOT NULL,
-    user_id INT NOT NULL,
-    question TEXT NOT NULL,
-    answer TEXT,
-    user_type ENUM('user', 'assistant') DEFAULT 'user',
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (session_id) REFERENCES sessions(id) ON DELETE CASCADE,
-    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-);
-
--- 创建索引以提高查询性能
-CREATE INDEX idx_sessions_user_id ON sessions(user_id);
-CREATE INDEX idx_messages_session_id ON messages(session_id);
-CREATE INDEX idx_messages_user_id ON messages(user_id);
-CREATE INDEX idx_messages_created_at ON messages(created_at);
-
--- 插入默认用户（可选）
-INSERT IGNORE INTO users (id, username, email) VALUES (1, 'default_user', 'user@example.com');
-
--- 插入默认会话（可选）
-INSERT IGNORE INTO sessions (id, user_id, title) VALUES (1, 1, '默认会话');
-
-COMMIT;
\ No newline at end of file
+-- 表结构由 Alembic 迁移管理（backend/migrations），不在此处建表：
+-- 后端启动时自动升级到最新版本（DB_AUTO_MIGRATE=True），
+-- 或在 backend 目录手动执行 python -m alembic upgrade head